@@ -1,10 +1,36 @@
 """Personal finance accounting package"""
 from ambiguity.statement_date import StatementDate
-from ambiguity.account_manager import AccountManager
 
 __all__ = [
     "account_manager",
+    "benchmark",
     "command_line",
+    "conditions",
     "credential_providers",
+    "daemon",
+    "downloads",
+    "export",
+    "fetch",
+    "journal",
+    "library_index",
+    "parsers",
+    "planner",
+    "registry",
+    "replay",
     "scd",
-    "statement_date"]
+    "scheduler",
+    "standin",
+    "standin_sites",
+    "statement_date",
+    "status",
+    "tracing"]
+
+
+def __getattr__(name):
+    """Import AccountManager on first use, keeping the package quick to
+    import for commands that don't need it"""
+    if name == "AccountManager":
+        from ambiguity.account_manager import AccountManager
+        return AccountManager
+    raise AttributeError("module {!r} has no attribute {!r}".format(
+        __name__, name))
@@ -1,9 +1,28 @@
-"""Account classes for ambiguity"""
-from ambiguity.account.account import Account
-from ambiguity.account.boa import BoA, BoAVisa
-from ambiguity.account.mitfcu import MITFCU
-from ambiguity.account.mitfcu_visa import MITFCUVisa
-from ambiguity.account.usbank_visa import USBankVisa
+"""Account classes for ambiguity. An institution's module is only imported
+once one of its accounts is created, see ACCOUNT_TYPES"""
+import importlib
+
+from ambiguity.account.account import Account, LoginSession
+from ambiguity.registry import Registry
+
+# acct_type in the settings: account class. Packages can add types with
+# entry points in the ambiguity.account_types group
+ACCOUNT_TYPES = Registry("ambiguity.account_types", {
+    "MITFCU": "ambiguity.account.mitfcu:MITFCU",
+    "MITFCU_Visa": "ambiguity.account.mitfcu_visa:MITFCUVisa",
+    "BoA": "ambiguity.account.boa:BoA",
+    "BoAVisa": "ambiguity.account.boa:BoAVisa",
+    "USBankVisa": "ambiguity.account.usbank_visa:USBankVisa",
+})
+
+# Modules of the account classes, imported as they are accessed
+CLASS_MODULES = {
+    "MITFCU": "mitfcu",
+    "MITFCUVisa": "mitfcu_visa",
+    "BoA": "boa",
+    "BoAVisa": "boa",
+    "USBankVisa": "usbank_visa",
+}
 
 __all__ = [
     "account",
@@ -11,3 +30,13 @@ __all__ = [
     "mitfcu",
     "mitfcu_visa",
     "usbank_visa"]
+
+
+def __getattr__(name):
+    """Import an account class on first access"""
+    if name in CLASS_MODULES:
+        module = importlib.import_module(
+            "ambiguity.account." + CLASS_MODULES[name])
+        return getattr(module, name)
+    raise AttributeError("module {!r} has no attribute {!r}".format(
+        __name__, name))
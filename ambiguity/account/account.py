@@ -4,10 +4,12 @@ import abc
 from collections import defaultdict
 import datetime
 import logging
-import re
 
 from ambiguity import StatementDate
 from ambiguity import account
+from ambiguity import planner
+from ambiguity import tracing
+from ambiguity.library_index import FilingError, LibraryIndex
 
 LOG = logging.getLogger(__name__)
 
@@ -17,6 +19,15 @@ class Account(metaclass=abc.ABCMeta):
 
     # pylint: disable=too-many-instance-attributes
     PULL_FMTS = set()
+    # Accounts of the same institution and cred_name share a login session
+    INSTITUTION = None
+    LOGOUT_URL = None
+    # Overrides of SimpleChromeDriver.DEFAULT_TIMEOUTS for this site
+    TIMEOUTS = dict()
+    # TransactionStore that filed statements are added to, if any
+    store = None
+    # PullJournal recording the progress of pulls, if any
+    journal = None
 
     # pylint: disable=too-many-arguments
     def __init__(self, name, open_date, lib_dir, statement_day=1, active=True,
@@ -36,31 +47,70 @@ class Account(metaclass=abc.ABCMeta):
                     self.ignore[sd] = self.PULL_FMTS.copy()
                 else:
                     self.ignore[sd] = set(fmts)
+        self.ignore_masks = planner.format_masks(self.ignore)
         LOG.info("Loaded account %s, %d statements found", name,
                  len(self.library))
 
     def build_library(self):
-        """Scan the library folder and add matching files to library"""
-        self.library = defaultdict(set)
-        self.lib_dir.mkdir(parents=True, exist_ok=True)
-        file_name_re = re.compile(self.name + r"_([0-9]{4})_([0-9]{2})\.(\w+)")
-        for fmt_dir in self.lib_dir.iterdir():
-            if not fmt_dir.is_dir():
-                continue
-            for file in fmt_dir.iterdir():
-                match = file_name_re.match(file.name)
-                if match and match.group(3) == fmt_dir.name:
-                    sd = StatementDate(match.group(1), match.group(2))
-                    self.library[sd].add(fmt_dir.name)
-
-    def file_statement(self, src_path, sd, fmt):
-        """File a statement into the library"""
-        fname = "{}_{}_{}.{}".format(
+        """Load the library index, rescanning folders that have changed"""
+        self.index = LibraryIndex(self.lib_dir, self.name)
+        self.library = self.index.load()
+        self.coverage = planner.format_masks(self.library)
+
+    def statement_path(self, sd, fmt):
+        """Return the path of a statement in the library"""
+        return self.lib_dir / fmt / "{}_{}_{}.{}".format(
             self.name, sd.year, str(sd.month).zfill(2), fmt)
-        (self.lib_dir / fmt).mkdir(exist_ok=True)
-        dest_path = self.lib_dir / fmt / fname
-        src_path.rename(dest_path)
+
+    def file_statement(self, src_path, sd, fmt, allow_empty=False):
+        """File a downloaded statement into the library atomically, raising
+        FilingError if it doesn't look like a statement of the format. Only
+        a statement known to have no transactions may be empty"""
+        dest_path = self.statement_path(sd, fmt)
+        dest_path.parent.mkdir(exist_ok=True)
+        with tracing.span("file_statement", sd=sd, fmt=fmt):
+            staged = self.index.stage(src_path, dest_path, allow_empty)
+            if self.journal is not None:
+                self.journal.record(self.name, sd, fmt, "downloaded", staged)
+            self.file_staged(sd, fmt, staged)
+
+    def file_staged(self, sd, fmt, staged, verify=False):
+        """File a StagedFile into the library, see LibraryIndex.commit"""
+        dest_path = self.statement_path(sd, fmt)
+        dest_path.parent.mkdir(exist_ok=True)
+        self.index.commit(staged, dest_path, verify)
+        if self.journal is not None:
+            self.journal.record(self.name, sd, fmt, "filed")
         self.library[sd].add(fmt)
+        self.coverage[fmt] = self.coverage.get(fmt, 0) | planner.bit(sd)
+        if self.store is not None:
+            try:
+                self.store.add_filed(self, sd, fmt)
+            except Exception:  # pylint: disable=broad-except
+                # The statement is filed, the next sync of the store adds it
+                LOG.exception("%s %s: Could not store the %s statement",
+                              self.name, sd, fmt)
+
+    def fetch_statements(self, scd, urls):
+        """Fetch statements given as {(sd, fmt): url} straight over HTTP with
+        the browser's session cookies and file them into the library"""
+        keys = list(urls)
+        jobs = [(urls[sd, fmt], scd.download_dir / "{}_{}.{}".format(
+            self.name, sd, fmt)) for sd, fmt in keys]
+        with tracing.span("fetch", statements=len(jobs)):
+            results = scd.fetcher().fetch_all(jobs)
+        for (sd, fmt), result in zip(keys, results):
+            if isinstance(result, Exception):
+                LOG.warning("%s %s: %s", self.name, sd, result)
+                self.log_failed_pull(sd, fmt)
+            else:
+                try:
+                    self.file_statement(result, sd, fmt)
+                except FilingError as ex:
+                    LOG.warning("%s %s: %s", self.name, sd, ex)
+                    self.log_failed_pull(sd, fmt)
+                    continue
+                self.log_successful_pull(sd, fmt)
 
     def has_statement(self, sd, fmt):
         """Return whether a statement exists in the library"""
@@ -77,69 +127,145 @@ class Account(metaclass=abc.ABCMeta):
             cur_sd = StatementDate.from_ym(ym)
             yield cur_sd
 
+    def missing_masks(self, today=None):
+        """Return the missing statements in the library, excluding ignores,
+        as {format: mask} with a bit set for the ym of each missing one"""
+        if not self.active:
+            return dict()
+        expected = planner.expected_mask(self.open_date, self.statement_day,
+                                         today)
+        missing = dict()
+        for fmt in self.PULL_FMTS:
+            mask = (expected & ~self.coverage.get(fmt, 0) &
+                    ~self.ignore_masks.get(fmt, 0))
+            if mask:
+                missing[fmt] = mask
+        return missing
+
     @property
     def missing_statements(self):
         """Return all missing statements in the library, excluding ignores"""
-        if not self.active:
-            return dict()
-        missing_statements = dict()
-        for sd in self.gen_statement_dates():
-            missing_fmts = self.PULL_FMTS - self.library[sd] - self.ignore[sd]
-            if missing_fmts:
-                missing_statements[sd] = missing_fmts
-        return missing_statements
-
-    def pull_missing(self, scd, credentials):
-        """Pull all missing statements in the library"""
-        ms = self.missing_statements
+        return planner.missing_statements(self.missing_masks())
+
+    @property
+    def session_key(self):
+        """Accounts with the same session key can share one login"""
+        return (self.INSTITUTION or type(self).__name__, self.cred_name)
+
+    def pull_missing(self, scd, credentials, session=None, statements=None):
+        """Pull the given missing statements, as {StatementDate: formats},
+        or all missing statements in the library by default"""
+        ms = self.missing_statements if statements is None else statements
         if ms:
             LOG.info("%s: Missing statements: %s", self.name, ms)
         else:
             LOG.info("%s: No missing statements", self.name)
-        self.pull(scd, credentials, ms, False)
+        self.pull(scd, credentials, ms, False, session)
 
-    def pull_current(self, scd, credentials):
+    def pull_current(self, scd, credentials, session=None):
         """Pull current transactions into the library"""
-        self.pull(scd, credentials, dict(), True)
+        self.pull(scd, credentials, dict(), True, session)
 
-    def pull(self, scd, cp, statements, pull_current=False):
-        """Template method for pulling a list of statements into the library"""
+    # pylint: disable=too-many-arguments
+    def pull(self, scd, cp, statements, pull_current=False, session=None):
+        """Template method for pulling a list of statements into the library.
+        Logs in through the given LoginSession, or a fresh one if None"""
         if not self.active:
             return
         if not statements and not pull_current:
             return
-        credentials = cp.get_credential(self.cred_name)
-        LOG.info("%s: Pulling statements", self.name)
-        scd.start()
-        scd.reset()
-        self.do_pull(scd, credentials, statements, pull_current)
+        scd.use_timeouts(self.TIMEOUTS)
+        if session is None:
+            with LoginSession(scd, cp) as session:
+                self.pull(scd, cp, statements, pull_current, session)
+            return
+        with tracing.span("pull", account=self.name):
+            session.enter(self)
+            LOG.info("%s: Pulling statements", self.name)
+            if self.journal is not None:
+                self.journal.mark(self.name, statements, "downloading")
+            with tracing.span("do_pull"):
+                self.do_pull(scd, statements, pull_current)
+
+    @abc.abstractmethod
+    def login(self, scd, credentials):
+        """Abstract method to log in from a fresh browser, returning once the
+        page every do_pull starts from has loaded"""
+        pass
+
+    def logout(self, scd):
+        """Log out of the institution"""
+        if self.LOGOUT_URL:
+            scd.get(self.LOGOUT_URL)
 
     @abc.abstractmethod
-    def do_pull(self, scd, credentials, statements, pull_current=False):
+    def do_pull(self, scd, statements, pull_current=False):
         """Abstract method to pull a list of statements to be implemented
-        by the concrete classes"""
+        by the concrete classes. Starts from the page left by login"""
         pass
 
     def log_failed_pull(self, sd, fmt):
         """Log a statement that could not be pulled"""
         LOG.warning("%s %s: Could not pull a %s statement", self.name, sd, fmt)
+        tracing.instant("failed_pull", sd=sd, fmt=fmt)
 
     def log_successful_pull(self, sd, fmt):
         """Log a successfully pulled statement"""
         LOG.info("%s %s: Pulled %s statement", self.name, sd, fmt)
+        tracing.instant("pulled", sd=sd, fmt=fmt)
 
     @staticmethod
     def factory(acct_type, **kwargs):
-        """Factory method to return a concrete Account given a type"""
-        if acct_type == "MITFCU":
-            return account.MITFCU(**kwargs)
-        elif acct_type == "MITFCU_Visa":
-            return account.MITFCUVisa(**kwargs)
-        elif acct_type == "BoA":
-            return account.BoA(**kwargs)
-        elif acct_type == "BoAVisa":
-            return account.BoAVisa(**kwargs)
-        elif acct_type == "USBankVisa":
-            return account.USBankVisa(**kwargs)
+        """Factory method to return a concrete Account given a type, looked
+        up in ambiguity.account.ACCOUNT_TYPES"""
+        try:
+            acct_cls = account.ACCOUNT_TYPES.load(acct_type)
+        except KeyError:
+            raise ValueError("Account type {} not supported".format(
+                acct_type))
+        return acct_cls(**kwargs)
+
+
+class LoginSession(object):
+    """A logged in browser session shared by accounts with the same session
+    key. Logs in lazily for the first account that needs it, then returns to
+    the post-login page for every later account, logging out on exit"""
+
+    def __init__(self, scd, cp):
+        self.scd = scd
+        self.cp = cp
+        self.owner = None
+        self.home_url = None
+
+    def enter(self, acct):
+        """Get the browser to the post-login page for the given account"""
+        if self.owner is None:
+            with tracing.span("credentials"):
+                credentials = self.cp.get_credential(acct.cred_name)
+            self.scd.start()
+            self.scd.reset()
+            LOG.info("%s: Logging in", acct.name)
+            with tracing.span("login"):
+                acct.login(self.scd, credentials)
+            self.owner = acct
+            self.home_url = self.scd.current_url
+        elif acct.session_key != self.owner.session_key:
+            raise ValueError("{} can't share the login of {}".format(
+                acct.name, self.owner.name))
         else:
-            raise ValueError("Account type %s not supported", acct_type)
+            LOG.info("%s: Reusing login of %s", acct.name, self.owner.name)
+            self.scd.close_other_windows()
+            self.scd.get(self.home_url)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        if self.owner is not None:
+            try:
+                self.owner.logout(self.scd)
+            except Exception:  # pylint: disable=broad-except
+                LOG.warning("%s: Could not log out", self.owner.name)
+                # Don't lend a browser that may still be logged in
+                self.scd.healthy = False
+            self.owner = None
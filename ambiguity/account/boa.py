@@ -1,16 +1,16 @@
 """Account class for Bank of America"""
 import datetime
-from time import sleep
 
 from ambiguity import StatementDate
+from ambiguity import conditions
 from ambiguity.account import Account
-from ambiguity.utils import Timeout
 
 
 class BoA(Account):
     """Concrete Account class for Bank of America"""
 
     PULL_FMTS = {"pdf", "csv", "qfx", "qif", "txt"}
+    INSTITUTION = "BoA"
     BOA_AUX_FMTS = {"csv", "qfx", "qif", "txt"}
     BASE_URL = "https://www.bankofamerica.com/"
     LOGOUT_URL = ("https://secure.bankofamerica.com/myaccounts/signoff/"
@@ -43,15 +43,19 @@ class BoA(Account):
         self.last_four_digits = last_four_digits
         super().__init__(**kwargs)
 
-    # pylint: disable=too-many-branches, too-many-statements
-    def do_pull(self, scd, credentials, statements, pull_current=False):
+    def login(self, scd, credentials):
         scd.get(self.BASE_URL)
-        sleep(1)
+        scd.wait_for(conditions.element_clickable(self.SELECTORS["username"]),
+                     replaces=1)
         scd.fill_field(self.SELECTORS["username"], credentials[0])
         scd.fill_field(self.SELECTORS["password"], credentials[1])
-        sleep(0.5)
+        scd.wait_for(conditions.dom_stable(0.2), replaces=0.5)
         scd.wait_till_clickable(self.SELECTORS["login"]).click()
+        scd.wait_for(conditions.element_visible(
+            self.SELECTORS["account_names"]), kind="login")
 
+    # pylint: disable=too-many-branches, too-many-statements
+    def do_pull(self, scd, statements, pull_current=False):
         scd.wait_till_visible(self.SELECTORS["account_names"])
         # import pdb; pdb.set_trace()
         for an in scd.find_all(self.SELECTORS["account_names"]):
@@ -75,16 +79,17 @@ class BoA(Account):
                 if not scd.find(self.SELECTORS["txn_dropdown"]).is_displayed():
                     scd.wait_till_clickable(self.SELECTORS["dl_modal"]).click()
                 other_stmts = dict()
-                choices = scd.find_all(self.SELECTORS["txn_dropdown_opts"])[1:]
+                choices = scd.extract(self.SELECTORS["txn_dropdown_opts"],
+                                      elements=True)[1:]
                 for choice in choices:
-                    if "Period ending" in choice.text:
-                        dt_string = choice.text.strip()[-10:]
+                    if "Period ending" in choice["text"]:
+                        dt_string = choice["text"][-10:]
                         dt = datetime.datetime.strptime(dt_string, "%m/%d/%Y")
                     else:
-                        dt_string = choice.text.strip()
+                        dt_string = choice["text"]
                         dt = datetime.datetime.strptime(dt_string, "%B %d, %Y")
                     sd = StatementDate.from_datetime(dt)
-                    other_stmts[sd] = choice
+                    other_stmts[sd] = choice["element"]
                 return other_stmts
             other_stmts = detect_aux_statements()
 
@@ -93,59 +98,34 @@ class BoA(Account):
                     for fmt in fmts:
                         self.log_failed_pull(sd, fmt)
                     continue
-                with Timeout(error_message="could not click on statement"):
-                    while not other_stmts[sd].is_displayed():
-                        sleep(0.1)
+                scd.wait_for(conditions.element_displayed(
+                    other_stmts[sd], "statement {}".format(sd)))
                 other_stmts[sd].click()
                 for fmt in fmts:
-                    scd.clear_download_glob("*." + fmt)
+                    dl = scd.expect_download("*." + fmt)
                     scd.wait_till_clickable(self.FMT_SELECTORS[fmt]).click()
                     scd.find(self.SELECTORS["dl_btn"]).click()
                     if scd.is_stale(other_stmts[sd]):
                         # page reloaded, no txns in period
                         for fmt2 in fmts:
                             dl_path = scd.download_dir / ("temp." + fmt2)
-                            dl_path.touch()
-                            self.file_statement(dl_path, sd, fmt2)
+                            # Truncating any leftover download of that name
+                            dl_path.write_bytes(b"")
+                            self.file_statement(dl_path, sd, fmt2,
+                                                allow_empty=True)
                             self.log_successful_pull(sd, fmt2)
                         other_stmts = detect_aux_statements()
                         break
                     elif not scd.find(
                             self.SELECTORS["txn_dropdown"]).is_displayed():
                         scd.find(self.SELECTORS["dl_modal"]).click()
-                    dl_path = scd.wait_for_download("*." + fmt)
+                    dl_path = scd.wait_for_download(dl)
                     self.file_statement(dl_path, sd, fmt)
                     self.log_successful_pull(sd, fmt)
 
-        if pdf_statements:
-            import pdb; pdb.set_trace()
-            # not supported anymore :()
-            # pdf_stmts = dict()
-            # scd.wait_till_clickable(self.SELECTORS["pdf_page"]).click()
-            # scd.wait_till_clickable(self.SELECTORS["pdf_stmt"])
-            # choices = scd.find_all(self.SELECTORS["pdf_stmt"])
-            # choice_dates = scd.find_all(self.SELECTORS["pdf_stmt_dates"])
-            # for i in range(len(choice_dates)):
-            #     choice_date = choice_dates[i]
-            #     choice = choices[i]
-            #     if "Statement" not in choice.text:
-            #         continue
-            #     dt = datetime.datetime.strptime(choice_date.text, "%m/%d/%Y")
-            #     sd = StatementDate.from_datetime(dt)
-            #     pdf_stmts[sd] = choice
-            # for sd in pdf_statements:
-            #     if sd not in pdf_stmts:
-            #         self.log_failed_pull(sd, "pdf")
-            #         continue
-            #     scd.clear_download_glob("*.pdf")
-            #     scd.scroll_to(pdf_stmts[sd]).click()
-            #     scd.wait_till_clickable(self.SELECTORS["pdf_dl_link"]).click()
-            #     dl_path = scd.wait_for_download("*.pdf")
-            #     self.file_statement(dl_path, sd, "pdf")
-            #     self.log_successful_pull(sd, "pdf")
-
-        # Logout
-        scd.get(self.LOGOUT_URL)
+        # The site doesn't offer pdf statements anymore
+        for sd in sorted(pdf_statements):
+            self.log_failed_pull(sd, "pdf")
 
 
 class BoAVisa(BoA):
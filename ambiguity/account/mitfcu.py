@@ -1,6 +1,6 @@
 """Account class for MITFCU"""
-from time import sleep
 from ambiguity import StatementDate
+from ambiguity import conditions
 from ambiguity.account import Account
 
 
@@ -8,6 +8,9 @@ class MITFCU(Account):
     """A concrete Account class for MITFCU accounts"""
 
     PULL_FMTS = {"csv", "pdf"}
+    INSTITUTION = "MITFCU"
+    # Don't keep a new device confirmation waiting too long for the prompt
+    TIMEOUTS = {"login": 10}
     BASE_URL = "https://www.mitfcu.org"
     LOGOUT_URL = "https://www.mitfcu2.org/tob/live/usp-core/app/logout"
     CSV_URL = (
@@ -48,23 +51,26 @@ class MITFCU(Account):
         self.description = description
         super().__init__(**kwargs)
 
-    def do_pull(self, scd, credentials, statements, pull_current=False):
-        # Login
+    def login(self, scd, credentials):
         scd.get(self.BASE_URL)
         scd.switch_to.frame(scd.find(self.SELECTORS["login_frame"]))
         scd.fill_field(self.SELECTORS["username"], credentials[0])
         scd.fill_field(self.SELECTORS["password"], credentials[1])
         scd.find(self.SELECTORS["login"]).click()
-
-        # Navigate to E-Statement viewer
-        sleep(2)
         try:
-            scd.find(self.SELECTORS["additional_services"]).click()
-        except IndexError:
+            scd.wait_for(
+                conditions.element_present(
+                    self.SELECTORS["additional_services"]),
+                kind="login", replaces=2)
+        except TimeoutError:
             print("Please confirm it's you and save this browser profile")
             print("Press Enter when you're done")
             input()
-        scd.find(self.SELECTORS["additional_services"]).click()
+
+    def do_pull(self, scd, statements, pull_current=False):
+        # Navigate to E-Statement viewer, once the page left by login, or
+        # reloaded for a later account sharing it, is ready
+        scd.wait_till_clickable(self.SELECTORS["additional_services"]).click()
         scd.find(self.SELECTORS["e-statements"]).click()
 
         scd.accept_alert()
@@ -82,26 +88,24 @@ class MITFCU(Account):
         while True:
             n_docs = len(docids)
             scd.wait_till_clickable(self.SELECTORS["hit"])
-            for choice in scd.find_all(self.SELECTORS["hit"]):
-                mm, _dd, yyyy = choice.text.split("/")
+            for choice in scd.extract(self.SELECTORS["hit"], ["href"]):
+                mm, _dd, yyyy = choice["text"].split("/")
                 sd = StatementDate(yyyy, mm)
-                docids[sd] = choice.get_attribute("href")[-8:-1]
+                docids[sd] = choice["href"][-8:-1]
             if len(docids) == n_docs:
                 break
             scd.execute_script(self.SELECTORS["next_hitlist_js"])
 
+        csv_urls = dict()
         for sd, fmts in statements.items():
             for fmt in fmts:
                 if sd not in docids:
                     self.log_failed_pull(sd, fmt)
-                    continue
-                if fmt == "csv":
-                    scd.clear_download_glob("*." + fmt)
-                    scd.get(self.CSV_URL.format(
+                elif fmt == "csv":
+                    csv_urls[sd, fmt] = self.CSV_URL.format(
                         docid=docids[sd],
                         subaccount=self.subaccount,
-                        description=self.description))
-                    dl_path = scd.wait_for_download("*." + fmt)
+                        description=self.description)
                 elif fmt == "pdf":
                     scd.get(self.PRINT_URL.format(
                         docid=docids[sd],
@@ -109,11 +113,11 @@ class MITFCU(Account):
                         description=self.description))
                     dl_path = scd.download_dir / "temp.pdf"
                     scd.print_to_pdf(dl_path, True)
+                    self.file_statement(dl_path, sd, fmt)
+                    self.log_successful_pull(sd, fmt)
                 else:
                     self.log_failed_pull(sd, fmt)
-                    continue
-                self.file_statement(dl_path, sd, fmt)
-                self.log_successful_pull(sd, fmt)
 
-        # Logout
-        scd.get(self.LOGOUT_URL)
+        # CSVs are plain GETs, skip the browser and fetch them all at once
+        if csv_urls:
+            self.fetch_statements(scd, csv_urls)
@@ -1,16 +1,16 @@
 """Account class for MITFCU Visa credit cards"""
 import datetime
-from time import sleep
 
 from ambiguity import StatementDate
+from ambiguity import conditions
 from ambiguity.account import Account
-from ambiguity.utils import Timeout
 
 
 class MITFCUVisa(Account):
     """A concrete Account class for MITFCU Visa accounts"""
 
     PULL_FMTS = {"pdf", "csv", "xlsx", "qfx", "ofx"}
+    INSTITUTION = "MITFCU"
     FCU_VISA_AUX_FMTS = {"csv", "xlsx", "qfx", "ofx"}
     BASE_URL = "https://www.mitfcu.org"
     ESTMT_URL = "https://mitfcu.mycardinfo.com/estatementenroll.aspx"
@@ -44,15 +44,18 @@ class MITFCUVisa(Account):
         self.last_four_digits = last_four_digits
         super().__init__(**kwargs)
 
-    # pylint: disable=too-many-branches, too-many-statements
-    def do_pull(self, scd, credentials, statements, pull_current=False):
-        # Login
+    def login(self, scd, credentials):
         scd.get(self.BASE_URL)
         scd.switch_to.frame(scd.find(self.SELECTORS["login_frame"]))
         scd.fill_field(self.SELECTORS["username"], credentials[0])
         scd.fill_field(self.SELECTORS["password"], credentials[1])
         scd.find(self.SELECTORS["login"]).click()
+        scd.wait_till_clickable(self.SELECTORS["account_link"].format(
+                self.last_four_digits,
+                self.last_four_digits))
 
+    # pylint: disable=too-many-branches, too-many-statements
+    def do_pull(self, scd, statements, pull_current=False):
         # Navigate to mycardinfo
         scd.wait_till_clickable(self.SELECTORS["account_link"].format(
                 self.last_four_digits,
@@ -73,18 +76,19 @@ class MITFCUVisa(Account):
             # See which PDF statements are available
             scd.get(self.ESTMT_URL)
             pdfjs = dict()
-            for choice in scd.find_all(self.SELECTORS["pdf_stmt_link"]):
-                mm, _dd, yyyy = choice.text.split("/")
+            for choice in scd.extract(self.SELECTORS["pdf_stmt_link"],
+                                      ["href"]):
+                mm, _dd, yyyy = choice["text"].split("/")
                 sd = StatementDate(yyyy, mm)
-                pdfjs[sd] = choice.get_attribute("href")[11:]
+                pdfjs[sd] = choice["href"][11:]
 
             for sd in pdf_statements:
                 if sd not in pdfjs:
                     self.log_failed_pull(sd, "pdf")
                     continue
-                scd.clear_download_glob("*.pdf")
+                dl = scd.expect_download("*.pdf")
                 scd.execute_script(pdfjs[sd])
-                dl_path = scd.wait_for_download("*.pdf")
+                dl_path = scd.wait_for_download(dl)
                 self.file_statement(dl_path, sd, "pdf")
                 self.log_successful_pull(sd, "pdf")
 
@@ -92,11 +96,12 @@ class MITFCUVisa(Account):
             scd.get(self.TRANSACTIONS_URL)
             scd.wait_till_clickable(self.SELECTORS["date_picker"]).click()
             docjs = dict()
-            for choice in scd.find_all(self.SELECTORS["stmt_choice"]):
-                dt_string = choice.text.split(" - ")[1]
+            for choice in scd.extract(self.SELECTORS["stmt_choice"],
+                                      ["href"]):
+                dt_string = choice["text"].split(" - ")[1]
                 dt = datetime.datetime.strptime(dt_string, "%b %d, %Y")
                 sd = StatementDate.from_datetime(dt)
-                docjs[sd] = choice.get_attribute("href")[11:]
+                docjs[sd] = choice["href"][11:]
             scd.wait_till_clickable(self.SELECTORS["date_picker"]).click()
 
             for sd, fmts in fcu_visa_aux_statements.items():
@@ -105,15 +110,9 @@ class MITFCUVisa(Account):
                         self.log_failed_pull(sd, fmt)
                     continue
                 scd.execute_script(docjs[sd])
-                with Timeout(error_message="error switching MITFCU dates"):
-                    while scd.find(self.SELECTORS["overlay"]).is_displayed():
-                        sleep(0.1)
-                for fmt in fmts:
-                    scd.clear_download_glob("*." + fmt)
-                    scd.get(self.DL_URLS[fmt])
-                    dl_path = scd.wait_for_download("*." + fmt)
-                    self.file_statement(dl_path, sd, fmt)
-                    self.log_successful_pull(sd, fmt)
-
-        # Logout
-        scd.get(self.LOGOUT_URL)
+                scd.wait_for(conditions.element_hidden(
+                    self.SELECTORS["overlay"]))
+                # The selected period lives in the server side session, so
+                # every format of it can be fetched concurrently over HTTP
+                self.fetch_statements(
+                    scd, {(sd, fmt): self.DL_URLS[fmt] for fmt in fmts})
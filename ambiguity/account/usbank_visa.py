@@ -1,17 +1,16 @@
 """Account class for MITFCU Visa credit cards"""
 import datetime
 from time import sleep
-from selenium.common.exceptions import TimeoutException
 
 from ambiguity import StatementDate
 from ambiguity.account import Account
-from ambiguity.utils import Timeout
 
 
 class USBankVisa(Account):
     """A concrete Account class for MITFCU Visa accounts"""
 
     PULL_FMTS = {"pdf", "csv", "qfx", "qif"}
+    INSTITUTION = "USBank"
     USBANK_AUX_FMTS = {"csv", "qfx", "qif"}
     BASE_URL = "https://usbank.com/"
     LOGOUT_URL = "https://onlinebanking.usbank.com/Auth/LogoutConfirmation"
@@ -37,14 +36,12 @@ class USBankVisa(Account):
         self.last_four_digits = last_four_digits
         super().__init__(**kwargs)
 
-    # pylint: disable=too-many-branches, too-many-statements
-    def do_pull(self, scd, credentials, statements, pull_current=False):
-        # Login
+    def login(self, scd, credentials):
+        from selenium.common.exceptions import TimeoutException
         scd.get(self.BASE_URL)
         scd.fill_field(self.SELECTORS["username"], credentials[0])
         scd.fill_field(self.SELECTORS["password"], credentials[1])
         scd.wait_till_clickable(self.SELECTORS["login"]).click()
-        import pdb; pdb.set_trace()
         try:
             scd.wait_till_clickable(self.SELECTORS["dl_xactions"])
         except TimeoutException:
@@ -53,6 +50,8 @@ class USBankVisa(Account):
             input()
             scd.wait_till_clickable(self.SELECTORS["dl_xactions"])
 
+    # pylint: disable=too-many-branches, too-many-statements
+    def do_pull(self, scd, statements, pull_current=False):
         pdf_statements = set()
         usbank_aux_statements = dict()
         for sd, fmts in statements.items():
@@ -81,9 +80,8 @@ class USBankVisa(Account):
                     return scd.find_all(self.SELECTORS["dl_format_item"])
 
                 for fmt in fmts:
-                    import pdb; pdb.set_trace()
                     fmt_items = ensure_fmt_menu_visible()
-                    scd.clear_download_glob("*." + fmt)
+                    dl = scd.expect_download("*." + fmt)
                     if fmt == "csv":
                         if "CSV" not in fmt_items[1].text:
                             self.log_failed_pull(sd, fmt)
@@ -103,7 +101,7 @@ class USBankVisa(Account):
                         self.log_failed_pull(sd, fmt)
                         continue
                     scd.wait_till_clickable(self.SELECTORS["dl_btn"]).click()
-                    dl_path = scd.wait_for_download("*." + fmt)
+                    dl_path = scd.wait_for_download(dl)
                     self.file_statement(dl_path, sd, fmt)
                     self.log_successful_pull(sd, fmt)
             scd.wait_till_clickable(self.SELECTORS["dl_cancel"]).click()
@@ -112,25 +110,22 @@ class USBankVisa(Account):
             pdf_stmts = dict()
             scd.wait_till_clickable(self.SELECTORS["stmts_link"]).click()
             scd.wait_till_visible(self.SELECTORS["stmt_list"])
-            choices = scd.find_all(self.SELECTORS["stmt_links"])
+            choices = scd.extract(self.SELECTORS["stmt_links"], elements=True)
             for c in choices:
                 try:
-                    dt = datetime.datetime.strptime(c.text, "%B %d, %Y")
+                    dt = datetime.datetime.strptime(c["text"], "%B %d, %Y")
                 except ValueError:
                     continue
                 if abs(dt.day - self.statement_day) < 3:
                     # Assume day won't roll over
                     sd = StatementDate.from_datetime(dt)
-                    pdf_stmts[sd] = c
+                    pdf_stmts[sd] = c["element"]
             for sd in pdf_stmts:
                 if sd not in pdf_stmts:
                     self.log_failed_pull(sd, "pdf")
                     continue
-                scd.clear_download_glob("*.pdf")
+                dl = scd.expect_download("*.pdf")
                 scd.scroll_to(pdf_stmts[sd]).click()
-                dl_path = scd.wait_for_download("*.pdf")
+                dl_path = scd.wait_for_download(dl)
                 self.file_statement(dl_path, sd, "pdf")
                 self.log_successful_pull(sd, "pdf")
-
-        # Logout
-        scd.get(self.LOGOUT_URL)
@@ -1,17 +1,150 @@
 """Account manager"""
+from collections import namedtuple, OrderedDict
 import logging
 from pathlib import Path
+import queue
+import threading
 
-from ambiguity.account import Account
+from ambiguity import tracing
+from ambiguity.account import Account, LoginSession
 from ambiguity.credential_providers import CredentialProvider
-from ambiguity.scd import SimpleChromeDriver
+from ambiguity.daemon import default_socket_path
+from ambiguity.journal import PullJournal
+from ambiguity.library_index import FilingError
+from ambiguity.planner import (
+    PlannedAccount, PullPlan, format_masks, plan_pulls)
+from ambiguity.scheduler import (
+    Attempt, PullScheduler, is_transient, limits_from_settings)
 
 LOG = logging.getLogger(__name__)
 
+# Folder of the library holding the cache of parsed statements
+PARSE_CACHE_DIR = ".parse_cache"
+# Folder of the library holding the TransactionStore
+STORE_DIR = ".transactions"
+
+# The statements of an account a pull pulled, including those it pulled
+# after retrying, and those it skipped or failed to pull, see PullReport
+PullResult = namedtuple("PullResult", ["name", "pulled", "retried",
+                                       "skipped", "failed"])
+
+
+def pull_job(accounts, job, scd, cp):
+    """Pull the statements of a PullJob in a single login session, given
+    the accounts by name, returning an Attempt per account. Accounts after
+    a failed login aren't tried, as they would fail the same way"""
+    attempts = []
+    with LoginSession(scd, cp) as session:
+        for name, statements in job.statements.items():
+            if attempts and attempts[-1].error and session.owner is None:
+                attempts.append(attempts[-1]._replace(
+                    name=name, remaining=statements))
+                continue
+            attempts.append(pull_account(accounts[name], scd, cp, session,
+                                         statements))
+    return attempts
+
+
+def pull_account(acct, scd, cp, session=None, statements=None):
+    """Pull statements of one account, as {StatementDate: formats}, or all
+    its missing ones, returning an Attempt. Errors are caught and reported,
+    so they don't hold up the accounts after"""
+    if statements is None:
+        statements = acct.missing_statements
+    error = None
+    transient = False
+    try:
+        acct.pull_missing(scd, cp, session, statements)
+    except Exception as ex:  # pylint: disable=broad-except
+        LOG.exception("%s: Pull failed", acct.name)
+        error = "{}: {}".format(type(ex).__name__, ex)
+        transient = is_transient(ex)
+    remaining = OrderedDict()
+    for sd, fmts in statements.items():
+        missing = {fmt for fmt in fmts if fmt not in acct.library.get(sd, ())}
+        if missing:
+            remaining[sd] = missing
+    return Attempt(acct.name, remaining, error, transient)
+
+
+class InlineExecutor(object):
+    """Runs the PullJobs of a PullScheduler one at a time on a browser of
+    this process"""
+
+    def __init__(self, accounts, scd, cp):
+        self.accounts = {acct.name: acct for acct in accounts}
+        self.scd = scd
+        self.cp = cp
+        self.done = []
+
+    def submit(self, job):
+        """Run a PullJob to the end"""
+        self.done.append((job.id, pull_job(self.accounts, job, self.scd,
+                                           self.cp)))
+
+    def finished(self, _timeout):
+        """Return the (job id, Attempts) of the jobs run since last time"""
+        done, self.done = self.done, []
+        return done
+
+
+class WorkerExecutor(object):
+    """Runs the PullJobs of a PullScheduler on worker processes, see
+    _pull_worker"""
+
+    def __init__(self, procs, tasks, results):
+        self.procs = procs
+        self.tasks = tasks
+        self.results = results
+
+    def submit(self, job):
+        """Hand a PullJob to the next free worker"""
+        self.tasks.put(job)
+
+    def finished(self, timeout):
+        """Return the (job id, Attempts) of the jobs done within timeout
+        seconds, or None once every worker has exited"""
+        try:
+            done = [self.results.get(timeout=timeout)]
+        except queue.Empty:
+            if any(proc.is_alive() for proc in self.procs):
+                return []
+            return None
+        while True:
+            try:
+                done.append(self.results.get_nowait())
+            except queue.Empty:
+                return done
+
+
+# pylint: disable=too-many-arguments
+def _pull_worker(accounts, tasks, results, download_dir, profile_dir,
+                 credentials, trace=False):
+    """Worker process: start a browser while the credentials are resolved,
+    take them off the credentials queue, then pull PullJobs off the task
+    queue until a None sentinel is received. If tracing, the worker's trace
+    events are sent back once it is done"""
+    from ambiguity.scd import SimpleChromeDriver
+    tracer = tracing.enable() if trace else tracing.disable()
+    download_dir.mkdir(parents=True, exist_ok=True)
+    by_name = {acct.name: acct for acct in accounts}
+    with SimpleChromeDriver(download_dir, profile_dir) as scd:
+        scd.start()
+        cp = credentials.get()
+        if cp is None:
+            return
+        for job in iter(tasks.get, None):
+            results.put((job.id, pull_job(by_name, job, scd, cp)))
+    if tracer is not None:
+        results.put(tracer.events)
+
 
 class AccountManager(object):  # pylint: disable=too-few-public-methods
     """An account manager to perform operations across multiple accounts in
     a single library. Takes settings in the form of a Namespace.
+
+    Selenium, the parsers and the rest are only imported by the operations
+    needing them, so checking on the library stays fast.
     """
 
     def __init__(self, settings):
@@ -19,14 +152,274 @@ class AccountManager(object):  # pylint: disable=too-few-public-methods
         self.library_dir = Path(settings.library_dir).expanduser()
         self.download_dir = Path(settings.chrome_download_dir).expanduser()
         self.profile_dir = Path(settings.chrome_profile_dir).expanduser()
+        self.daemon_socket = default_socket_path(settings)
+        self.settings = settings
+        self.limits = limits_from_settings(settings)
+        self._store = None
+        self._journal = None
         self.accounts = []
         for acct_params in settings.accounts:
             lib_dir = self.library_dir / acct_params["name"]
             self.accounts.append(
                 Account.factory(**acct_params, lib_dir=lib_dir))
 
-    def pull_all(self):
-        """Pulls all missing statements from each account"""
-        with SimpleChromeDriver(self.download_dir, self.profile_dir) as scd:
+    @property
+    def store(self):
+        """The TransactionStore of the library, which every account adds
+        the statements it files to from then on"""
+        if self._store is None:
+            from ambiguity.parsers import TransactionStore
+            self._store = TransactionStore(self.library_dir / STORE_DIR,
+                                           self.library_dir / PARSE_CACHE_DIR)
             for acct in self.accounts:
-                acct.pull_missing(scd, self.cp)
+                acct.store = self._store
+        return self._store
+
+    def plan(self, today=None):
+        """Return the PullPlan of every account's missing statements"""
+        return plan_pulls(self.accounts, today)
+
+    @property
+    def journal(self):
+        """The PullJournal of the library, which every account records the
+        progress of its pulls in"""
+        if self._journal is None:
+            self._journal = PullJournal(
+                self.library_dir / PullJournal.FILE_NAME)
+            for acct in self.accounts:
+                acct.journal = self._journal
+        return self._journal
+
+    # pylint: disable=too-many-arguments
+    def pull_all(self, workers=1, record=None, replay=None, realtime=False,
+                 resume=False):
+        """Pulls all missing statements from each account. With more than
+        one worker, accounts are pulled concurrently by a pool of browsers.
+        Accounts sharing a login are pulled one after another in a single
+        session. The session can be recorded into or replayed from a
+        directory, see SimpleChromeDriver.record and replay. Statements are
+        scheduled by a PullScheduler, retrying transient failures within
+        the limits of each institution, see pull_limits in the settings.
+        Progress is kept in the PullJournal, and with resume only what the
+        last pull left unfinished is pulled, see resume_plan. Returns a
+        list of PullResults, one per account"""
+        if workers > 1 and (record or replay):
+            LOG.warning("Recording and replaying pull with one browser")
+            workers = 1
+        # Have the statements filed from here on stored as they arrive
+        self.store  # pylint: disable=pointless-statement
+        journal = self.journal
+        if resume:
+            plan = self.resume_plan(journal)
+            LOG.info("Resuming the last pull, %d statements left",
+                     len(plan))
+        else:
+            # Starting over forgets the statements the last pull staged
+            self.file_downloaded(journal, discard=True)
+            plan = self.plan()
+            journal.start(plan)
+        with tracing.span("pull_all", workers=workers):
+            report = self._pull_all(plan, workers, record, replay, realtime)
+        self.log_summary(report)
+        results = []
+        for acct in self.accounts:
+            counts = report.counts(acct.name)
+            results.append(PullResult(
+                acct.name, counts["pulled"] + counts["retried"],
+                counts["retried"], counts["skipped"], counts["failed"]))
+        return results
+
+    def file_downloaded(self, journal, discard=False):
+        """File the statements the last pull in the journal downloaded but
+        didn't get to file, returning {account name: {StatementDate:
+        formats}} of the ones it left unfiled. Statements downloaded again
+        since, or whose staged file went missing or changed, aren't filed.
+        With discard, the staged files left unfiled are deleted, as when a
+        new journal is about to forget them"""
+        by_name = {acct.name: acct for acct in self.accounts}
+        remaining = dict()  # account name: {StatementDate: formats}
+        for (name, sd, fmt), record in journal.pending().items():
+            acct = by_name.get(name)
+            downloaded = record["state"] == "downloaded"
+            if acct is not None and fmt in acct.library.get(sd, ()):
+                # Filed before the journal could say so
+                journal.record(name, sd, fmt, "filed")
+            elif acct is not None and downloaded:
+                try:
+                    acct.file_staged(sd, fmt, journal.staged(record), True)
+                    acct.log_successful_pull(sd, fmt)
+                    continue
+                except (OSError, FilingError) as ex:
+                    LOG.warning("%s %s: Pulling again, %s", name, sd, ex)
+            if acct is not None and fmt not in acct.library.get(sd, ()):
+                remaining.setdefault(name, dict()).setdefault(
+                    sd, set()).add(fmt)
+            if discard and downloaded:
+                journal.staged(record).path.unlink(missing_ok=True)
+        return remaining
+
+    def resume_plan(self, journal):
+        """File the statements the last pull in the journal downloaded but
+        didn't get to file, see file_downloaded, and return a PullPlan of
+        the ones it didn't download"""
+        remaining = self.file_downloaded(journal)
+        plan = PullPlan()
+        for acct in self.accounts:
+            if acct.name in remaining:
+                plan.add(acct.session_key, PlannedAccount(
+                    acct.name, type(acct).__name__,
+                    format_masks(remaining[acct.name])))
+        return plan
+
+    def credential_names(self, plan):
+        """Return the credential names of the accounts in a PullPlan"""
+        return {acct.cred_name for acct in self.accounts if acct.name in plan}
+
+    def prefetch_credentials(self, names, scd=None):
+        """Resolve the named credentials up front, unlocking or prompting
+        once before any pulling, and return them as a StaticCP. A browser
+        given is started on another thread meanwhile"""
+        starter = None
+        if scd is not None and names:
+            # A failed start is retried, and reported, at the first login
+            starter = threading.Thread(target=scd.start, daemon=True,
+                                       name="browser_start")
+            starter.start()
+        try:
+            with tracing.span("credentials"):
+                return self.cp.resolve_all(names)
+        finally:
+            if starter is not None:
+                starter.join()
+
+    # pylint: disable=too-many-arguments
+    def _pull_all(self, plan, workers, record=None, replay=None,
+                  realtime=False):
+        """Pull the statements of a PullPlan, returning the PullReport"""
+        if workers > 1:
+            return self.pull_parallel(workers, plan)
+        from ambiguity.scd import SimpleChromeDriver
+        names = self.credential_names(plan)
+        with SimpleChromeDriver(self.download_dir, self.profile_dir,
+                                self.daemon_socket) as scd:
+            if record is not None:
+                scd.record(record)
+            elif replay is not None:
+                scd.replay(replay, realtime)
+            cp = self.prefetch_credentials(names, scd)
+            scheduler = PullScheduler(plan, self.limits)
+            return scheduler.run(InlineExecutor(self.accounts, scd, cp))
+
+    def pull_parallel(self, workers, plan=None):
+        """Pull the statements of a PullPlan, by default of every missing
+        one, on a bounded pool of worker processes, each driving its own
+        browser with a copy of the profile and a separate download
+        directory. Accounts sharing a login are pulled in one session by
+        the same worker. Returns the PullReport"""
+        import multiprocessing
+        import tempfile
+        from ambiguity.scd import copy_profile
+        if plan is None:
+            plan = self.plan()
+        scheduler = PullScheduler(plan, self.limits)
+        if not plan.groups:
+            return scheduler.report
+        workers = min(workers, len(plan.groups))
+
+        tracer = tracing.tracer()
+        tasks = multiprocessing.Queue()
+        done = multiprocessing.Queue()
+        credentials = multiprocessing.Queue()
+
+        with tempfile.TemporaryDirectory(prefix="ambi_profiles_") as tmp:
+            procs = []
+            for slot in range(workers):
+                profile_dir = Path(tmp) / "profile{}".format(slot)
+                if self.profile_dir.exists():
+                    copy_profile(self.profile_dir, profile_dir)
+                # Downloads stay next to the main download dir so statements
+                # can still be renamed into the library
+                download_dir = self.download_dir / "worker{}".format(slot)
+                proc = multiprocessing.Process(
+                    target=_pull_worker,
+                    args=(self.accounts, tasks, done, download_dir,
+                          profile_dir, credentials, tracer is not None))
+                proc.start()
+                procs.append(proc)
+
+            # Prompt for everything while the workers start their browsers,
+            # they can't read from stdin. Each worker takes one copy
+            cp = None
+            try:
+                cp = self.prefetch_credentials(self.credential_names(plan))
+            finally:
+                for _ in procs:
+                    credentials.put(cp)
+                if cp is None:
+                    for proc in procs:
+                        proc.join()
+
+            report = scheduler.run(WorkerExecutor(procs, tasks, done),
+                                   workers)
+            for _ in procs:
+                tasks.put(None)
+            traces = workers if tracer is not None else 0
+            while traces:
+                try:
+                    tracer.events.extend(done.get(timeout=1))
+                    traces -= 1
+                except queue.Empty:
+                    if not any(proc.is_alive() for proc in procs):
+                        break
+            for proc in procs:
+                proc.join()
+
+        # Statements were filed by the workers, catch up with the library
+        for acct in self.accounts:
+            if acct.name in plan:
+                acct.build_library()
+        return report
+
+    def parse_all(self, workers=None, all_formats=False, cache=True,
+                  dedup=False):
+        """Parse every account's statements into one TransactionTable on a
+        pool of worker processes. Each statement is read from its most
+        structured format unless all_formats. Parsed statements are cached
+        in the library, so only new or changed ones get parsed again. With
+        dedup, transactions found in several files, like every format of a
+        statement, are merged into one. Returns the table and the (file
+        name, error) of each file that couldn't be parsed"""
+        from ambiguity.parsers import parse_library
+        cache_dir = self.library_dir / PARSE_CACHE_DIR if cache else None
+        with tracing.span("parse_all"):
+            return parse_library(self.accounts, workers, all_formats,
+                                 cache_dir, dedup)
+
+    def sync_store(self):
+        """Bring the TransactionStore up to date with every account's
+        library, for statements filed without it, and return it. Statements
+        filed by pulls are stored as they arrive"""
+        with tracing.span("sync_store"):
+            self.store.sync(self.accounts)
+        return self.store
+
+    def export_beancount(self, full=False):
+        """Export every account's statements to a beancount ledger set up
+        by the beancount section of the settings. Only statements that
+        changed since the last export are written unless full. Returns the
+        number of statements written, unchanged and not parseable"""
+        from ambiguity.export import BeancountExporter
+        exporter = BeancountExporter.from_settings(
+            self.settings, self.library_dir,
+            cache_dir=self.library_dir / PARSE_CACHE_DIR)
+        with tracing.span("export_beancount"):
+            return exporter.export(self.accounts, full)
+
+    @staticmethod
+    def log_summary(report):
+        """Log a PullReport, listing the statements retried, skipped and
+        failed apart"""
+        lines = report.lines()
+        LOG.info(lines[0])
+        for line in lines[1:]:
+            LOG.warning(line)
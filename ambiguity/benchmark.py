@@ -0,0 +1,87 @@
+"""Benchmarks of the scrapers pulling from local stand-in bank sites"""
+from collections import OrderedDict, namedtuple
+import logging
+from pathlib import Path
+import tempfile
+import time
+
+from ambiguity import account
+from ambiguity import standin_sites
+from ambiguity.credential_providers import StaticCP
+from ambiguity.scd import SimpleChromeDriver
+
+LOG = logging.getLogger(__name__)
+
+# Account type: (stand-in site class, account class, formats to pull).
+# BoA PDFs aren't benchmarked because the scraper can't pull them anymore
+BENCHMARKS = OrderedDict([
+    ("MITFCU", (standin_sites.MITFCUSite, account.MITFCU,
+                account.MITFCU.PULL_FMTS)),
+    ("MITFCU_Visa", (standin_sites.MITFCUSite, account.MITFCUVisa,
+                     account.MITFCUVisa.PULL_FMTS)),
+    ("BoA", (standin_sites.BoASite, account.BoA,
+             account.BoA.BOA_AUX_FMTS)),
+    ("USBankVisa", (standin_sites.USBankSite, account.USBankVisa,
+                    account.USBankVisa.PULL_FMTS)),
+])
+
+
+class BenchResult(namedtuple("BenchResult", [
+        "acct_type", "statements", "seconds", "commands", "requests"])):
+    """Outcome of pulling every statement of a stand-in site once"""
+
+    __slots__ = ()
+    HEADER = "{:<12} {:>6} {:>10} {:>9} {:>9} {:>9}".format(
+        "account", "stmts", "wall", "stmts/min", "commands", "requests")
+
+    @property
+    def per_minute(self):
+        """Statements pulled per minute of wall time"""
+        return self.statements * 60 / self.seconds if self.seconds else 0
+
+    def __str__(self):
+        return "{:<12} {:>6d} {:>9.2f}s {:>9.1f} {:>9d} {:>9d}".format(
+            self.acct_type, self.statements, self.seconds, self.per_minute,
+            self.commands, self.requests)
+
+
+# pylint: disable=too-many-arguments, too-many-locals
+def run_benchmark(acct_type, months=12, page_size=10, rows=30, latency=0,
+                  headless=True):
+    """Pull every statement of a stand-in site with an account's scraper
+    and return a BenchResult. Browser startup isn't counted, login is"""
+    site_cls, acct_cls, fmts = BENCHMARKS[acct_type]
+    with tempfile.TemporaryDirectory() as tmp, site_cls(
+            months, page_size, rows, latency) as site:
+        tmp = Path(tmp)
+        acct = site.localize(acct_cls)(
+            name=acct_type,
+            open_date=site.statement_date(site.statements[-1]).date(),
+            lib_dir=tmp / "library",
+            statement_day=site.STATEMENT_DAY,
+            cred_name="bench",
+            **site.ACCOUNT_PARAMS[acct_cls.__name__])
+        statements = {sd: set(fmts) for sd in site.statements}
+        cp = StaticCP({"bench": ("user", "password")})
+        with SimpleChromeDriver(tmp / "downloads", tmp / "profile",
+                                headless=headless) as scd:
+            scd.start()
+            commands = scd.commands
+            start = time.perf_counter()
+            acct.pull(scd, cp, statements)
+            seconds = time.perf_counter() - start
+            commands = scd.commands - commands
+        pulled = sum(len(acct.library[sd] & fmts) for sd in site.statements)
+        return BenchResult(acct_type, pulled, seconds, commands,
+                           len(site.server.requests))
+
+
+def run_benchmarks(acct_types=None, **kwargs):
+    """Benchmark each account type, logging and returning the results"""
+    results = []
+    for acct_type in acct_types or BENCHMARKS:
+        LOG.info("Benchmarking %s", acct_type)
+        results.append(run_benchmark(acct_type, **kwargs))
+    LOG.info("Results:\n%s", "\n".join(
+        [BenchResult.HEADER] + [str(result) for result in results]))
+    return results
@@ -1,12 +1,15 @@
-"""Command line entry points for the package"""
+"""Command line entry points for the package. Each imports what it needs
+when run, so one command doesn't pay for the imports of another"""
 import argparse
+import datetime
+from decimal import Decimal, InvalidOperation
 import logging
+import time
 from pathlib import Path
 
 import yaml
 
-from ambiguity.account_manager import AccountManager
-from ambiguity.scd import SimpleChromeDriver
+from ambiguity import tracing
 from ambiguity.utils import Namespace
 
 LOG = logging.getLogger(__name__)
@@ -20,12 +23,17 @@ logging.basicConfig(
     style="{")
 
 
-def get_settings():
-    """Returns a settings namespace after parsing command args"""
-    parser = argparse.ArgumentParser(
-        description='Pull statements for all accounts')
+def make_parser(description):
+    """Returns an argument parser that accepts a settings file"""
+    parser = argparse.ArgumentParser(description=description)
     parser.add_argument('settings_file', nargs='?', default="settings.yaml")
-    args = parser.parse_args()
+    return parser
+
+
+def get_settings(args=None):
+    """Returns a settings namespace after parsing command args"""
+    if args is None:
+        args = make_parser('Pull statements for all accounts').parse_args()
     settings_path = Path(args.settings_file).expanduser()
     try:
         settings = Namespace(**yaml.load(settings_path.read_text()))
@@ -39,17 +47,217 @@ def get_settings():
 
 def pull():
     """Pulls statements with an AccountManager and a settings file"""
-    am = AccountManager(get_settings())
-    am.pull_all()
+    parser = make_parser('Pull statements for all accounts')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help="number of browsers pulling concurrently")
+    parser.add_argument('--trace', metavar="TRACE_FILE",
+                        help="write a Chrome trace of the pull to this file "
+                        "and a per-account breakdown next to it")
+    session = parser.add_mutually_exclusive_group()
+    session.add_argument('--record', metavar="DIR",
+                         help="record the pages and downloads of the pull "
+                         "into this directory")
+    session.add_argument('--replay', metavar="DIR",
+                         help="pull from a recording instead of the real "
+                         "sites")
+    parser.add_argument('--realtime', action='store_true',
+                        help="replay at the recorded speed")
+    parser.add_argument('--plan', action='store_true',
+                        help="print the statements that would be pulled, "
+                        "grouped by login, instead of pulling them")
+    parser.add_argument('--resume', action='store_true',
+                        help="only pull what the last pull left unfinished")
+    args = parser.parse_args()
+    from ambiguity.account_manager import AccountManager
+    if args.plan:
+        am = AccountManager(get_settings(args))
+        print(yaml.dump(am.plan().to_dict(), default_flow_style=None))
+        return
+    if args.trace:
+        tracer = tracing.enable()
+    try:
+        with tracing.span("setup"):
+            am = AccountManager(get_settings(args))
+        am.pull_all(
+            workers=args.jobs,
+            record=Path(args.record).expanduser() if args.record else None,
+            replay=Path(args.replay).expanduser() if args.replay else None,
+            realtime=args.realtime,
+            resume=args.resume)
+    finally:
+        if args.trace:
+            trace_path = Path(args.trace).expanduser()
+            tracer.write(trace_path)
+            breakdown = tracer.breakdown()
+            trace_path.with_suffix(".txt").write_text(breakdown + "\n")
+            LOG.info("Trace written to %s\n%s", trace_path, breakdown)
 
 
 def open_scd():
     """Opens the SimpleChromeDriver and falls into the interpreter for playing
     around with things"""
+    from ambiguity.daemon import default_socket_path
+    from ambiguity.scd import SimpleChromeDriver
     settings = get_settings()
     download_dir = Path(settings.chrome_download_dir).expanduser()
     profile_dir = Path(settings.chrome_profile_dir).expanduser()
-    with SimpleChromeDriver(download_dir, profile_dir) as scd:
+    with SimpleChromeDriver(download_dir, profile_dir,
+                            default_socket_path(settings)) as scd:
         scd.start()
         import code
         code.interact(local=dict(globals(), **locals()))
+
+
+def browser_daemon():
+    """Runs a daemon keeping warm browsers for other commands to attach to,
+    or controls an already running one"""
+    parser = make_parser('Keep warm browsers for ambi-pull and ambi-scd')
+    parser.add_argument('-n', '--size', type=int, default=1,
+                        help="number of browsers to keep started")
+    parser.add_argument('--max-uses', type=int, default=20,
+                        help="restart a browser after this many uses")
+    parser.add_argument('--status', action='store_true',
+                        help="show the state of the running daemon")
+    parser.add_argument('--stop', action='store_true',
+                        help="stop the running daemon")
+    args = parser.parse_args()
+    from ambiguity.daemon import (
+        BrowserDaemon, DaemonClient, default_socket_path)
+    settings = get_settings(args)
+    socket_path = default_socket_path(settings)
+    if args.status or args.stop:
+        try:
+            reply = DaemonClient(socket_path).request(
+                "shutdown" if args.stop else "status")
+        except OSError:
+            LOG.critical("No daemon is listening on %s", socket_path)
+            import sys
+            sys.exit(1)
+        print(yaml.dump(reply, default_flow_style=False))
+        return
+    daemon = BrowserDaemon(
+        socket_path,
+        Path(settings.chrome_download_dir).expanduser(),
+        Path(settings.chrome_profile_dir).expanduser(),
+        size=args.size, max_uses=args.max_uses)
+    daemon.serve_forever()
+
+
+def bench():
+    """Benchmarks the scrapers against local stand-in bank sites"""
+    from ambiguity import benchmark
+    parser = argparse.ArgumentParser(
+        description='Benchmark the scrapers against local stand-in sites')
+    parser.add_argument('acct_types', nargs='*', metavar='ACCOUNT_TYPE',
+                        help="account types to benchmark, default all of "
+                        + ", ".join(benchmark.BENCHMARKS))
+    parser.add_argument('-m', '--months', type=int, default=12,
+                        help="number of monthly statements on each site")
+    parser.add_argument('-p', '--page-size', type=int, default=10,
+                        help="statements per page of paginated lists")
+    parser.add_argument('-r', '--rows', type=int, default=30,
+                        help="transactions per statement")
+    parser.add_argument('-l', '--latency', type=float, default=0.05,
+                        help="seconds the sites take to answer a request")
+    parser.add_argument('--show-browser', action='store_true',
+                        help="run Chrome with a window instead of headless")
+    args = parser.parse_args()
+    for acct_type in args.acct_types:
+        if acct_type not in benchmark.BENCHMARKS:
+            parser.error("no benchmark for account type " + acct_type)
+    benchmark.run_benchmarks(
+        args.acct_types, months=args.months, page_size=args.page_size,
+        rows=args.rows, latency=args.latency,
+        headless=not args.show_browser)
+
+
+def export():
+    """Exports the statement library to other bookkeeping formats"""
+    parser = argparse.ArgumentParser(
+        description='Export the statement library')
+    formats = parser.add_subparsers(dest='format', metavar='FORMAT')
+    formats.required = True
+    beancount = formats.add_parser(
+        'beancount', help="write a beancount ledger")
+    beancount.add_argument('settings_file', nargs='?',
+                           default="settings.yaml")
+    beancount.add_argument('--full', action='store_true',
+                           help="write every statement again, not only the "
+                           "ones that changed since the last export")
+    args = parser.parse_args()
+    from ambiguity.account_manager import AccountManager
+    am = AccountManager(get_settings(args))
+    am.export_beancount(full=args.full)
+
+
+def iso_date(text):
+    """Returns the date of a YYYY-MM-DD argument"""
+    try:
+        return datetime.datetime.strptime(text, "%Y-%m-%d").date()
+    except ValueError:
+        raise argparse.ArgumentTypeError("not a YYYY-MM-DD date: " + text)
+
+
+def dollars(text):
+    """Returns the amount of a dollar argument"""
+    try:
+        return Decimal(text)
+    except InvalidOperation:
+        raise argparse.ArgumentTypeError("not an amount: " + text)
+
+
+def query():
+    """Queries the transactions of the parsed statement library"""
+    parser = make_parser('Find transactions in the statement library')
+    parser.add_argument('-p', '--payee',
+                        help="payees containing all of these words")
+    parser.add_argument('-a', '--account', action='append', dest='accounts',
+                        metavar='ACCOUNT', help="only this account, can be "
+                        "given more than once")
+    parser.add_argument('--since', type=iso_date, metavar='YYYY-MM-DD')
+    parser.add_argument('--until', type=iso_date, metavar='YYYY-MM-DD')
+    parser.add_argument('--year', type=int,
+                        help="shorthand for --since and --until of a year")
+    parser.add_argument('--min', type=dollars, dest='low',
+                        help="smallest amount")
+    parser.add_argument('--max', type=dollars, dest='high',
+                        help="largest amount")
+    parser.add_argument('-n', '--limit', type=int,
+                        help="show only the latest this many")
+    args = parser.parse_args()
+    if args.year:
+        args.since = args.since or datetime.date(args.year, 1, 1)
+        args.until = args.until or datetime.date(args.year, 12, 31)
+    from ambiguity.account_manager import AccountManager
+    start = time.perf_counter()
+    am = AccountManager(get_settings(args))
+    index = am.sync_store().index(acct.name for acct in am.accounts)
+    rows = index.query(payee=args.payee, accounts=args.accounts,
+                       start=args.since, end=args.until, low=args.low,
+                       high=args.high)
+    for idx in rows[-args.limit:] if args.limit else rows:
+        txn = index.table.row(idx)
+        print("{}  {:>12}  {:<20}  {}{}".format(
+            txn.date, txn.amount, txn.account, txn.payee,
+            "  ({})".format(txn.memo) if txn.memo else ""))
+    total = sum(index.table.amount[idx] for idx in rows)
+    LOG.info("%d of %d transactions, totalling %.2f, found in %.1f ms",
+             len(rows), len(index), total / 100,
+             (time.perf_counter() - start) * 1000)
+
+
+def status():
+    """Reports the coverage of the library from the settings and library
+    indexes alone, without a browser. Exits with 1 if statements are
+    missing, for health checks"""
+    parser = make_parser('Show the statements filed and missing per account')
+    args = parser.parse_args()
+    from ambiguity.account_manager import AccountManager
+    from ambiguity.status import account_status, format_status
+    logging.getLogger("ambiguity").setLevel(logging.WARNING)
+    am = AccountManager(get_settings(args))
+    statuses = [account_status(acct) for acct in am.accounts]
+    print(format_status(statuses))
+    if any(status.missing for status in statuses):
+        import sys
+        sys.exit(1)
@@ -0,0 +1,119 @@
+"""Declarative conditions for SimpleChromeDriver.wait_for"""
+from fnmatch import fnmatch
+import os
+
+from ambiguity.downloads import is_partial
+
+DOM_QUIET_JS = """
+if (!window.__ambiMutations) {
+    window.__ambiMutations = {last: performance.now()};
+    new MutationObserver(function() {
+        window.__ambiMutations.last = performance.now();
+    }).observe(document, {subtree: true, childList: true,
+                          attributes: true, characterData: true});
+}
+return performance.now() - window.__ambiMutations.last;
+"""
+
+NETWORK_QUIET_JS = """
+if (document.readyState !== "complete") {
+    return 0;
+}
+var last = 0;
+var entries = performance.getEntriesByType("resource");
+for (var i = 0; i < entries.length; i++) {
+    last = Math.max(last, entries[i].responseEnd);
+}
+return performance.now() - last;
+"""
+
+
+class Condition(object):  # pylint: disable=too-few-public-methods
+    """A described predicate on the driver. Calling it returns something
+    truthy, often the element waited for, once the condition holds"""
+
+    def __init__(self, description, check):
+        self.description = description
+        self.check = check
+
+    def __call__(self, scd):
+        return self.check(scd)
+
+    def __repr__(self):
+        return self.description
+
+
+def element_present(selector):
+    """The first element matching the CSS selector exists"""
+    def check(scd):
+        elements = scd.find_all(selector)
+        return elements[0] if elements else False
+    return Condition("{} present".format(selector), check)
+
+
+def element_visible(selector):
+    """The first element matching the CSS selector is displayed"""
+    def check(scd):
+        elements = scd.find_all(selector)
+        if elements and elements[0].is_displayed():
+            return elements[0]
+        return False
+    return Condition("{} visible".format(selector), check)
+
+
+def element_clickable(selector):
+    """The first element matching the CSS selector is displayed and enabled"""
+    def check(scd):
+        elements = scd.find_all(selector)
+        if (elements and elements[0].is_displayed() and
+                elements[0].is_enabled()):
+            return elements[0]
+        return False
+    return Condition("{} clickable".format(selector), check)
+
+
+def element_hidden(selector):
+    """No element matching the CSS selector is displayed"""
+    def check(scd):
+        return not any(el.is_displayed() for el in scd.find_all(selector))
+    return Condition("{} hidden".format(selector), check)
+
+
+def element_displayed(element, description="element"):
+    """An already found element is displayed"""
+    return Condition("{} displayed".format(description),
+                     lambda scd: element.is_displayed())
+
+
+def field_value(field, value):
+    """An input field holds the given value"""
+    return Condition("field value {!r}".format(value),
+                     lambda scd: field.get_attribute("value") == value)
+
+
+def dom_stable(quiet=0.3):
+    """The page's DOM hasn't changed for quiet seconds"""
+    return Condition(
+        "DOM quiet for {}s".format(quiet),
+        lambda scd: scd.execute_script(DOM_QUIET_JS) >= quiet * 1000)
+
+
+def network_idle(quiet=0.5):
+    """The page has loaded and no resource finished for quiet seconds"""
+    return Condition(
+        "network idle for {}s".format(quiet),
+        lambda scd: scd.execute_script(NETWORK_QUIET_JS) >= quiet * 1000)
+
+
+def download_started(download):
+    """A download for the handle is being written or has finished"""
+    def check(scd):
+        for entry in os.scandir(str(scd.download_dir)):
+            if entry.name in download.before:
+                continue
+            if is_partial(entry.name) or fnmatch(entry.name,
+                                                 download.pattern):
+                return True
+        return False
+    return Condition("download of {} started".format(download.pattern),
+                     check)
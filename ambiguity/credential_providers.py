@@ -4,10 +4,24 @@ import getpass
 import logging
 from pathlib import Path
 
-from pykeepass import PyKeePass
+from ambiguity.registry import Registry
 
 LOG = logging.getLogger(__name__)
 
+# provider_type in the settings: credential provider class. Packages can
+# add providers with entry points in the ambiguity.credential_providers group
+CREDENTIAL_PROVIDERS = Registry("ambiguity.credential_providers", {
+    "keepass": "ambiguity.credential_providers:KeepassCP",
+    "stdin": "ambiguity.credential_providers:StdinCP",
+})
+
+
+def log_missing(names):
+    """Warn about credential names that could not be resolved"""
+    if names:
+        LOG.warning("Could not find credentials with names %s, pulling "
+                    "their accounts will fail", ", ".join(names))
+
 
 class CredentialProvider(metaclass=abc.ABCMeta):
     """Abstract base class for all credential providers"""
@@ -17,20 +31,36 @@ class CredentialProvider(metaclass=abc.ABCMeta):
         """Get a (username, password) tuple for the given credential name"""
         pass
 
+    def resolve_all(self, names):
+        """Resolve every credential name up front, returning a StaticCP
+        holding them. Names that can't be resolved are logged and left out,
+        so only the sessions needing them fail"""
+        credentials = []
+        missing = []
+        for name in sorted(names):
+            try:
+                credentials.append((name, self.get_credential(name)))
+            except ValueError:
+                missing.append(name)
+        log_missing(missing)
+        return StaticCP(credentials)
+
     @staticmethod
     def factory(provider_type, **kwargs):
-        """Factory method that returns a credential provider given a type"""
-        if provider_type == "keepass":
-            return KeepassCP(**kwargs)
-        elif provider_type == "stdin":
-            return StdinCP()
-        else:
+        """Factory method that returns a credential provider given a type,
+        looked up in CREDENTIAL_PROVIDERS"""
+        try:
+            cp_cls = CREDENTIAL_PROVIDERS.load(provider_type)
+        except KeyError:
             raise ValueError("Credential provider {} not supported".format(
                 provider_type))
+        return cp_cls(**kwargs)
 
 
 class KeepassCP(CredentialProvider):
-    """Concrete credential provider for keepass databases"""
+    """Concrete credential provider for keepass databases. The database is
+    unlocked once, then indexed by entry title in a single pass, so each
+    lookup after that is a dict lookup"""
 
     def __init__(self, kdbx_file, keyfile=None):
         self.kdbx_file = Path(kdbx_file).expanduser()
@@ -46,12 +76,13 @@ class KeepassCP(CredentialProvider):
                         self.keyfile.absolute()))
         else:
             self.keyfile = None
-        print(self.kdbx_file.absolute(), self.keyfile.absolute())
+        self.index = None
 
     @property
     def kdbx(self):
         """A lazy loaded property for loading the pykeepass database"""
         if not hasattr(self, "__lazy_kdbx"):
+            from pykeepass import PyKeePass
             for _ in range(3):
                 kdbx_pass = getpass.getpass("Keepass password: ")
                 try:
@@ -72,12 +103,30 @@ class KeepassCP(CredentialProvider):
                 sys.exit()
         return getattr(self, "__lazy_kdbx")
 
+    def build_index(self):
+        """Index the (username, password) of every entry by its title,
+        keeping the first of entries sharing a title"""
+        if self.index is None:
+            index = dict()
+            for entry in self.kdbx.entries:
+                if entry.title is not None:
+                    index.setdefault(entry.title,
+                                     (entry.username, entry.password))
+            self.index = index
+        return self.index
+
     def get_credential(self, name):
-        entry = self.kdbx.find_entries_by_title(name, first=True)
-        if entry is None:
+        try:
+            return self.build_index()[name]
+        except KeyError:
             raise ValueError("Could not find credential with name {}".format(
                 name))
-        return entry.username, entry.password
+
+    def resolve_all(self, names):
+        index = self.build_index()
+        log_missing(sorted(set(names) - set(index)))
+        return StaticCP((name, index[name]) for name in names
+                        if name in index)
 
 
 class StdinCP(CredentialProvider):
@@ -87,3 +136,19 @@ class StdinCP(CredentialProvider):
         username = input("{} username: ".format(name))
         password = getpass.getpass("{} password: ".format(name))
         return username, password
+
+
+class StaticCP(CredentialProvider):
+    """Concrete credential provider backed by already resolved credentials,
+    see CredentialProvider.resolve_all. Handy for handing credentials to
+    worker processes that have no stdin"""
+
+    def __init__(self, credentials):
+        self.credentials = dict(credentials)
+
+    def get_credential(self, name):
+        try:
+            return self.credentials[name]
+        except KeyError:
+            raise ValueError("Could not find credential with name {}".format(
+                name))
@@ -0,0 +1,210 @@
+"""A long-lived daemon keeping warm browsers for CLI commands to attach to"""
+import json
+import logging
+import os
+from pathlib import Path
+import socket
+import socketserver
+import threading
+
+LOG = logging.getLogger(__name__)
+
+
+class DaemonClient(object):
+    """Talks to a BrowserDaemon over its unix socket, one JSON request and
+    one JSON reply per connection"""
+
+    def __init__(self, socket_path, timeout=5):
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def request(self, cmd, **kwargs):
+        """Send a command to the daemon and return its reply. Raises OSError
+        if no daemon is listening"""
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(self.timeout)
+            sock.connect(str(self.socket_path))
+            sock.sendall(json.dumps(dict(kwargs, cmd=cmd)).encode() + b"\n")
+            with sock.makefile("rb") as fin:
+                reply = fin.readline()
+        if not reply:
+            raise ConnectionError("Daemon closed the connection")
+        return json.loads(reply.decode())
+
+    def acquire(self):
+        """Borrow a started browser, returning its executor URL, session id
+        and download directory, or an error"""
+        return self.request("acquire")
+
+    def release(self, session_id, healthy=True):
+        """Hand a borrowed browser back to the daemon"""
+        return self.request("release", session_id=session_id, healthy=healthy)
+
+
+class PooledDriver(object):  # pylint: disable=too-few-public-methods
+    """A browser kept by the daemon along with its usage stats"""
+
+    def __init__(self, slot, download_dir, profile_dir, busy=False):
+        from ambiguity.scd import SimpleChromeDriver
+        self.slot = slot
+        self.scd = SimpleChromeDriver(download_dir, profile_dir)
+        self.scd.start()
+        self.uses = 0
+        self.busy = busy
+
+    @property
+    def healthy(self):
+        """Whether the browser still answers commands"""
+        try:
+            self.scd.window_handles  # pylint: disable=pointless-statement
+            return True
+        except Exception:  # pylint: disable=broad-except
+            return False
+
+    def describe(self):
+        """Return what a client needs to attach to the browser"""
+        return {
+            "executor": self.scd.service.service_url,
+            "session_id": self.scd.session_id,
+            "download_dir": str(self.scd.download_dir),
+        }
+
+
+class BrowserDaemon(object):
+    """Keeps a pool of started SimpleChromeDrivers that CLI commands borrow
+    over a unix socket. Browsers failing a health check are replaced, as are
+    browsers that have been borrowed max_uses times"""
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, socket_path, download_dir, profile_dir, size=1,
+                 max_uses=20):
+        self.socket_path = socket_path
+        self.download_dir = download_dir
+        self.profile_dir = profile_dir
+        self.size = size
+        self.max_uses = max_uses
+        self.pool = []
+        self.lock = threading.Lock()
+        self.server = None
+
+    def dirs(self, slot):
+        """Return the download and profile directories of a pool slot. Each
+        browser gets its own copy of the profile, leaving the configured one
+        free for commands starting their own browser when the pool is busy"""
+        profile_dir = self.socket_path.parent / "daemon_profile{}".format(
+            slot)
+        if not profile_dir.exists() and self.profile_dir.exists():
+            from ambiguity.scd import copy_profile
+            copy_profile(self.profile_dir, profile_dir)
+        return self.download_dir / "daemon{}".format(slot), profile_dir
+
+    def recycle(self, pooled, busy=False):
+        """Replace a pooled browser with a freshly started one, left busy
+        if asked. Called without the lock held, on a slot marked busy so no
+        one else takes it meanwhile. If the browser can't be started, the
+        old one is left in its slot to be recycled again next time"""
+        LOG.info("Recycling browser %d after %d uses", pooled.slot,
+                 pooled.uses)
+        try:
+            pooled.scd.quit()
+        except Exception:  # pylint: disable=broad-except
+            LOG.warning("Browser %d did not quit cleanly", pooled.slot)
+        try:
+            fresh = PooledDriver(pooled.slot, *self.dirs(pooled.slot),
+                                 busy=busy)
+        except Exception:  # pylint: disable=broad-except
+            LOG.exception("Could not restart browser %d", pooled.slot)
+            with self.lock:
+                pooled.busy = False
+            return None
+        with self.lock:
+            self.pool[self.pool.index(pooled)] = fresh
+        return fresh
+
+    def acquire(self):
+        """Lend out a free browser, restarting it first if unhealthy"""
+        with self.lock:
+            pooled = next((p for p in self.pool if not p.busy), None)
+            if pooled is None:
+                return {"error": "all browsers are busy"}
+            pooled.busy = True
+        if not pooled.healthy:
+            pooled = self.recycle(pooled, busy=True)
+            if pooled is None:
+                return {"error": "could not restart a browser"}
+        with self.lock:
+            pooled.uses += 1
+        return pooled.describe()
+
+    def release(self, session_id, healthy=True):
+        """Take a browser back, recycling it in the background if it is
+        unhealthy or worn out. It stays busy until restarted"""
+        with self.lock:
+            pooled = next((p for p in self.pool
+                           if p.scd.session_id == session_id), None)
+            if pooled is None:
+                return {"error": "unknown session"}
+            if healthy and pooled.uses < self.max_uses:
+                pooled.busy = False
+                return {"ok": True}
+        threading.Thread(target=self.recycle, args=(pooled,), daemon=True,
+                         name="recycle{}".format(pooled.slot)).start()
+        return {"ok": True}
+
+    def handle(self, message):
+        """Return the reply to a client message"""
+        cmd = message.get("cmd")
+        if cmd == "acquire":
+            return self.acquire()
+        elif cmd == "release":
+            return self.release(message.get("session_id"),
+                                message.get("healthy", True))
+        elif cmd == "status":
+            with self.lock:
+                return {"browsers": [
+                    {"slot": p.slot, "uses": p.uses, "busy": p.busy}
+                    for p in self.pool]}
+        elif cmd == "shutdown":
+            threading.Thread(target=self.server.shutdown).start()
+            return {"ok": True}
+        return {"error": "unknown command {}".format(cmd)}
+
+    def serve_forever(self):
+        """Start the browsers and serve clients until shut down"""
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            """Answers one JSON request per connection"""
+
+            def handle(self):
+                try:
+                    message = json.loads(self.rfile.readline().decode())
+                    reply = daemon.handle(message)
+                except ValueError as ex:
+                    reply = {"error": str(ex)}
+                self.wfile.write(json.dumps(reply).encode() + b"\n")
+
+        # Anyone who can connect can drive the browsers and their logins
+        self.socket_path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        if self.socket_path.exists():
+            self.socket_path.unlink()
+        LOG.info("Starting %d browsers", self.size)
+        self.pool = [PooledDriver(slot, *self.dirs(slot))
+                     for slot in range(self.size)]
+        self.server = socketserver.ThreadingUnixStreamServer(
+            str(self.socket_path), Handler)
+        os.chmod(str(self.socket_path), 0o600)
+        LOG.info("Listening on %s", self.socket_path)
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            self.socket_path.unlink()
+            for pooled in self.pool:
+                pooled.scd.quit()
+
+
+def default_socket_path(settings):
+    """Return the daemon socket path from the settings namespace"""
+    return Path(getattr(settings, "daemon_socket",
+                        "~/.scd/daemon.sock")).expanduser()
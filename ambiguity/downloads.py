@@ -0,0 +1,194 @@
+"""Tracking of browser downloads as they land in the download directory"""
+import ctypes
+import ctypes.util
+from fnmatch import fnmatch
+import logging
+import os
+import select
+import struct
+import sys
+import time
+
+from ambiguity.utils import Deadline
+
+LOG = logging.getLogger(__name__)
+
+# Suffixes of files the browser is still writing to
+PARTIAL_SUFFIXES = (".crdownload", ".part", ".tmp")
+
+# inotify constants from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def is_partial(name):
+    """Return whether a file name belongs to an unfinished download"""
+    return name.endswith(PARTIAL_SUFFIXES)
+
+
+class Download(object):  # pylint: disable=too-few-public-methods
+    """Handle for a download that is expected to land in the download
+    directory. Files that already existed when it was created never match"""
+
+    def __init__(self, pattern, before=()):
+        self.pattern = pattern
+        self.before = set(before)
+        self.created = time.monotonic()
+        self.path = None
+        self.finished = None
+
+    @property
+    def latency(self):
+        """Seconds between expecting the download and it being written"""
+        if self.finished is None:
+            return None
+        return self.finished - self.created
+
+    def __repr__(self):
+        return "Download({!r}, {})".format(
+            self.pattern, self.path.name if self.path else "pending")
+
+
+class DownloadWatcher(object):
+    """Watches a download directory and hands out each fully written file
+    to exactly one Download handle. Uses inotify where available and falls
+    back to polling the directory"""
+
+    POLL_INTERVAL = 0.1
+
+    def __init__(self, download_dir):
+        self.download_dir = download_dir
+        self.download_dir.mkdir(parents=True, exist_ok=True)
+        self.finished = []  # (name, monotonic time) in order of completion
+        self.claimed = set()
+        self.stats = dict()  # (size, mtime) of files seen by the last poll
+        self.stamps = dict()  # (size, mtime) of files when they finished
+        self.fd = self._inotify_init()
+        if self.fd is None:
+            LOG.debug("inotify unavailable, polling %s", download_dir)
+        for entry in os.scandir(str(self.download_dir)):
+            if entry.is_file():
+                self._finish(entry.name)
+                self.stamps[entry.name] = self._stat(entry)
+
+    def _inotify_init(self):
+        """Start watching the directory with inotify, returning the file
+        descriptor or None if inotify is unavailable"""
+        if not sys.platform.startswith("linux"):
+            return None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        if fd < 0:
+            return None
+        wd = libc.inotify_add_watch(
+            fd, os.fsencode(str(self.download_dir)),
+            IN_CLOSE_WRITE | IN_MOVED_TO)
+        if wd < 0:
+            os.close(fd)
+            return None
+        return fd
+
+    def close(self):
+        """Stop watching the directory"""
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def expect(self, pattern):
+        """Return a handle for the next new download matching the glob"""
+        existing = [entry.name
+                    for entry in os.scandir(str(self.download_dir))]
+        return Download(pattern, existing)
+
+    def wait(self, download, seconds=10, error_message="Timeout"):
+        """Wait until a file for the download handle has been completely
+        written and return its Path. Raises TimeoutError otherwise"""
+        with Deadline(seconds, error_message) as deadline:
+            while download.path is None:
+                self._claim(download)
+                if download.path is not None:
+                    break
+                deadline.check()
+                self._update(min(deadline.remaining, 1 if self.fd is not None
+                                 else self.POLL_INTERVAL))
+        LOG.debug("Downloaded %s after %.2fs",
+                  download.path.name, download.latency)
+        return download.path
+
+    def _claim(self, download):
+        """Give the download the oldest finished file it matches"""
+        for name, finished in self.finished:
+            if (name in self.claimed or name in download.before or
+                    not fnmatch(name, download.pattern)):
+                continue
+            path = self.download_dir / name
+            if not path.exists():
+                continue
+            self.claimed.add(name)
+            download.path = path
+            download.finished = finished
+            return
+
+    def _finish(self, name):
+        """Record a fully written file"""
+        if is_partial(name) or name.startswith("."):
+            return
+        self.claimed.discard(name)
+        self.finished = [(n, t) for n, t in self.finished if n != name]
+        self.finished.append((name, time.monotonic()))
+
+    def _update(self, timeout):
+        """Block for up to timeout seconds collecting finished files"""
+        if self.fd is None:
+            time.sleep(timeout)
+            self._poll()
+            return
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return
+        try:
+            buf = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(buf):
+            _wd, _mask, _cookie, length = EVENT_HEADER.unpack_from(
+                buf, offset)
+            offset += EVENT_HEADER.size
+            name = buf[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if name:
+                self._finish(os.fsdecode(name))
+
+    @staticmethod
+    def _stat(entry):
+        """Return what identifies one version of a directory entry"""
+        stat = entry.stat()
+        return stat.st_size, stat.st_mtime_ns
+
+    def _poll(self):
+        """Scan the directory, finishing files whose size stopped changing"""
+        stats = dict()
+        names = set()
+        for entry in os.scandir(str(self.download_dir)):
+            names.add(entry.name)
+            if entry.is_file() and not is_partial(entry.name):
+                stats[entry.name] = self._stat(entry)
+        # Forget files that were moved away so their names can be reused
+        self.finished = [(n, t) for n, t in self.finished if n in stats]
+        self.claimed &= names
+        for name, stat in stats.items():
+            if self.stamps.get(name) == stat:
+                continue
+            partial = any(name + suffix in names
+                          for suffix in PARTIAL_SUFFIXES)
+            if self.stats.get(name) == stat and not partial:
+                self._finish(name)
+                self.stamps[name] = stat
+        self.stats = stats
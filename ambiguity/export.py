@@ -0,0 +1,230 @@
+"""Exporting the statement library to other bookkeeping formats"""
+import datetime
+import hashlib
+import itertools
+import json
+import logging
+import os
+import re
+
+from ambiguity.parsers.cache import ParseCache
+from ambiguity.parsers.dedup import DuplicateIndex
+from ambiguity.parsers.engine import (
+    PARSE_ERRORS, load_statement, statement_files)
+
+LOG = logging.getLogger(__name__)
+
+# Beancount account names: capitalized components joined by colons
+ACCOUNT_NAME_RE = re.compile(r"^[A-Z][A-Za-z0-9-]*(:[A-Z0-9][A-Za-z0-9-]*)+$")
+
+
+def default_account_name(acct):
+    """Return the beancount account of an account missing from the
+    mapping, like Assets:Mitfcu:Checking for mitfcu_checking. Card accounts
+    are liabilities"""
+    kind = "Liabilities" if "Visa" in type(acct).__name__ else "Assets"
+    parts = [re.sub(r"[^A-Za-z0-9-]", "", part).capitalize()
+             for part in acct.name.split("_")]
+    return ":".join([kind] + [part for part in parts if part])
+
+
+def quote(text):
+    """Return a beancount string literal"""
+    return '"{}"'.format(text.replace("\\", "\\\\").replace('"', '\\"'))
+
+
+def format_cents(cents):
+    """Return an amount in cents as a decimal string"""
+    sign = "-" if cents < 0 else ""
+    return "{}{}.{:02d}".format(sign, abs(cents) // 100, abs(cents) % 100)
+
+
+class BeancountExporter(object):
+    """Writes the transactions of a statement library as a beancount
+    ledger. Every statement becomes its own file under the output directory,
+    <account>/<yyyy-mm>.beancount, included from main.beancount along with
+    the open directives. Statements are walked per account in StatementDate
+    order and streamed one at a time from parsing to writing, so memory
+    only grows with the fingerprints of an account's transactions.
+    Transactions already written for an earlier statement of the account,
+    as when statements overlap, are left out, see DuplicateIndex.
+
+    accounts maps account names to beancount accounts, defaulting to
+    default_account_name. categories maps payee regular expressions to the
+    account balancing a transaction, tried in order, falling back to
+    default_category. A hash of the sources of each exported statement and
+    of the account's statements before it is kept in a state file, and
+    only statements whose hash changed since the last export are written
+    again unless full"""
+
+    MAIN_FILE = "main.beancount"
+    STATE_FILE = ".export_state.json"
+    STATE_VERSION = 2
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, output_dir, accounts=None, categories=None,
+                 default_category="Expenses:Uncategorized", currency="USD",
+                 cache_dir=None):
+        self.output_dir = output_dir
+        self.accounts = dict(accounts or {})
+        self.categories = [(re.compile(pattern, re.I), account)
+                           for pattern, account in (categories or {}).items()]
+        self.default_category = default_category
+        self.currency = currency
+        self.cache = ParseCache(cache_dir) if cache_dir is not None else None
+        for name in ([default_category] + list(self.accounts.values()) +
+                     [account for _, account in self.categories]):
+            if not ACCOUNT_NAME_RE.match(name):
+                raise ValueError("Bad beancount account name " + name)
+
+    @classmethod
+    def from_settings(cls, settings, library_dir, cache_dir=None):
+        """Return an exporter configured by the beancount section of the
+        settings, writing to library_dir/beancount by default"""
+        config = dict(getattr(settings, "beancount", None) or {})
+        output_dir = config.pop("output_dir", None)
+        if output_dir is None:
+            output_dir = library_dir / "beancount"
+        else:
+            output_dir = library_dir / os.path.expanduser(output_dir)
+        return cls(output_dir, cache_dir=cache_dir, **config)
+
+    @property
+    def fingerprint(self):
+        """Identifies the configuration the ledger was written with. Any
+        change to it means every statement is written again"""
+        config = repr((sorted(self.accounts.items()),
+                       [(regex.pattern, account)
+                        for regex, account in self.categories],
+                       self.default_category, self.currency))
+        return hashlib.sha1(config.encode()).hexdigest()[:12]
+
+    def account_name(self, acct_name):
+        """Return the beancount account of an account of the library"""
+        return self.accounts[acct_name]
+
+    def category(self, payee):
+        """Return the account balancing a transaction with a payee"""
+        for regex, account in self.categories:
+            if regex.search(payee):
+                return account
+        return self.default_category
+
+    def entries(self, statement, rows, select=None):
+        """Generate the beancount entries of a statement's StatementRows in
+        date order, only the ones at the row indexes in select if given"""
+        account = self.account_name(statement.acct_name)
+        strings = rows.strings
+        if select is None:
+            select = range(len(rows.date))
+        order = sorted(select, key=rows.date.__getitem__)
+        for idx in order:
+            payee = strings[rows.payee[idx]]
+            yield "{} * {} {}\n  {}  {} {}\n  {}\n\n".format(
+                datetime.date.fromordinal(rows.date[idx]).isoformat(),
+                quote(payee), quote(strings[rows.memo[idx]]), account,
+                format_cents(rows.amount[idx]), self.currency,
+                self.category(payee))
+
+    def write_atomic(self, path, chunks):
+        """Write an iterable of text chunks to a file, replacing it only
+        once it is complete"""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + ".tmp")
+        with tmp_path.open("w", encoding="utf-8") as fout:
+            fout.writelines(chunks)
+        os.replace(str(tmp_path), str(path))
+
+    def main_file(self, accounts):
+        """Generate the lines of main.beancount"""
+        yield "option \"operating_currency\" {}\n\n".format(
+            quote(self.currency))
+        if not accounts:
+            return
+        start = min(acct.open_date for acct in accounts)
+        for acct in accounts:
+            yield "{} open {} {}\n".format(
+                acct.open_date.isoformat(), self.account_name(acct.name),
+                self.currency)
+        for category in sorted({self.default_category} |
+                               {account for _, account in self.categories}):
+            yield "{} open {}\n".format(start.isoformat(), category)
+        yield "\n"
+        for acct in accounts:
+            yield "include {}\n".format(
+                quote("{}/*.beancount".format(acct.name)))
+
+    def load_state(self):
+        """Return the sources hash of each exported statement by its
+        <account>/<yyyy-mm>, empty if the ledger was written differently"""
+        try:
+            state = json.loads(
+                (self.output_dir / self.STATE_FILE).read_text())
+        except (OSError, ValueError):
+            return dict()
+        if (state.get("version") != self.STATE_VERSION or
+                state.get("fingerprint") != self.fingerprint):
+            return dict()
+        return state["statements"]
+
+    def save_state(self, statements):
+        """Record the sources hash of each exported statement"""
+        self.write_atomic(self.output_dir / self.STATE_FILE, [json.dumps({
+            "version": self.STATE_VERSION, "fingerprint": self.fingerprint,
+            "statements": statements}, indent=1, sort_keys=True)])
+
+    def export(self, accounts, full=False):
+        """Export the statements of the accounts, returning the number of
+        statements written, left as they were and not parseable"""
+        accounts = list(accounts)
+        for acct in accounts:
+            self.accounts.setdefault(acct.name, default_account_name(acct))
+        previous = dict() if full else self.load_state()
+        exported = dict()
+        written = unchanged = failed = 0
+        for acct_name, statements in itertools.groupby(
+                statement_files(accounts),
+                key=lambda statement: statement.acct_name):
+            index = DuplicateIndex()
+            sources = hashlib.sha256()
+            unread = []  # unchanged statements, not read into index yet
+            for statement in statements:
+                sources.update(statement.sha.encode())
+                key = "{}/{!r}".format(acct_name, statement.sd)
+                path = self.output_dir / (key + ".beancount")
+                if previous.get(key) == sources.hexdigest() and path.exists():
+                    exported[key] = sources.hexdigest()
+                    unchanged += 1
+                    unread.append(statement)
+                    continue
+                # What a changed statement leaves out depends on the ones
+                # before it
+                for earlier in unread:
+                    try:
+                        index.new_rows(acct_name,
+                                       load_statement(earlier, self.cache))
+                    except PARSE_ERRORS:
+                        pass
+                unread = []
+                try:
+                    rows = load_statement(statement, self.cache)
+                except PARSE_ERRORS as ex:
+                    LOG.warning("Could not parse %s: %s", statement.path.name,
+                                ex)
+                    failed += 1
+                    continue
+                self.write_atomic(path, self.entries(
+                    statement, rows, index.new_rows(acct_name, rows)))
+                exported[key] = sources.hexdigest()
+                written += 1
+        # Statements gone from the library take their files with them
+        for key in set(previous) - set(exported):
+            path = self.output_dir / (key + ".beancount")
+            if path.exists():
+                path.unlink()
+        self.write_atomic(self.output_dir / self.MAIN_FILE,
+                          self.main_file(accounts))
+        self.save_state(exported)
+        LOG.info("Exported %d statements to %s, %d unchanged, %d failed",
+                 written, self.output_dir, unchanged, failed)
+        return written, unchanged, failed
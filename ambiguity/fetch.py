@@ -0,0 +1,118 @@
+"""Direct HTTP downloads that reuse the browser's logged in session"""
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import time
+from urllib.parse import urljoin, urlsplit
+
+import urllib3
+
+LOG = logging.getLogger(__name__)
+
+
+class SessionFetcher(object):
+    """Fetches plain GET exports over a pooled keep-alive HTTP connection,
+    sending the cookies of an authenticated browser session. A rebase
+    function can redirect URLs elsewhere, and an on_fetch callback is told
+    the url, dest, content type and seconds taken of every fetch"""
+
+    CHUNK_SIZE = 64 * 1024
+    MAX_REDIRECTS = 5
+    REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+    def __init__(self, cookies, user_agent=None, workers=4):
+        self.cookies = list(cookies)
+        self.workers = workers
+        self.headers = {"User-Agent": user_agent} if user_agent else {}
+        self.pool = urllib3.PoolManager(maxsize=workers, block=True)
+        self.rebase = None
+        self.on_fetch = None
+
+    @classmethod
+    def from_driver(cls, scd, workers=4):
+        """Return a fetcher with the cookies of the driver's current site"""
+        user_agent = scd.execute_script("return navigator.userAgent")
+        return cls(scd.get_cookies(), user_agent, workers)
+
+    def cookie_header(self, url):
+        """Return the Cookie header value the browser would send to url"""
+        parts = urlsplit(url)
+        host = parts.hostname or ""
+        path = parts.path or "/"
+        pairs = []
+        for cookie in self.cookies:
+            domain = cookie.get("domain", host)
+            if domain.startswith("."):
+                # A domain cookie, sent to the domain and its subdomains
+                if host != domain[1:] and not host.endswith(domain):
+                    continue
+            elif host != domain:
+                # A host-only cookie, sent to its exact host only
+                continue
+            if not path.startswith(cookie.get("path", "/")):
+                continue
+            if cookie.get("secure") and parts.scheme != "https":
+                continue
+            pairs.append("{}={}".format(cookie["name"], cookie["value"]))
+        return "; ".join(pairs)
+
+    def request(self, url):
+        """GET url, following redirects with the cookies of each hop's own
+        host, so a redirect elsewhere never sees the session cookies of the
+        site it came from. Returns the final url and its streamed
+        response"""
+        for _ in range(self.MAX_REDIRECTS + 1):
+            headers = dict(self.headers)
+            cookie = self.cookie_header(url)
+            if cookie:
+                headers["Cookie"] = cookie
+            response = self.pool.request(
+                "GET", url, headers=headers, redirect=False,
+                preload_content=False)
+            location = response.headers.get("Location")
+            if response.status not in self.REDIRECT_STATUSES or not location:
+                return url, response
+            response.read()
+            response.release_conn()
+            LOG.debug("Redirected from %s to %s", url, location)
+            url = urljoin(url, location)
+        raise IOError("Too many redirects fetching {}".format(url))
+
+    def fetch(self, url, dest):
+        """Download url to the dest Path, raising IOError on a failed or
+        unexpected response such as a login page served in place of a file"""
+        if self.rebase is not None:
+            url = self.rebase(url)
+        start = time.monotonic()
+        url, response = self.request(url)
+        try:
+            content_type = response.headers.get("Content-Type", "")
+            if response.status != 200:
+                raise IOError("HTTP {} fetching {}".format(
+                    response.status, url))
+            if (content_type.startswith("text/html") and
+                    dest.suffix not in (".html", ".htm")):
+                raise IOError("Got a web page instead of a file from {}"
+                              .format(url))
+            partial = dest.with_name(dest.name + ".part")
+            with partial.open("wb") as fout:
+                for chunk in response.stream(self.CHUNK_SIZE):
+                    fout.write(chunk)
+            partial.rename(dest)
+        finally:
+            response.release_conn()
+        LOG.debug("Fetched %s to %s", url, dest.name)
+        if self.on_fetch is not None:
+            self.on_fetch(url, dest, content_type, time.monotonic() - start)
+        return dest
+
+    def fetch_all(self, jobs):
+        """Concurrently fetch (url, dest) pairs. Returns a list with the Path
+        or the exception raised for each job, in order"""
+        def fetch_job(job):
+            """Fetch one job, handing back exceptions instead of raising"""
+            try:
+                return self.fetch(*job)
+            except (IOError, urllib3.exceptions.HTTPError) as ex:
+                return ex
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(fetch_job, jobs))
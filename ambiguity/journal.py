@@ -0,0 +1,112 @@
+"""Write-ahead journal of a pull, for resuming one that didn't finish"""
+from collections import OrderedDict
+import json
+import logging
+import os
+from pathlib import Path
+import time
+
+from ambiguity.library_index import StagedFile, fsync_dir
+from ambiguity.statement_date import StatementDate
+
+LOG = logging.getLogger(__name__)
+
+
+class PullJournal(object):
+    """Records the state of every statement of a pull, one JSON line per
+    change, each flushed to disk before the pull moves on:
+
+        planned:     in the PullPlan of the pull
+        downloading: its account started pulling it
+        downloaded:  downloaded, checked and staged into the library, see
+                     LibraryIndex.stage, with the path, size and sha256
+        filed:       filed into the library
+
+    The last line of a statement is its state. Workers of a parallel pull
+    append to the same journal, which only holds its path so it can be
+    handed to them"""
+
+    FILE_NAME = ".pull_journal.jsonl"
+    STATES = ("planned", "downloading", "downloaded", "filed")
+
+    def __init__(self, path):
+        self.path = path
+
+    @staticmethod
+    def _line(acct_name, sd, fmt, state, staged=None):
+        """Return the journal line of a statement's state"""
+        record = {"acct": acct_name, "sd": repr(sd), "fmt": fmt,
+                  "state": state, "time": round(time.time(), 3)}
+        if staged is not None:
+            record.update(path=os.path.abspath(str(staged.path)),
+                          size=staged.size, sha=staged.sha)
+        return json.dumps(record, sort_keys=True) + "\n"
+
+    def _append(self, lines):
+        """Append lines to the journal in one write, flushed to disk"""
+        if not lines:
+            return
+        fd = os.open(str(self.path), os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                     0o600)
+        try:
+            os.write(fd, "".join(lines).encode())
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def start(self, plan):
+        """Replace the journal with the statements of a PullPlan, planned"""
+        lines = [self._line(name, sd, fmt, "planned")
+                 for name in plan.by_name
+                 for sd, fmts in plan.statements(name).items()
+                 for fmt in sorted(fmts)]
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        tmp_path.write_text("".join(lines))
+        with tmp_path.open("rb") as fin:
+            os.fsync(fin.fileno())
+        os.replace(str(tmp_path), str(self.path))
+        fsync_dir(self.path.parent)
+
+    def mark(self, acct_name, statements, state):
+        """Record the state of an account's statements, given as
+        {StatementDate: formats}"""
+        self._append([self._line(acct_name, sd, fmt, state)
+                      for sd, fmts in statements.items()
+                      for fmt in sorted(fmts)])
+
+    def record(self, acct_name, sd, fmt, state, staged=None):
+        """Record the state of one statement, with its StagedFile once
+        downloaded"""
+        self._append([self._line(acct_name, sd, fmt, state, staged)])
+
+    def states(self):
+        """Return the last record of every statement in the journal as
+        {(account name, StatementDate, format): record}, in journal order.
+        A line cut short by a crash is skipped"""
+        states = OrderedDict()
+        try:
+            text = self.path.read_text()
+        except FileNotFoundError:
+            return states
+        for line in text.splitlines():
+            try:
+                record = json.loads(line)
+                key = (record["acct"], StatementDate.from_iso(record["sd"]),
+                       record["fmt"])
+            except (ValueError, KeyError):
+                LOG.debug("Skipping journal line %r", line)
+                continue
+            states[key] = record
+        return states
+
+    def pending(self):
+        """Return the records of the statements not filed yet, see states"""
+        return OrderedDict((key, record)
+                           for key, record in self.states().items()
+                           if record["state"] != "filed")
+
+    @staticmethod
+    def staged(record):
+        """Return the StagedFile of a downloaded record"""
+        return StagedFile(Path(record["path"]), record["size"],
+                          record["sha"])
@@ -0,0 +1,219 @@
+"""Persistent index of the statements filed in an account's library"""
+import codecs
+from collections import defaultdict, namedtuple
+import errno
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+
+from ambiguity.statement_date import StatementDate
+
+LOG = logging.getLogger(__name__)
+
+# A checked statement moved into the library folder, synced to disk
+StagedFile = namedtuple("StagedFile", ["path", "size", "sha"])
+
+# How statements of a format start, after any byte order mark and whitespace
+SIGNATURES = {
+    "pdf": (b"%PDF-",),
+    "qfx": (b"OFXHEADER", b"<?xml", b"<OFX"),
+    "ofx": (b"OFXHEADER", b"<?xml", b"<OFX"),
+}
+# How web pages served in place of a statement start, lower cased
+WEB_PAGES = (b"<!doctype html", b"<html")
+
+
+class FilingError(ValueError):
+    """A download that doesn't look like the statement it should be"""
+
+
+def fsync_dir(path):
+    """Flush the entries of a directory to disk"""
+    fd = os.open(str(path), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def check_statement(path, fmt, allow_empty=False):
+    """Flush a downloaded statement to disk and return its size and sha256
+    hex digest, raising FilingError if it is empty, unless allow_empty, a
+    web page or not in its format"""
+    digest = hashlib.sha256()
+    with path.open("rb") as fin:
+        head = fin.read(1024)
+        digest.update(head)
+        for chunk in iter(lambda: fin.read(64 * 1024), b""):
+            digest.update(chunk)
+        size = fin.tell()
+        os.fsync(fin.fileno())
+    if not size:
+        if allow_empty:
+            return size, digest.hexdigest()
+        raise FilingError("{} is empty".format(path.name))
+    if head.startswith(codecs.BOM_UTF8):
+        head = head[len(codecs.BOM_UTF8):]
+    head = head.lstrip()
+    if head.lower().startswith(WEB_PAGES) and fmt not in ("html", "htm"):
+        raise FilingError("{} is a web page, not a {} statement".format(
+            path.name, fmt))
+    if fmt in SIGNATURES and not head.startswith(SIGNATURES[fmt]):
+        raise FilingError("{} is not a {} statement".format(path.name, fmt))
+    return size, digest.hexdigest()
+
+
+def file_digest(path):
+    """Return the sha256 hex digest of a file's contents"""
+    digest = hashlib.sha256()
+    with path.open("rb") as fin:
+        for chunk in iter(lambda: fin.read(64 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class LibraryIndex(object):
+    """A manifest kept in the library folder recording the statement date,
+    size, mtime and hash of every filed statement. Format folders whose
+    mtime hasn't changed since they were indexed are trusted without being
+    listed, so loading costs scale with what changed"""
+
+    FILE_NAME = ".index.json"
+    VERSION = 1
+
+    def __init__(self, lib_dir, name):
+        self.lib_dir = lib_dir
+        self.path = lib_dir / self.FILE_NAME
+        self.file_name_re = re.compile(
+            re.escape(name) + r"_([0-9]{4})_([0-9]{2})\.(\w+)$")
+        self.formats = dict()
+
+    def load(self):
+        """Load the index, rescanning changed format folders, and return the
+        library as a mapping of StatementDate to a set of formats"""
+        self.lib_dir.mkdir(parents=True, exist_ok=True)
+        cached = self._read()
+        formats = dict()
+        changed = False
+        for fmt_dir in self.lib_dir.iterdir():
+            if not fmt_dir.is_dir():
+                continue
+            fmt = fmt_dir.name
+            mtime = fmt_dir.stat().st_mtime_ns
+            entry = cached.get(fmt)
+            if entry is None or entry["mtime"] != mtime:
+                LOG.debug("Indexing %s", fmt_dir)
+                old_files = entry["files"] if entry else dict()
+                entry = {"mtime": mtime,
+                         "files": self._scan(fmt_dir, old_files)}
+                changed = True
+            formats[fmt] = entry
+        if changed or formats.keys() != cached.keys():
+            self.formats = formats
+            self.save()
+        self.formats = formats
+        return self.library
+
+    @property
+    def library(self):
+        """The indexed statements as a mapping of StatementDate to formats"""
+        library = defaultdict(set)
+        for fmt, entry in self.formats.items():
+            for year, month, _size, _mtime, _sha in entry["files"].values():
+                library[StatementDate(year, month)].add(fmt)
+        return library
+
+    def file(self, src_path, dest_path, allow_empty=False):
+        """Atomically file a statement into its format folder and index it,
+        see stage and commit"""
+        self.commit(self.stage(src_path, dest_path, allow_empty), dest_path)
+
+    def stage(self, src_path, dest_path, allow_empty=False):
+        """Check a downloaded statement, see check_statement, and move it
+        into the library folder under a hidden name, leaving the format
+        folders untouched. Returns its StagedFile once it is on disk, so a
+        crash can't leave a partial statement behind"""
+        fmt = dest_path.parent.name
+        size, sha = check_statement(src_path, fmt, allow_empty)
+        staged_path = self.lib_dir / ".{}.staged".format(dest_path.name)
+        try:
+            os.replace(str(src_path), str(staged_path))
+        except OSError as ex:
+            if ex.errno != errno.EXDEV:
+                raise
+            # Downloads on another file system are copied over instead
+            shutil.copyfile(str(src_path), str(staged_path))
+            with staged_path.open("rb") as fin:
+                os.fsync(fin.fileno())
+            src_path.unlink()
+        fsync_dir(self.lib_dir)
+        return StagedFile(staged_path, size, sha)
+
+    def commit(self, staged, dest_path, verify=False):
+        """Rename a StagedFile over dest_path and index it. Its size is
+        checked, and its contents too if verify, raising FilingError if the
+        staged file changed since it was staged"""
+        stat = staged.path.stat()
+        if stat.st_size != staged.size or (
+                verify and file_digest(staged.path) != staged.sha):
+            raise FilingError("{} changed since it was staged".format(
+                staged.path.name))
+        fmt_dir = dest_path.parent
+        entry = self.formats.setdefault(
+            fmt_dir.name, {"mtime": None, "files": dict()})
+        before = fmt_dir.stat().st_mtime_ns
+        os.replace(str(staged.path), str(dest_path))
+        fsync_dir(fmt_dir)
+        fsync_dir(staged.path.parent)
+        # Only vouch for the folder if nothing else changed it beforehand
+        if entry["mtime"] == before:
+            entry["mtime"] = fmt_dir.stat().st_mtime_ns
+        match = self.file_name_re.match(dest_path.name)
+        if match and match.group(3) == fmt_dir.name:
+            entry["files"][dest_path.name] = [
+                int(match.group(1)), int(match.group(2)), staged.size,
+                dest_path.stat().st_mtime_ns, staged.sha]
+        self.save()
+
+    def save(self):
+        """Atomically write the index to disk"""
+        data = {"version": self.VERSION, "formats": self.formats}
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        tmp_path.write_text(json.dumps(data, separators=(",", ":")))
+        os.replace(str(tmp_path), str(self.path))
+
+    def _read(self):
+        """Return the formats stored on disk, or nothing if unusable"""
+        try:
+            data = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return dict()
+        if not isinstance(data, dict) or data.get("version") != self.VERSION:
+            return dict()
+        return data.get("formats", dict())
+
+    def _scan(self, fmt_dir, old_files):
+        """Index every statement in a format folder, reusing the records of
+        files whose size and mtime are unchanged"""
+        files = dict()
+        for path in fmt_dir.iterdir():
+            record = self._record(path, old_files)
+            if record is not None:
+                files[path.name] = record
+        return files
+
+    def _record(self, path, old_files):
+        """Return the [year, month, size, mtime, sha256] record of a file,
+        or None if it isn't a statement of this account"""
+        match = self.file_name_re.match(path.name)
+        if not match or match.group(3) != path.parent.name:
+            return None
+        stat = path.stat()
+        old = old_files.get(path.name)
+        if old and old[2] == stat.st_size and old[3] == stat.st_mtime_ns:
+            return old
+        return [int(match.group(1)), int(match.group(2)), stat.st_size,
+                stat.st_mtime_ns, file_digest(path)]
@@ -0,0 +1,20 @@
+"""Parsers turning the statements in the library into transactions"""
+from ambiguity.parsers.cache import ParseCache
+from ambiguity.parsers.dedup import DedupTable
+from ambiguity.parsers.engine import parse_files, parse_library
+from ambiguity.parsers.formats import ParseError
+from ambiguity.parsers.institutions import parser_for
+from ambiguity.parsers.query import TransactionIndex
+from ambiguity.parsers.store import StorePartition, TransactionStore
+from ambiguity.parsers.table import (
+    StatementRows, Transaction, TransactionTable)
+
+__all__ = [
+    "cache",
+    "dedup",
+    "engine",
+    "formats",
+    "institutions",
+    "query",
+    "store",
+    "table"]
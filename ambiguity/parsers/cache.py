@@ -0,0 +1,88 @@
+"""On-disk cache of parsed statements, keyed by their content"""
+from array import array
+import logging
+import os
+import struct
+import sys
+
+from ambiguity.parsers.table import StatementRows
+
+LOG = logging.getLogger(__name__)
+
+
+class ParseCache(object):
+    """Stores the StatementRows of every parsed statement in a file named by
+    the sha256 of the statement and the cache key of its parser, so an entry
+    is only found again for the same content read by the same parser. An
+    entry is a header, the five columns as little endian arrays and the
+    strings, each ended by a NUL. Entries are written atomically by whichever
+    process parsed the statement"""
+
+    MAGIC = b"AMBPC2"
+    HEADER = struct.Struct("<6sII")  # magic, rows, bytes of strings
+    COLUMNS = (("date", "i"), ("amount", "q"), ("payee", "i"), ("memo", "i"),
+               ("fitid", "i"))
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def path(self, sha, key):
+        """Return the path of an entry, sharded by the start of the hash"""
+        return self.cache_dir / sha[:2] / "{}-{}.bin".format(sha, key)
+
+    def load(self, sha, key):
+        """Return the cached StatementRows of a statement, or None"""
+        try:
+            data = self.path(sha, key).read_bytes()
+            magic, rows, strings_len = self.HEADER.unpack_from(data)
+        except (OSError, struct.error):
+            return None
+        if magic != self.MAGIC:
+            return None
+        offset = self.HEADER.size
+        columns = []
+        for _name, typecode in self.COLUMNS:
+            column = array(typecode)
+            end = offset + rows * column.itemsize
+            column.frombytes(data[offset:end])
+            if sys.byteorder == "big":
+                column.byteswap()
+            columns.append(column)
+            offset = end
+        if offset + strings_len != len(data):
+            LOG.debug("Ignoring truncated cache entry %s", sha)
+            return None
+        strings = data[offset:].decode().split("\0")[:-1]
+        return StatementRows(*columns, strings)
+
+    def store(self, sha, key, rows):
+        """Cache the StatementRows of a statement"""
+        strings = "".join(string.replace("\0", "") + "\0"
+                          for string in rows.strings).encode()
+        parts = [self.HEADER.pack(self.MAGIC, len(rows.date), len(strings))]
+        for name, typecode in self.COLUMNS:
+            column = array(typecode, getattr(rows, name))
+            if sys.byteorder == "big":
+                column.byteswap()
+            parts.append(column.tobytes())
+        parts.append(strings)
+        path = self.path(sha, key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name("{}.{}.tmp".format(path.name, os.getpid()))
+        tmp_path.write_bytes(b"".join(parts))
+        os.replace(str(tmp_path), str(path))
+
+    def prune(self, live):
+        """Delete the entries whose file name isn't in live"""
+        if not self.cache_dir.exists():
+            return
+        removed = 0
+        for shard in os.scandir(str(self.cache_dir)):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name not in live:
+                    os.unlink(entry.path)
+                    removed += 1
+        if removed:
+            LOG.info("Removed %d stale parse cache entries", removed)
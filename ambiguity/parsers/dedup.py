@@ -0,0 +1,135 @@
+"""Merging the transactions that several statement files have in common"""
+from array import array
+from collections import OrderedDict
+import re
+
+from ambiguity.parsers.table import TransactionTable
+
+# Characters of normalized payees compared. Some exports cut payees short
+PAYEE_LENGTH = 16
+
+NON_ALNUM_RE = re.compile(r"[^A-Z0-9]+")
+
+
+def normalize_payee(payee):
+    """Return a payee as it compares across export formats: upper case
+    letters and digits only, cut to PAYEE_LENGTH"""
+    return NON_ALNUM_RE.sub("", payee.upper())[:PAYEE_LENGTH]
+
+
+def fingerprints(rows):
+    """Generate the fingerprint of each transaction of the StatementRows of
+    a file, or anything with their columns: its date, amount and normalized
+    payee, and how many times these came up before in the file"""
+    normalized = [normalize_payee(string) for string in rows.strings]
+    seen = dict()  # fingerprint without occurrence: count in this file
+    for idx in range(len(rows.date)):
+        key = (rows.date[idx], rows.amount[idx], normalized[rows.payee[idx]])
+        occurrence = seen.get(key, 0)
+        seen[key] = occurrence + 1
+        yield key + (occurrence,)
+
+
+class DuplicateIndex(object):
+    """Remembers the transactions read so far, to find them again in
+    another file. A transaction with an id, like an OFX FITID, is found by
+    its account and id, and otherwise by its account and fingerprint among
+    the transactions read without one or with the same id. Ids survive
+    payees reworded between exports, fingerprints let files without ids
+    merge with the ones that have them. Both are hash lookups"""
+
+    def __init__(self):
+        self.ids = dict()  # (account, id): row
+        self.keys = dict()  # (account, fingerprint): (row, id)
+        self.read = 0  # transactions seen by new_rows
+
+    def record(self, account, fingerprint, fitid, row):
+        """Return the row a transaction was read as before, or None after
+        recording it as read as row"""
+        key = (account,) + fingerprint
+        found = self.ids.get((account, fitid)) if fitid else None
+        if found is None:
+            found, found_id = self.keys.get(key, (None, ""))
+            if fitid and found_id and found_id != fitid:
+                found = None
+        if found is None:
+            self.keys.setdefault(key, (row, fitid))
+        elif fitid:
+            self.keys[key] = (found, fitid)
+        if fitid:
+            self.ids.setdefault((account, fitid),
+                                row if found is None else found)
+        return found
+
+    def new_rows(self, account, rows):
+        """Return the indexes of the transactions of an account's
+        StatementRows not read before, as an array, recording them"""
+        new = array("i")
+        for idx, fingerprint in enumerate(fingerprints(rows)):
+            if self.record(account, fingerprint, rows.strings[rows.fitid[idx]],
+                           self.read) is None:
+                new.append(idx)
+            self.read += 1
+        return new
+
+
+class DedupTable(TransactionTable):
+    """A TransactionTable that merges transactions already in it as
+    statements are appended with extend_statement. Every transaction is
+    fingerprinted by its account, date, amount and normalized payee, and by
+    how many times that fingerprint came up before in its own file, so
+    identical transactions within one file stay apart while the same ones in
+    another file, like an overlapping date range or another format of the
+    statement, merge with them. Transactions with the same id from the
+    institution merge whatever their payees, see DuplicateIndex. Each row
+    costs constant time however many files came before.
+
+    Merged rows keep the file they were first read from as their source,
+    and provenance lists every file they were read from"""
+
+    def __init__(self):
+        super().__init__()
+        self.index = DuplicateIndex()
+        self.merged = dict()  # row: array of the codes of later sources
+        self.duplicates = 0
+
+    def extend(self, other):
+        """Append every transaction of another table, merging them as if
+        the rows of each of its source files were appended with
+        extend_statement"""
+        files = OrderedDict()  # (account, source) codes: row indexes
+        for idx in range(len(other)):
+            files.setdefault((other.account[idx], other.source[idx]),
+                             array("i")).append(idx)
+        for (account, source), rows in files.items():
+            self.extend_statement(other.statement_rows(rows),
+                                  other.strings[account],
+                                  other.strings[source])
+
+    def extend_statement(self, rows, account, source):
+        account_code = self.intern(account)
+        source_code = self.intern(source)
+        for idx, fingerprint in enumerate(fingerprints(rows)):
+            fitid = rows.strings[rows.fitid[idx]]
+            row = self.index.record(account_code, fingerprint, fitid,
+                                    len(self.date))
+            if row is not None:
+                self.merged.setdefault(row, array("i")).append(source_code)
+                self.duplicates += 1
+                continue
+            self.date.append(rows.date[idx])
+            self.amount.append(rows.amount[idx])
+            self.payee.append(self.intern(rows.strings[rows.payee[idx]]))
+            self.memo.append(self.intern(rows.strings[rows.memo[idx]]))
+            self.fitid.append(self.intern(fitid))
+            self.account.append(account_code)
+            self.source.append(source_code)
+
+    def provenance(self, idx):
+        """Return the files the transaction at a row index was read from"""
+        return [self.strings[self.source[idx]]] + [
+            self.strings[code] for code in self.merged.get(idx, ())]
+
+    def __repr__(self):
+        return "<DedupTable of {} transactions, {} merged>".format(
+            len(self), self.duplicates)
@@ -0,0 +1,163 @@
+"""Parsing a whole statement library into one transaction table"""
+from array import array
+from collections import defaultdict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import logging
+
+from ambiguity.parsers.cache import ParseCache
+from ambiguity.parsers.dedup import DedupTable
+from ambiguity.parsers.formats import ParseError
+from ambiguity.parsers.institutions import (
+    PARSERS, PREFERRED_FORMATS, parser_for)
+from ambiguity.parsers.table import StatementRows, TransactionTable
+from ambiguity.statement_date import StatementDate
+
+LOG = logging.getLogger(__name__)
+
+# Files handed to a worker process at a time
+CHUNK_SIZE = 64
+
+# What a statement that can't be parsed may raise
+PARSE_ERRORS = (ParseError, OSError, UnicodeError, IndexError, KeyError,
+                ValueError)
+
+# A statement file in the library to be parsed
+StatementFile = namedtuple(
+    "StatementFile", ["acct_type", "acct_name", "sd", "path", "sha"])
+
+
+def statement_files(accounts, all_formats=False):
+    """Generate a StatementFile for the statement files of each account, in
+    statement date order. Only the preferred format of each statement is
+    included unless all_formats"""
+    for acct in accounts:
+        acct_type = type(acct).__name__
+        parsers = PARSERS.get(acct_type, dict())
+        files = defaultdict(dict)
+        for fmt, entry in acct.index.formats.items():
+            if fmt not in parsers:
+                continue
+            for fname, (year, month, _size, _mtime, sha) in entry[
+                    "files"].items():
+                files[year, month][fmt] = (acct.lib_dir / fmt / fname, sha)
+        for ym in sorted(files):
+            fmts = [fmt for fmt in PREFERRED_FORMATS if fmt in files[ym]]
+            for fmt in fmts if all_formats else fmts[:1]:
+                yield StatementFile(acct_type, acct.name, StatementDate(*ym),
+                                    *files[ym][fmt])
+
+
+def parse_statement(parser, path):
+    """Parse a statement file into StatementRows. An empty file is a
+    statement without transactions, as filed when a site has none"""
+    rows = StatementRows(array("i"), array("q"), array("i"), array("i"),
+                         array("i"), [])
+    if path.stat().st_size == 0:
+        return rows
+    codes = dict()
+
+    def intern(string):
+        """Return the code of a string of the statement"""
+        if string not in codes:
+            codes[string] = len(rows.strings)
+            rows.strings.append(string)
+        return codes[string]
+    for date, cents, payee, memo, *fitid in parser.parse(path):
+        rows.date.append(date.toordinal())
+        rows.amount.append(cents)
+        rows.payee.append(intern(payee))
+        rows.memo.append(intern(memo))
+        rows.fitid.append(intern(fitid[0] if fitid else ""))
+    return rows
+
+
+def cache_key(statement):
+    """Return the cache key of the parser of a StatementFile"""
+    return parser_for(statement.acct_type,
+                      statement.path.suffix[1:]).cache_key
+
+
+def load_statement(statement, cache=None):
+    """Return the StatementRows of a StatementFile, from the ParseCache if
+    given and cached there, otherwise parsing and caching it"""
+    key = cache_key(statement)
+    if cache is not None:
+        rows = cache.load(statement.sha, key)
+        if rows is not None:
+            return rows
+    rows = parse_statement(
+        parser_for(statement.acct_type, statement.path.suffix[1:]),
+        statement.path)
+    if cache is not None:
+        cache.store(statement.sha, key, rows)
+    return rows
+
+
+def parse_files(jobs, cache_dir=None):
+    """Parse a list of jobs, caching the results if given a cache
+    directory. Returns the StatementRows of each job, or the error that
+    kept it from being parsed"""
+    cache = ParseCache(cache_dir) if cache_dir is not None else None
+    results = []
+    for statement in jobs:
+        try:
+            results.append(load_statement(statement, cache))
+        except PARSE_ERRORS as ex:
+            results.append(ex)
+    return results
+
+
+# pylint: disable=too-many-locals
+def parse_library(accounts, workers=None, all_formats=False, cache_dir=None,
+                  dedup=False):
+    """Parse the statements of the accounts, returning a TransactionTable
+    and the (file name, error) of each file that couldn't be parsed. With a
+    cache directory, statements parsed before are loaded from it and only
+    the rest are parsed, on a pool of worker processes. workers defaults to
+    the number of CPUs. With dedup, the table is a DedupTable merging the
+    transactions found in more than one file"""
+    jobs = list(statement_files(accounts, all_formats))
+    cache = ParseCache(cache_dir) if cache_dir is not None else None
+    results = [None] * len(jobs)
+    if cache is not None:
+        for idx, statement in enumerate(jobs):
+            results[idx] = cache.load(statement.sha, cache_key(statement))
+    missed = [idx for idx, rows in enumerate(results) if rows is None]
+    chunks = [missed[i:i + CHUNK_SIZE]
+              for i in range(0, len(missed), CHUNK_SIZE)]
+
+    def merge(chunk, parsed):
+        """Put the results of a chunk of jobs in place"""
+        for idx, rows in zip(chunk, parsed):
+            results[idx] = rows
+    if workers == 1 or len(chunks) <= 1:
+        for chunk in chunks:
+            merge(chunk, parse_files([jobs[i] for i in chunk], cache_dir))
+    else:
+        with ProcessPoolExecutor(workers) as executor:
+            parsed = executor.map(
+                parse_files, [[jobs[i] for i in chunk] for chunk in chunks],
+                [cache_dir] * len(chunks))
+            for chunk, chunk_parsed in zip(chunks, parsed):
+                merge(chunk, chunk_parsed)
+
+    table = DedupTable() if dedup else TransactionTable()
+    failures = []
+    for statement, rows in zip(jobs, results):
+        name = statement.path.name
+        if isinstance(rows, Exception):
+            LOG.warning("Could not parse %s: %s", name, rows)
+            failures.append((name, str(rows)))
+        else:
+            table.extend_statement(rows, statement.acct_name, name)
+    if cache is not None and missed:
+        cache.prune(live_cache_entries(accounts, cache))
+    LOG.info("Parsed %d transactions from %d files, %d from cache",
+             len(table), len(jobs) - len(failures), len(jobs) - len(missed))
+    return table, failures
+
+
+def live_cache_entries(accounts, cache):
+    """Return the cache entry names of every parseable statement file"""
+    return {cache.path(statement.sha, cache_key(statement)).name
+            for statement in statement_files(accounts, all_formats=True)}
@@ -0,0 +1,296 @@
+"""Parsers for the statement export formats banks hand out"""
+import abc
+import csv
+import datetime
+from decimal import Decimal, InvalidOperation
+import hashlib
+import html
+import io
+import re
+import zipfile
+from xml.etree import ElementTree
+
+# Column header aliases, lower case
+DATE_COLUMNS = ("date", "posted date", "posting date", "transaction date",
+                "trans. date", "trans date")
+AMOUNT_COLUMNS = ("amount", "transaction amount")
+DEBIT_COLUMNS = ("debit", "debits", "withdrawal", "withdrawals")
+CREDIT_COLUMNS = ("credit", "credits", "deposit", "deposits")
+PAYEE_COLUMNS = ("payee", "description", "name", "merchant")
+MEMO_COLUMNS = ("memo", "notes")
+
+DATE_FORMATS = ("%m/%d/%Y", "%m/%d/%y", "%Y-%m-%d", "%Y%m%d")
+
+# Excel serial day numbers count from here
+EXCEL_EPOCH = datetime.date(1899, 12, 30)
+
+XLSX_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+
+
+class ParseError(ValueError):
+    """A statement file that can't be parsed"""
+
+
+def parse_cents(text):
+    """Return an amount like "$1,234.56", "-12.00" or "(3.50)" in cents"""
+    text = text.strip().replace("$", "").replace(",", "")
+    negative = text.startswith("(") and text.endswith(")")
+    if negative:
+        text = text[1:-1]
+    try:
+        cents = int(Decimal(text).scaleb(2).to_integral_value())
+    except InvalidOperation:
+        raise ParseError("Bad amount {!r}".format(text))
+    return -cents if negative else cents
+
+
+def parse_date(text, formats=DATE_FORMATS):
+    """Return the date in text, trying each format in turn"""
+    text = text.strip()
+    for fmt in formats:
+        try:
+            return datetime.datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    raise ParseError("Bad date {!r}".format(text))
+
+
+class Parser(metaclass=abc.ABCMeta):
+    """Base class of the parsers of one export format. parse yields the
+    (date, cents, payee, memo) of every transaction in a file, followed by
+    the id the institution gave it if the format has one"""
+
+    # Bump when a change makes the parser read files differently
+    VERSION = 1
+
+    @property
+    def cache_key(self):
+        """Identifies the parser class, version and configuration, so
+        cached results are only reused by an identical parser"""
+        config = repr(sorted(vars(self).items()))
+        return "{}{}-{}".format(
+            type(self).__name__, self.VERSION,
+            hashlib.sha1(config.encode()).hexdigest()[:8])
+
+    @abc.abstractmethod
+    def parse(self, path):
+        """Generate the transactions in a statement file"""
+        pass
+
+
+class DelimitedParser(Parser):
+    """Parses comma separated exports. The header row is found by its
+    column names, skipping any summary block above it, and rows without an
+    amount, like opening balances, are skipped. Amounts come from an amount
+    column or from debit and credit columns. negate flips the sign for
+    exports showing charges as positive amounts"""
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, date=DATE_COLUMNS, amount=AMOUNT_COLUMNS,
+                 debit=DEBIT_COLUMNS, credit=CREDIT_COLUMNS,
+                 payee=PAYEE_COLUMNS, memo=MEMO_COLUMNS,
+                 date_formats=DATE_FORMATS, negate=False):
+        self.columns = {"date": date, "amount": amount, "debit": debit,
+                        "credit": credit, "payee": payee, "memo": memo}
+        self.date_formats = date_formats
+        self.negate = negate
+
+    def rows(self, path):
+        """Generate the rows of a file as lists of strings"""
+        with path.open(newline="", encoding="utf-8-sig",
+                       errors="replace") as fin:
+            yield from csv.reader(fin)
+
+    def header(self, row):
+        """Return the index of each known column if row is the header"""
+        names = [cell.strip().lower() for cell in row]
+        found = dict()
+        for column, aliases in self.columns.items():
+            for alias in aliases:
+                if alias in names:
+                    found[column] = names.index(alias)
+                    break
+        if "date" in found and ("amount" in found or "debit" in found or
+                                "credit" in found):
+            return found
+        return None
+
+    def cents(self, row, found):
+        """Return the amount of a row in cents, or None if it has none"""
+        def cell(column):
+            """Return a cell's stripped text, empty if missing"""
+            idx = found.get(column)
+            return row[idx].strip() if idx is not None and idx < len(
+                row) else ""
+        if cell("amount"):
+            cents = parse_cents(cell("amount"))
+        elif cell("debit") or cell("credit"):
+            cents = 0
+            if cell("credit"):
+                cents += abs(parse_cents(cell("credit")))
+            if cell("debit"):
+                cents -= abs(parse_cents(cell("debit")))
+        else:
+            return None
+        return -cents if self.negate else cents
+
+    def date(self, text):
+        """Return the date in a date cell"""
+        return parse_date(text, self.date_formats)
+
+    def parse(self, path):
+        found = None
+        for row in self.rows(path):
+            if found is None:
+                found = self.header(row)
+                continue
+            if not any(cell.strip() for cell in row):
+                continue
+            cents = self.cents(row, found)
+            if cents is None:
+                continue
+            date = self.date(row[found["date"]])
+            payee = row[found["payee"]].strip() if "payee" in found else ""
+            memo = row[found["memo"]].strip() if "memo" in found else ""
+            yield date, cents, payee, memo
+        if found is None:
+            raise ParseError("No transaction header in {}".format(path.name))
+
+
+class TextParser(DelimitedParser):
+    """Parses tab separated or fixed width text exports, where columns are
+    separated by a tab or at least two spaces"""
+
+    SEPARATOR_RE = re.compile(r"\t| {2,}")
+
+    def rows(self, path):
+        with path.open(encoding="utf-8-sig", errors="replace") as fin:
+            for line in fin:
+                yield self.SEPARATOR_RE.split(line.strip())
+
+
+class XLSXParser(DelimitedParser):
+    """Parses the first sheet of a spreadsheet export. Some banks serve
+    delimited text under a spreadsheet name, which is read as such. Broken
+    spreadsheets raise ParseError"""
+
+    # How every zip archive, spreadsheets included, starts
+    ZIP_MAGIC = b"PK\x03\x04"
+
+    def rows(self, path):
+        try:
+            archive = zipfile.ZipFile(str(path))
+        except zipfile.BadZipFile:
+            with path.open("rb") as fin:
+                if fin.read(len(self.ZIP_MAGIC)) == self.ZIP_MAGIC:
+                    raise ParseError("Broken spreadsheet {}".format(
+                        path.name))
+            text = path.read_text(encoding="utf-8-sig", errors="replace")
+            delimiter = "\t" if "\t" in text.split("\n", 1)[0] else ","
+            yield from csv.reader(io.StringIO(text), delimiter=delimiter)
+            return
+        try:
+            with archive:
+                shared = self.shared_strings(archive)
+                sheet = ElementTree.fromstring(
+                    archive.read("xl/worksheets/sheet1.xml"))
+        except (ElementTree.ParseError, zipfile.BadZipFile, KeyError) as ex:
+            raise ParseError("Broken spreadsheet {}: {}".format(
+                path.name, ex))
+        for row in sheet.iter(XLSX_NS + "row"):
+            cells = []
+            for cell in row.iter(XLSX_NS + "c"):
+                col = self.column_index(cell.get("r", ""))
+                if col is not None:
+                    cells.extend([""] * (col - len(cells)))
+                cells.append(self.cell_value(cell, shared))
+            yield cells
+
+    @staticmethod
+    def shared_strings(archive):
+        """Return the shared strings of a spreadsheet archive"""
+        shared = []
+        if "xl/sharedStrings.xml" in archive.namelist():
+            root = ElementTree.fromstring(
+                archive.read("xl/sharedStrings.xml"))
+            for item in root.iter(XLSX_NS + "si"):
+                shared.append("".join(
+                    node.text or "" for node in item.iter(XLSX_NS + "t")))
+        return shared
+
+    @staticmethod
+    def column_index(ref):
+        """Return the zero based column of a cell reference like "C7" """
+        letters = re.match(r"[A-Z]+", ref)
+        if not letters:
+            return None
+        idx = 0
+        for letter in letters.group():
+            idx = idx * 26 + ord(letter) - ord("A") + 1
+        return idx - 1
+
+    @staticmethod
+    def cell_value(cell, shared):
+        """Return the text of a cell"""
+        kind = cell.get("t")
+        if kind == "inlineStr":
+            return "".join(node.text or ""
+                           for node in cell.iter(XLSX_NS + "t"))
+        value = cell.find(XLSX_NS + "v")
+        if value is None or value.text is None:
+            return ""
+        if kind == "s":
+            return shared[int(value.text)]
+        return value.text
+
+    def date(self, text):
+        # Date cells hold the number of days since the Excel epoch
+        if re.match(r"^[0-9]+(\.[0-9]+)?$", text.strip()):
+            return EXCEL_EPOCH + datetime.timedelta(days=int(float(text)))
+        return super().date(text)
+
+
+class OFXParser(Parser):
+    """Parses OFX and QFX exports, in either their SGML or XML flavor,
+    keeping the FITID of each transaction"""
+
+    VERSION = 2
+    TRANSACTION_RE = re.compile(r"<STMTTRN>(.*?)</STMTTRN>", re.S | re.I)
+    TAG_RE = re.compile(r"<(\w+)>([^<\r\n]*)")
+
+    def parse(self, path):
+        text = path.read_text(encoding="latin-1")
+        for match in self.TRANSACTION_RE.finditer(text):
+            fields = {tag.upper(): html.unescape(value.strip())
+                      for tag, value in self.TAG_RE.findall(match.group(1))}
+            if "DTPOSTED" not in fields or "TRNAMT" not in fields:
+                raise ParseError("Incomplete transaction in {}".format(
+                    path.name))
+            payee = fields.get("NAME") or fields.get("PAYEE", "")
+            yield (parse_date(fields["DTPOSTED"][:8], ("%Y%m%d",)),
+                   parse_cents(fields["TRNAMT"]), payee,
+                   fields.get("MEMO", ""), fields.get("FITID", ""))
+
+
+class QIFParser(Parser):
+    """Parses QIF exports, including Quicken's 1/ 2'20 style dates"""
+
+    DATE_FORMATS = ("%m/%d/%Y", "%m/%d/%y", "%m/%d'%y", "%m/%d'%Y",
+                    "%d/%m/%Y")
+
+    def parse(self, path):
+        fields = dict()
+        with path.open(encoding="latin-1") as fin:
+            for line in fin:
+                line = line.rstrip("\r\n")
+                if not line or line.startswith("!"):
+                    continue
+                if line.startswith("^"):
+                    if "T" in fields or "U" in fields:
+                        date = fields["D"].replace(" ", "0")
+                        yield (parse_date(date, self.DATE_FORMATS),
+                               parse_cents(fields.get("T", fields.get("U"))),
+                               fields.get("P", ""), fields.get("M", ""))
+                    fields = dict()
+                else:
+                    fields.setdefault(line[0], line[1:])
@@ -0,0 +1,41 @@
+"""The parser of each export format of each account type"""
+from ambiguity.parsers.formats import (
+    DelimitedParser, OFXParser, QIFParser, TextParser, XLSXParser)
+
+# Account class name: {format: parser}
+PARSERS = {
+    "MITFCU": {
+        "csv": DelimitedParser(),
+    },
+    "MITFCUVisa": {
+        "csv": DelimitedParser(),
+        "xlsx": XLSXParser(),
+        "qfx": OFXParser(),
+        "ofx": OFXParser(),
+    },
+    "BoA": {
+        "csv": DelimitedParser(),
+        "qfx": OFXParser(),
+        "qif": QIFParser(),
+        "txt": TextParser(),
+    },
+    "BoAVisa": {
+        "csv": DelimitedParser(payee=("payee",), memo=("reference number",)),
+        "qfx": OFXParser(),
+        "qif": QIFParser(),
+    },
+    "USBankVisa": {
+        "csv": DelimitedParser(payee=("name",), memo=("memo",)),
+        "qfx": OFXParser(),
+        "qif": QIFParser(),
+    },
+}
+
+# Formats to read a statement from when only one copy of it is parsed, the
+# ones carrying the most structure first
+PREFERRED_FORMATS = ("qfx", "ofx", "csv", "qif", "xlsx", "txt")
+
+
+def parser_for(acct_type, fmt):
+    """Return the parser of a format for an account class name, or None"""
+    return PARSERS.get(acct_type, dict()).get(fmt)
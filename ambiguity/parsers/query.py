@@ -0,0 +1,247 @@
+"""Indexed lookups over a transaction table"""
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from decimal import Decimal
+import logging
+import os
+import re
+import struct
+import sys
+
+from ambiguity.parsers.table import TransactionTable
+
+LOG = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    """Return the lower case words of a payee"""
+    return TOKEN_RE.findall(text.lower())
+
+
+def to_cents(amount):
+    """Return an amount given as a number or string of dollars in cents"""
+    return int(Decimal(str(amount)).scaleb(2).to_integral_value())
+
+
+def sorted_rows(table, column, key):
+    """Return the row numbers of a table sorted by key, and for each
+    string code of column where its rows start, as arrays. The rows of a
+    code c are rows[starts[c]:starts[c + 1]]"""
+    codes = getattr(table, column)
+    rows = array("i", sorted(range(len(table)),
+                             key=lambda idx: (codes[idx], key(idx))))
+    counts = array("i", [0]) * (len(table.strings) + 1)
+    for code in codes:
+        counts[code + 1] += 1
+    for code in range(len(table.strings)):
+        counts[code + 1] += counts[code]
+    return rows, counts
+
+
+class TransactionIndex(object):
+    """Indexes a TransactionTable for queries: row numbers sorted by date,
+    by amount, by payee and by account, the last two then by date, each
+    with the offsets where the rows of a payee or account start, and an
+    inverted index from payee words to payee strings. A query starts from
+    whichever index narrows it down the most and checks the other
+    conditions against the table's columns, so it costs about the size of
+    its smallest candidate set rather than the size of the table.
+
+    The index is all flat arrays, so save writes it to a file along with
+    its table and load reads both back without redoing any of the work"""
+
+    MAGIC = b"AMBIX1"
+    HEADER = struct.Struct("<6s32s16QQ")  # magic, key, arrays, strings
+    TABLE_ARRAYS = (("date", "i"), ("amount", "q"), ("payee", "i"),
+                    ("memo", "i"), ("account", "i"), ("source", "i"),
+                    ("fitid", "i"))
+    INDEX_ARRAYS = (("by_date", "i"), ("dates", "i"), ("by_amount", "i"),
+                    ("amounts", "q"), ("by_payee", "i"), ("payee_starts", "i"),
+                    ("by_account", "i"), ("account_dates", "i"),
+                    ("account_starts", "i"))
+
+    def __init__(self, table, arrays=None):
+        self.table = table
+        if arrays is not None:
+            self.__dict__.update(arrays)
+        else:
+            self.by_date = array("i", sorted(range(len(table)),
+                                             key=table.date.__getitem__))
+            self.dates = array("i", (table.date[idx]
+                                     for idx in self.by_date))
+            self.by_amount = array("i", sorted(range(len(table)),
+                                               key=table.amount.__getitem__))
+            self.amounts = array("q", (table.amount[idx]
+                                       for idx in self.by_amount))
+            self.by_payee, self.payee_starts = sorted_rows(
+                table, "payee", table.date.__getitem__)
+            self.by_account, self.account_starts = sorted_rows(
+                table, "account", table.date.__getitem__)
+            self.account_dates = array("i", (table.date[idx]
+                                             for idx in self.by_account))
+        self.tokens = defaultdict(set)
+        for code, string in enumerate(table.strings):
+            if self.payee_starts[code] < self.payee_starts[code + 1]:
+                for token in tokenize(string):
+                    self.tokens[token].add(code)
+
+    def __len__(self):
+        return len(self.table)
+
+    def save(self, path, key):
+        """Write the table and index to a file atomically, under a key of
+        32 bytes identifying what they were built from"""
+        arrays = [getattr(self.table, name) for name, _ in self.TABLE_ARRAYS]
+        arrays += [getattr(self, name) for name, _ in self.INDEX_ARRAYS]
+        strings = "".join(string.replace("\0", "") + "\0"
+                          for string in self.table.strings).encode()
+        parts = [self.HEADER.pack(self.MAGIC, key,
+                                  *[len(column) for column in arrays],
+                                  len(strings))]
+        for column in arrays:
+            if sys.byteorder == "big":
+                column = array(column.typecode, column)
+                column.byteswap()
+            parts.append(column.tobytes())
+        parts.append(strings)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name("{}.{}.tmp".format(path.name, os.getpid()))
+        tmp_path.write_bytes(b"".join(parts))
+        os.replace(str(tmp_path), str(path))
+
+    @classmethod
+    def load(cls, path, key):
+        """Return the TransactionIndex saved to a file under a key, over a
+        plain TransactionTable, or None if there is none or it was saved
+        under another key"""
+        try:
+            data = path.read_bytes()
+            header = cls.HEADER.unpack_from(data)
+        except (OSError, struct.error):
+            return None
+        magic, saved_key, lengths = header[0], header[1], header[2:]
+        if magic != cls.MAGIC or saved_key != key:
+            return None
+        columns = []
+        offset = cls.HEADER.size
+        for (_name, typecode), length in zip(
+                cls.TABLE_ARRAYS + cls.INDEX_ARRAYS, lengths):
+            column = array(typecode)
+            end = offset + length * column.itemsize
+            column.frombytes(data[offset:end])
+            if sys.byteorder == "big":
+                column.byteswap()
+            columns.append(column)
+            offset = end
+        if offset + lengths[-1] != len(data):
+            LOG.debug("Ignoring truncated index %s", path.name)
+            return None
+        table = TransactionTable()
+        for (name, _), column in zip(cls.TABLE_ARRAYS, columns):
+            setattr(table, name, column)
+        table.strings = data[offset:].decode().split("\0")[:-1]
+        table.codes = {string: code
+                       for code, string in enumerate(table.strings)}
+        return cls(table, dict(zip(
+            (name for name, _ in cls.INDEX_ARRAYS),
+            columns[len(cls.TABLE_ARRAYS):])))
+
+    def date_rows(self, start=None, end=None):
+        """Return the rows dated from start to end inclusive, by date"""
+        lo = 0 if start is None else bisect_left(self.dates,
+                                                 start.toordinal())
+        hi = len(self.dates) if end is None else bisect_right(
+            self.dates, end.toordinal())
+        return self.by_date[lo:hi]
+
+    def amount_rows(self, low=None, high=None):
+        """Return the rows with amounts from low to high cents inclusive"""
+        lo = 0 if low is None else bisect_left(self.amounts, low)
+        hi = len(self.amounts) if high is None else bisect_right(
+            self.amounts, high)
+        return self.by_amount[lo:hi]
+
+    def payee_rows(self, code):
+        """Return the rows of a payee string code, by date"""
+        return self.by_payee[self.payee_starts[code]:
+                             self.payee_starts[code + 1]]
+
+    def account_rows(self, accounts, start=None, end=None):
+        """Return the rows of the accounts dated from start to end
+        inclusive, by account and then date"""
+        rows = array("i")
+        for account in accounts:
+            code = self.table.codes.get(account)
+            if code is None:
+                continue
+            lo, hi = self.account_starts[code], self.account_starts[code + 1]
+            if start is not None:
+                lo = bisect_left(self.account_dates, start.toordinal(), lo, hi)
+            if end is not None:
+                hi = bisect_right(self.account_dates, end.toordinal(), lo, hi)
+            rows.extend(self.by_account[lo:hi])
+        return rows
+
+    def payee_codes(self, payee):
+        """Return the payee strings containing every word of payee"""
+        codes = None
+        for token in tokenize(payee):
+            found = self.tokens.get(token, set())
+            codes = found if codes is None else codes & found
+        return codes if codes is not None else set()
+
+    # pylint: disable=too-many-arguments,too-many-locals
+    def query(self, payee=None, accounts=None, start=None, end=None,
+              low=None, high=None):
+        """Return the row numbers of the transactions matching every given
+        condition, by date. payee matches payees containing all its words,
+        accounts is a list of account names, start and end are dates and
+        low and high amounts in dollars, all inclusive"""
+        table = self.table
+        low = None if low is None else to_cents(low)
+        high = None if high is None else to_cents(high)
+        candidates = []  # (size, function returning the rows)
+        codes = None
+        if payee is not None:
+            codes = self.payee_codes(payee)
+            candidates.append((
+                sum(self.payee_starts[code + 1] - self.payee_starts[code]
+                    for code in codes),
+                lambda: [idx for code in codes
+                         for idx in self.payee_rows(code)]))
+        account_codes = None
+        if accounts is not None:
+            account_codes = {table.codes[name] for name in accounts
+                             if name in table.codes}
+            account_rows = self.account_rows(accounts, start, end)
+            candidates.append((len(account_rows), lambda: account_rows))
+        if start is not None or end is not None:
+            date_rows = self.date_rows(start, end)
+            candidates.append((len(date_rows), lambda: date_rows))
+        if low is not None or high is not None:
+            amount_rows = self.amount_rows(low, high)
+            candidates.append((len(amount_rows), lambda: amount_rows))
+        if not candidates:
+            return list(self.by_date)
+        rows = min(candidates, key=lambda candidate: candidate[0])[1]()
+
+        first = None if start is None else start.toordinal()
+        last = None if end is None else end.toordinal()
+        dates, amounts = table.date, table.amount
+        matches = [
+            idx for idx in rows
+            if (codes is None or table.payee[idx] in codes) and
+            (account_codes is None or table.account[idx] in account_codes) and
+            (first is None or dates[idx] >= first) and
+            (last is None or dates[idx] <= last) and
+            (low is None or amounts[idx] >= low) and
+            (high is None or amounts[idx] <= high)]
+        matches.sort(key=lambda idx: (dates[idx], idx))
+        return matches
+
+    def transactions(self, **conditions):
+        """Return the Transactions matching a query, by date"""
+        return [self.table.row(idx) for idx in self.query(**conditions)]
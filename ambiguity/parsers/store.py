@@ -0,0 +1,230 @@
+"""Memory mapped store of the parsed transactions of the library"""
+from array import array
+from collections import namedtuple
+import hashlib
+import json
+import logging
+import mmap
+import os
+import shutil
+import sys
+
+from ambiguity.parsers.cache import ParseCache
+from ambiguity.parsers.dedup import DedupTable, DuplicateIndex
+from ambiguity.parsers.engine import (
+    PARSE_ERRORS, StatementFile, load_statement, statement_files)
+from ambiguity.parsers.institutions import PARSERS, PREFERRED_FORMATS
+from ambiguity.parsers.query import TransactionIndex
+from ambiguity.parsers.table import TransactionTable
+from ambiguity.statement_date import StatementDate
+
+LOG = logging.getLogger(__name__)
+
+# The transactions of one statement of an account, as read from the store.
+# Columns are read-only views of the mapped files
+StorePartition = namedtuple(
+    "StorePartition", ["account", "sd", "source", "date", "amount", "payee",
+                       "memo", "fitid", "strings"])
+
+
+class TransactionStore(object):
+    """Keeps the transactions of every statement in the library as fixed
+    width columns, one file each, partitioned by account and statement
+    date: <account>/<yyyy-mm>.<sha>/ holds little endian date, amount,
+    payee, memo and fitid files and the partition's strings, each ended by
+    a NUL. Readers map the column files, so processes reading the store
+    share its pages instead of each parsing and holding their own copy.
+
+    Each account has a manifest of its partitions, replaced atomically when
+    a statement is added, after which the partition it replaced is deleted.
+    A statement is stored from its most structured format, see
+    PREFERRED_FORMATS, and stored again when that format is filed anew.
+    Indexes of the accounts queried are kept in .index, see index"""
+
+    MANIFEST = "partitions.json"
+    INDEX_DIR = ".index"
+    VERSION = 2
+    COLUMNS = ParseCache.COLUMNS
+
+    def __init__(self, store_dir, cache_dir=None):
+        self.store_dir = store_dir
+        self.cache = ParseCache(cache_dir) if cache_dir is not None else None
+
+    def manifest(self, acct_name):
+        """Return the partitions of an account as {yyyy-mm: entry}"""
+        try:
+            data = json.loads(
+                (self.store_dir / acct_name / self.MANIFEST).read_text())
+        except (OSError, ValueError):
+            return dict()
+        if data.get("version") != self.VERSION:
+            return dict()
+        return data["partitions"]
+
+    def _save_manifest(self, acct_name, partitions):
+        """Atomically replace the manifest of an account"""
+        path = self.store_dir / acct_name / self.MANIFEST
+        tmp_path = path.with_name("{}.{}.tmp".format(path.name, os.getpid()))
+        tmp_path.write_text(json.dumps(
+            {"version": self.VERSION, "partitions": partitions},
+            indent=1, sort_keys=True))
+        os.replace(str(tmp_path), str(path))
+
+    @staticmethod
+    def wanted(statement, entry):
+        """Return whether a StatementFile should replace a stored entry"""
+        fmt = statement.path.suffix[1:]
+        if fmt not in PARSERS.get(statement.acct_type, dict()):
+            return False
+        if entry is None:
+            return True
+        if fmt == entry["fmt"]:
+            return statement.sha != entry["sha"]
+        return PREFERRED_FORMATS.index(fmt) < PREFERRED_FORMATS.index(
+            entry["fmt"])
+
+    def add(self, statement):
+        """Parse a StatementFile and store its transactions if it is the
+        best format of its statement. Returns whether it was stored"""
+        partitions = self.manifest(statement.acct_name)
+        key = repr(statement.sd)
+        old = partitions.get(key)
+        if not self.wanted(statement, old):
+            return False
+        try:
+            rows = load_statement(statement, self.cache)
+        except PARSE_ERRORS as ex:
+            LOG.warning("Could not store %s: %s", statement.path.name, ex)
+            return False
+        part_name = "{}.{}".format(key, statement.sha[:16])
+        part_dir = self.store_dir / statement.acct_name / part_name
+        tmp_dir = part_dir.with_name(part_name + ".tmp")
+        shutil.rmtree(str(tmp_dir), ignore_errors=True)
+        tmp_dir.mkdir(parents=True)
+        for name, typecode in self.COLUMNS:
+            column = array(typecode, getattr(rows, name))
+            if sys.byteorder == "big":
+                column.byteswap()
+            (tmp_dir / name).write_bytes(column.tobytes())
+        (tmp_dir / "strings").write_bytes("".join(
+            string.replace("\0", "") + "\0"
+            for string in rows.strings).encode())
+        if part_dir.exists():
+            shutil.rmtree(str(part_dir))
+        os.replace(str(tmp_dir), str(part_dir))
+        partitions[key] = {"dir": part_name, "fmt": statement.path.suffix[1:],
+                           "sha": statement.sha, "rows": len(rows.date),
+                           "source": statement.path.name}
+        self._save_manifest(statement.acct_name, partitions)
+        if old is not None and old["dir"] != part_name:
+            # Readers that mapped the old partition keep their pages
+            shutil.rmtree(str(self.store_dir / statement.acct_name /
+                              old["dir"]), ignore_errors=True)
+        return True
+
+    def add_filed(self, acct, sd, fmt):
+        """Store a statement an account just filed into its library"""
+        fname = "{}_{}_{}.{}".format(
+            acct.name, sd.year, str(sd.month).zfill(2), fmt)
+        record = acct.index.formats.get(fmt, {}).get("files", {}).get(fname)
+        if record is None:
+            return False
+        return self.add(StatementFile(type(acct).__name__, acct.name, sd,
+                                      acct.lib_dir / fmt / fname, record[4]))
+
+    def sync(self, accounts):
+        """Store every statement of the accounts missing from the store or
+        changed since, and drop partitions whose statements are gone.
+        Returns the number of statements stored"""
+        stored = 0
+        for acct in accounts:
+            live = set()
+            for statement in statement_files([acct]):
+                live.add(repr(statement.sd))
+                if self.add(statement):
+                    stored += 1
+            partitions = self.manifest(acct.name)
+            gone = set(partitions) - live
+            if gone:
+                for key in gone:
+                    shutil.rmtree(str(self.store_dir / acct.name /
+                                      partitions.pop(key)["dir"]),
+                                  ignore_errors=True)
+                self._save_manifest(acct.name, partitions)
+        if stored:
+            LOG.info("Stored the transactions of %d statements", stored)
+        return stored
+
+    def _map(self, path, typecode):
+        """Return a read-only view of a column file as typecode items"""
+        if sys.byteorder == "big":
+            column = array(typecode)
+            column.frombytes(path.read_bytes())
+            column.byteswap()
+            return column
+        with path.open("rb") as fin:
+            if os.fstat(fin.fileno()).st_size == 0:
+                return array(typecode)
+            mapped = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(mapped).cast(typecode)
+
+    def partitions(self, acct_name, start=None, end=None):
+        """Generate the StorePartitions of an account in StatementDate
+        order, from the StatementDates start to end inclusive"""
+        for key, entry in sorted(self.manifest(acct_name).items()):
+            sd = StatementDate.from_iso(key)
+            if (start is not None and sd < start) or (
+                    end is not None and end < sd):
+                continue
+            part_dir = self.store_dir / acct_name / entry["dir"]
+            try:
+                columns = [self._map(part_dir / name, typecode)
+                           for name, typecode in self.COLUMNS]
+                strings = (part_dir / "strings").read_bytes().decode()
+            except OSError:
+                # Replaced by a writer since the manifest was read
+                LOG.debug("Partition %s of %s went away", key, acct_name)
+                continue
+            yield StorePartition(acct_name, sd, entry["source"], *columns,
+                                 strings.split("\0")[:-1])
+
+    def unique_rows(self, acct_names, start=None, end=None):
+        """Generate each StorePartition of the accounts with the array of
+        its row indexes not already read from another statement of the
+        account, the rows a DedupTable would keep. Only fingerprints and
+        ids are held, one account at a time, the rows stay in the mapped
+        columns"""
+        for acct_name in acct_names:
+            index = DuplicateIndex()
+            for part in self.partitions(acct_name, start, end):
+                yield part, index.new_rows(acct_name, part)
+
+    def index(self, acct_names):
+        """Return a TransactionIndex over the deduplicated transactions of
+        the accounts. It is saved in the store, under the partitions it was
+        built from, and loaded from there until they change"""
+        acct_names = list(acct_names)
+        path = self.store_dir / self.INDEX_DIR / "{}.bin".format(
+            hashlib.sha256(json.dumps(acct_names).encode()).hexdigest()[:16])
+        key = hashlib.sha256(json.dumps(
+            [self.VERSION] + [self.manifest(acct_name)
+                              for acct_name in acct_names],
+            sort_keys=True).encode()).digest()
+        index = TransactionIndex.load(path, key)
+        if index is None:
+            table = TransactionTable()
+            for part, rows in self.unique_rows(acct_names):
+                table.extend_statement(part, part.account, part.source, rows)
+            index = TransactionIndex(table)
+            index.save(path, key)
+            LOG.debug("Indexed %d transactions", len(table))
+        return index
+
+    def table(self, acct_names, start=None, end=None, dedup=False):
+        """Return the stored transactions of the accounts as one
+        TransactionTable, or a DedupTable if dedup"""
+        table = DedupTable() if dedup else TransactionTable()
+        for acct_name in acct_names:
+            for part in self.partitions(acct_name, start, end):
+                table.extend_statement(part, acct_name, part.source)
+        return table
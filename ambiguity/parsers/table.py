@@ -0,0 +1,117 @@
+"""A columnar table of transactions"""
+from array import array
+from collections import namedtuple
+import datetime
+from decimal import Decimal
+
+Transaction = namedtuple(
+    "Transaction", ["date", "amount", "payee", "memo", "account", "source"])
+
+# The transactions of one statement file: date, amount, payee, memo and
+# fitid columns, the last three coding into strings. fitid is the id the
+# institution gave a transaction, or "" if the format has none
+StatementRows = namedtuple(
+    "StatementRows", ["date", "amount", "payee", "memo", "fitid", "strings"])
+
+# Columns holding codes into the table's string pool
+STRING_COLUMNS = ("payee", "memo", "account", "source", "fitid")
+
+
+class TransactionTable(object):
+    """Transactions stored column by column in typed arrays: dates as
+    proleptic ordinals, amounts in cents, and payees, memos, accounts,
+    source files and the ids institutions gave transactions, "" for none,
+    as codes into one pool of distinct strings. Memory grows
+    with the columns rather than with an object per row. Rows read back as
+    Transaction tuples"""
+
+    def __init__(self):
+        self.date = array("i")
+        self.amount = array("q")
+        self.payee = array("i")
+        self.memo = array("i")
+        self.account = array("i")
+        self.source = array("i")
+        self.fitid = array("i")
+        self.strings = []
+        self.codes = dict()
+
+    def __len__(self):
+        return len(self.date)
+
+    def intern(self, string):
+        """Return the code of a string in the pool, adding it if new"""
+        code = self.codes.get(string)
+        if code is None:
+            code = self.codes[string] = len(self.strings)
+            self.strings.append(string)
+        return code
+
+    # pylint: disable=too-many-arguments
+    def append(self, date, cents, payee, memo, account, source, fitid=""):
+        """Add a transaction given its date and amount in cents"""
+        self.date.append(date.toordinal())
+        self.amount.append(cents)
+        self.payee.append(self.intern(payee))
+        self.memo.append(self.intern(memo))
+        self.account.append(self.intern(account))
+        self.source.append(self.intern(source))
+        self.fitid.append(self.intern(fitid))
+
+    def extend(self, other):
+        """Append every transaction of another table"""
+        remap = array("i", (self.intern(string) for string in other.strings))
+        self.date.extend(other.date)
+        self.amount.extend(other.amount)
+        for column in STRING_COLUMNS:
+            getattr(self, column).extend(
+                remap[code] for code in getattr(other, column))
+
+    def extend_statement(self, rows, account, source, select=None):
+        """Append the StatementRows of a file with its account and source,
+        only the ones at the row indexes in select if given"""
+        remap = array("i", (self.intern(string) for string in rows.strings))
+        if select is None:
+            select = range(len(rows.date))
+        self.date.extend(rows.date[idx] for idx in select)
+        self.amount.extend(rows.amount[idx] for idx in select)
+        self.payee.extend(remap[rows.payee[idx]] for idx in select)
+        self.memo.extend(remap[rows.memo[idx]] for idx in select)
+        self.fitid.extend(remap[rows.fitid[idx]] for idx in select)
+        self.account.extend([self.intern(account)] * len(select))
+        self.source.extend([self.intern(source)] * len(select))
+
+    def statement_rows(self, rows):
+        """Return the transactions at row indexes as StatementRows, coding
+        into the strings they use only"""
+        statement = StatementRows(array("i"), array("q"), array("i"),
+                                  array("i"), array("i"), [])
+        remap = dict()  # code in the pool: code in statement.strings
+        for idx in rows:
+            statement.date.append(self.date[idx])
+            statement.amount.append(self.amount[idx])
+            for column in ("payee", "memo", "fitid"):
+                code = getattr(self, column)[idx]
+                if code not in remap:
+                    remap[code] = len(statement.strings)
+                    statement.strings.append(self.strings[code])
+                getattr(statement, column).append(remap[code])
+        return statement
+
+    def row(self, idx):
+        """Return the transaction at a row index"""
+        strings = self.strings
+        return Transaction(
+            datetime.date.fromordinal(self.date[idx]),
+            Decimal(self.amount[idx]).scaleb(-2),
+            strings[self.payee[idx]],
+            strings[self.memo[idx]],
+            strings[self.account[idx]],
+            strings[self.source[idx]])
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self.row(idx)
+
+    def __repr__(self):
+        return "<TransactionTable of {} transactions>".format(len(self))
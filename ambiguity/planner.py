@@ -0,0 +1,121 @@
+"""Planning which statements to pull, with months as bits of an integer.
+Bit n of a mask stands for the StatementDate whose ym is BASE_YM + n"""
+from collections import namedtuple, OrderedDict
+import datetime
+
+from ambiguity.statement_date import StatementDate
+
+# The month of bit 0, keeping masks a few hundred bytes long
+BASE_YM = StatementDate(1900, 1).ym
+
+# The missing statements of an account: {format: mask}
+PlannedAccount = namedtuple("PlannedAccount",
+                            ["name", "acct_type", "missing"])
+
+
+def bit(sd):
+    """Return the mask of one StatementDate"""
+    return 1 << (sd.ym - BASE_YM)
+
+
+def span_mask(first, last):
+    """Return the mask of the yms from first up to but excluding last"""
+    if last <= first:
+        return 0
+    return ((1 << (last - first)) - 1) << (first - BASE_YM)
+
+
+def iter_bits(mask):
+    """Generate the yms set in a mask, in order"""
+    while mask:
+        low = mask & -mask
+        yield BASE_YM + low.bit_length() - 1
+        mask ^= low
+
+
+def format_masks(statements):
+    """Return {format: mask} of a mapping of StatementDate to formats"""
+    masks = dict()
+    for sd, fmts in statements.items():
+        sd_bit = bit(sd)
+        for fmt in fmts:
+            masks[fmt] = masks.get(fmt, 0) | sd_bit
+    return masks
+
+
+def expected_mask(open_date, statement_day, today=None):
+    """Return the mask of the statements an account opened on open_date
+    should have had by today. A month's statement is only expected once its
+    statement day has passed"""
+    if today is None:
+        today = datetime.date.today()
+    start = StatementDate.from_datetime(open_date).ym
+    end = StatementDate.from_datetime(today).ym
+    return span_mask(start + 1 - int(open_date.day < statement_day),
+                     end + int(today.day > statement_day))
+
+
+def missing_statements(missing):
+    """Return {format: mask} as {StatementDate: set of formats}"""
+    statements = dict()
+    for fmt, mask in missing.items():
+        for ym in iter_bits(mask):
+            statements.setdefault(StatementDate.from_ym(ym), set()).add(fmt)
+    return OrderedDict(sorted(statements.items()))
+
+
+class PullPlan(object):
+    """The missing statements of a set of accounts, grouped by the login
+    session they can share, in the order the accounts came in"""
+
+    def __init__(self):
+        self.groups = OrderedDict()  # session key: [PlannedAccount]
+        self.by_name = dict()
+
+    def add(self, session_key, planned):
+        """Add the PlannedAccount of an account with missing statements"""
+        self.groups.setdefault(session_key, []).append(planned)
+        self.by_name[planned.name] = planned
+
+    def __contains__(self, name):
+        return name in self.by_name
+
+    def __len__(self):
+        """The number of statements to pull, counting each format"""
+        return sum(bin(mask).count("1") for planned in self.by_name.values()
+                   for mask in planned.missing.values())
+
+    def statements(self, name):
+        """Return the missing statements of an account as {StatementDate:
+        set of formats}, empty if it has none"""
+        planned = self.by_name.get(name)
+        return missing_statements(planned.missing) if planned else dict()
+
+    def to_dict(self):
+        """Return the plan as plain lists and dicts, for YAML or JSON"""
+        groups = []
+        for (institution, cred_name), accounts in self.groups.items():
+            groups.append({
+                "institution": institution,
+                "cred_name": cred_name,
+                "accounts": [{
+                    "name": planned.name,
+                    "acct_type": planned.acct_type,
+                    "missing": dict(
+                        (repr(sd), sorted(fmts)) for sd, fmts in
+                        missing_statements(planned.missing).items()),
+                } for planned in accounts]})
+        return {"statements": len(self), "groups": groups}
+
+
+def plan_pulls(accounts, today=None):
+    """Return the PullPlan of the missing statements of every account.
+    Each account costs a few integer operations per format, however many
+    months it covers"""
+    plan = PullPlan()
+    for acct in accounts:
+        missing = acct.missing_masks(today)
+        if missing:
+            plan.add(acct.session_key, PlannedAccount(
+                acct.name, type(acct).__name__, missing))
+    return plan
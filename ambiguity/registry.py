@@ -0,0 +1,65 @@
+"""Registries of pluggable classes, imported only once asked for"""
+import importlib
+import logging
+
+LOG = logging.getLogger(__name__)
+
+
+class Registry(object):
+    """Maps names to classes given as "module:Class" paths, importing a
+    class's module the first time the class is asked for. Names missing
+    from the registry are looked up among the entry points of group, so
+    installed packages can add classes without touching this one:
+
+        entry_points={"ambiguity.account_types": [
+            "Chase=ambiguity_chase:Chase"]}
+    """
+
+    def __init__(self, group, paths):
+        self.group = group
+        self.paths = dict(paths)
+        self.loaded = dict()
+        self.discovered = False
+
+    def register(self, name, path):
+        """Add a "module:Class" path under a name"""
+        self.paths[name] = path
+        self.loaded.pop(name, None)
+
+    def discover(self):
+        """Register the entry points of the group not registered already"""
+        if self.discovered:
+            return
+        self.discovered = True
+        from importlib import metadata
+        try:
+            entry_points = metadata.entry_points(group=self.group)
+        except TypeError:  # Before python 3.10
+            entry_points = metadata.entry_points().get(self.group, [])
+        for entry_point in entry_points:
+            if entry_point.name not in self.paths:
+                LOG.debug("Found %s %s in %s", self.group, entry_point.name,
+                          entry_point.value)
+                self.paths[entry_point.name] = entry_point.value
+
+    def __contains__(self, name):
+        if name not in self.paths:
+            self.discover()
+        return name in self.paths
+
+    def names(self):
+        """Return every name available, including entry points"""
+        self.discover()
+        return sorted(self.paths)
+
+    def load(self, name):
+        """Return the class registered under a name, importing it if needed.
+        Raises KeyError for unknown names"""
+        if name in self.loaded:
+            return self.loaded[name]
+        if name not in self:
+            raise KeyError(name)
+        module_name, _, attr = self.paths[name].partition(":")
+        cls = getattr(importlib.import_module(module_name), attr)
+        self.loaded[name] = cls
+        return cls
@@ -0,0 +1,270 @@
+"""Recording scraper sessions against the real sites and replaying them
+offline from a local server"""
+import base64
+from collections import defaultdict
+import json
+import logging
+import mimetypes
+import re
+import threading
+import time
+from urllib.parse import urljoin, urlsplit
+
+from selenium.common.exceptions import WebDriverException
+
+from ambiguity.standin import StandinServer
+
+LOG = logging.getLogger(__name__)
+
+# Response headers worth replaying. Bodies are stored decoded, so encoding
+# and length headers would be wrong
+KEPT_HEADERS = ("content-type", "content-disposition", "location")
+
+# Content types whose absolute URLs get pointed at the replay server
+TEXT_TYPES = ("text/", "application/javascript", "application/json",
+              "application/x-javascript")
+
+ABSOLUTE_URL_RE = re.compile(rb"https?://([A-Za-z0-9.-]+(?::[0-9]+)?)")
+
+
+def request_key(method, url):
+    """Return the key responses to a request are recorded under"""
+    parts = urlsplit(url)
+    path = parts.path or "/"
+    if parts.query:
+        path += "?" + parts.query
+    return "{} {}{}".format(method, parts.netloc, path)
+
+
+class Recording(object):
+    """A directory of recorded responses: a manifest listing the method,
+    URL, status, headers and server time of each response in the order they
+    were received, and a file per body"""
+
+    MANIFEST = "manifest.json"
+    VERSION = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = []
+        self.lock = threading.Lock()
+        try:
+            data = json.loads((path / self.MANIFEST).read_text())
+        except (OSError, ValueError):
+            return
+        if data.get("version") == self.VERSION:
+            self.entries = data["entries"]
+
+    @property
+    def hosts(self):
+        """Hosts with recorded responses"""
+        return {urlsplit(entry["url"]).netloc for entry in self.entries}
+
+    def clear(self):
+        """Drop everything recorded so far"""
+        with self.lock:
+            self.entries = []
+
+    # pylint: disable=too-many-arguments
+    def add(self, method, url, status, headers, body, elapsed):
+        """Record a response. Thread safe"""
+        headers = {name.lower(): value for name, value in headers.items()
+                   if name.lower() in KEPT_HEADERS}
+        with self.lock:
+            body_name = "bodies/{:05d}".format(len(self.entries))
+            self.entries.append({
+                "method": method, "url": url, "status": status,
+                "headers": headers, "body": body_name,
+                "elapsed": round(elapsed, 4)})
+        body_path = self.path / body_name
+        body_path.parent.mkdir(parents=True, exist_ok=True)
+        body_path.write_bytes(body)
+
+    def add_file(self, url, path, content_type=None, elapsed=0,
+                 attachment=False):
+        """Record a downloaded or fetched file as the response to a GET"""
+        if content_type is None:
+            content_type = (mimetypes.guess_type(path.name)[0] or
+                            "application/octet-stream")
+        headers = {"Content-Type": content_type}
+        if attachment:
+            headers["Content-Disposition"] = (
+                "attachment; filename=" + path.name)
+        self.add("GET", url, 200, headers, path.read_bytes(), elapsed)
+
+    def body(self, entry):
+        """Return the recorded body of an entry"""
+        return (self.path / entry["body"]).read_bytes()
+
+    def save(self):
+        """Write the manifest"""
+        self.path.mkdir(parents=True, exist_ok=True)
+        with self.lock:
+            data = {"version": self.VERSION, "entries": self.entries}
+        (self.path / self.MANIFEST).write_text(json.dumps(data, indent=1))
+
+
+class Recorder(object):
+    """Records what a SimpleChromeDriver receives into a Recording. Network
+    events are read from Chrome's performance log and each response body is
+    fetched over DevTools before the page can discard it"""
+
+    # Tries at fetching a body, it may belong to a window not yet current
+    BODY_TRIES = 3
+
+    def __init__(self, scd, recording):
+        self.scd = scd
+        self.recording = recording
+        self.recording.clear()
+        self.requests = dict()  # requestId: (method, url, timestamp)
+        self.responses = dict()  # requestId: (response, timestamp)
+        self.pending = dict()  # requestId: tries at fetching the body
+        self.downloads = []  # URLs of downloads that began, oldest first
+        self.busy = False
+
+    def collect(self):
+        """Record the responses received since the last call"""
+        if self.busy:
+            return
+        self.busy = True
+        try:
+            for entry in self.scd.get_log("performance"):
+                self._handle(json.loads(entry["message"])["message"])
+            for request_id in list(self.pending):
+                self._record_body(request_id)
+        finally:
+            self.busy = False
+
+    def _handle(self, message):
+        """Track one DevTools event from the performance log"""
+        method = message["method"]
+        params = message.get("params", {})
+        request_id = params.get("requestId")
+        if method == "Network.requestWillBeSent":
+            redirect = params.get("redirectResponse")
+            if redirect is not None and request_id in self.requests:
+                req_method, url, sent = self.requests[request_id]
+                self.recording.add(req_method, url, redirect["status"],
+                                   redirect["headers"], b"",
+                                   params["timestamp"] - sent)
+            request = params["request"]
+            if request["url"].startswith(("http:", "https:")):
+                self.requests[request_id] = (
+                    request["method"], request["url"], params["timestamp"])
+        elif method == "Network.responseReceived":
+            if request_id in self.requests:
+                self.responses[request_id] = (params["response"],
+                                              params["timestamp"])
+        elif method == "Network.loadingFinished":
+            if request_id in self.responses:
+                self.pending[request_id] = 0
+        elif method in ("Page.downloadWillBegin",
+                        "Browser.downloadWillBegin"):
+            self.downloads.append(params["url"])
+
+    def _record_body(self, request_id):
+        """Fetch and record the body of a finished response"""
+        try:
+            result = self.scd.execute_cdp_cmd(
+                "Network.getResponseBody", {"requestId": request_id})
+        except WebDriverException:
+            self.pending[request_id] += 1
+            if self.pending[request_id] >= self.BODY_TRIES:
+                method, url, _sent = self.requests.pop(request_id)
+                LOG.debug("No body recorded for %s %s", method, url)
+                del self.pending[request_id]
+                del self.responses[request_id]
+            return
+        del self.pending[request_id]
+        method, url, sent = self.requests.pop(request_id)
+        response, received = self.responses.pop(request_id)
+        if result.get("base64Encoded"):
+            body = base64.b64decode(result["body"])
+        else:
+            body = result["body"].encode()
+        self.recording.add(method, url, response["status"],
+                           response["headers"], body, received - sent)
+
+    def add_download(self, download):
+        """Record a finished Download as the response to the URL of the
+        oldest download Chrome started"""
+        self.collect()
+        if not self.downloads:
+            LOG.warning("No URL known for download %s", download.path.name)
+            return
+        self.recording.add_file(self.downloads.pop(0), download.path,
+                                elapsed=download.latency or 0,
+                                attachment=True)
+
+    def add_fetch(self, url, path, content_type, elapsed):
+        """Record a file fetched outside the browser"""
+        self.recording.add_file(url, path, content_type, elapsed)
+
+    def stop(self):
+        """Record what's left and write the manifest"""
+        self.collect()
+        self.recording.save()
+        LOG.info("Recorded %d responses to %s", len(self.recording.entries),
+                 self.recording.path)
+
+
+class ReplayServer(StandinServer):
+    """Serves a Recording on localhost. A recorded URL is served at
+    /<host>/<path>, and absolute URLs in pages and redirects are rewritten
+    to match. Each request gets the recorded responses to it in order,
+    repeating the last one, so pages whose content changed during the
+    session replay the same way. With realtime, every response takes as
+    long as it took the real server"""
+
+    def __init__(self, recording, realtime=False):
+        super().__init__()
+        self.recording = recording
+        self.realtime = realtime
+        self.hosts = recording.hosts
+        self.index = defaultdict(list)
+        for entry in recording.entries:
+            self.index[request_key(entry["method"], entry["url"])].append(
+                entry)
+        self.served = defaultdict(int)
+
+    def rebase(self, url):
+        """Return the local URL replaying a recorded URL"""
+        parts = urlsplit(url)
+        if (parts.scheme not in ("http", "https") or
+                parts.netloc == "127.0.0.1:{}".format(self.port)):
+            return url
+        return self.url("/" + request_key("GET", url).split(" ", 1)[1])
+
+    def lookup(self, request):
+        """Return the recorded key of a request. Root relative links lose
+        the host, which is then taken from the page that made the request"""
+        host = request.path.split("/")[1]
+        if host in self.hosts:
+            return "{} {}".format(request.method, request.path[1:])
+        referer = urlsplit(request.headers.get("Referer", ""))
+        host = referer.path.split("/")[1] if referer.path else ""
+        if host in self.hosts:
+            return "{} {}{}".format(request.method, host, request.path)
+        return None
+
+    def respond(self, request):
+        with self.lock:
+            self.requests.append(request.path)
+            key = self.lookup(request)
+            entries = self.index.get(key)
+            if not entries:
+                LOG.debug("Nothing recorded for %s", request.path)
+                return 404, {"Content-Type": "text/plain"}, b"not recorded"
+            entry = entries[min(self.served[key], len(entries) - 1)]
+            self.served[key] += 1
+        if self.realtime:
+            time.sleep(entry["elapsed"])
+        headers = dict(entry["headers"])
+        body = self.recording.body(entry)
+        if "location" in headers:
+            headers["location"] = self.rebase(
+                urljoin(entry["url"], headers["location"]))
+        if headers.get("content-type", "").startswith(TEXT_TYPES):
+            base = self.url("/").encode()
+            body = ABSOLUTE_URL_RE.sub(lambda m: base + m.group(1), body)
+        return entry["status"], headers, body
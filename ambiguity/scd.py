@@ -1,24 +1,92 @@
 """A simple version of Chrome Webdriver with special features for ambiguity"""
+import base64
+import logging
+from pathlib import Path
 import re
-from time import sleep
+import shutil
 import warnings
 
-from PyPDF2 import PdfFileMerger
 from selenium import webdriver
-from selenium.common.exceptions import StaleElementReferenceException, JavascriptException
+from selenium.common.exceptions import (
+    NoSuchElementException, StaleElementReferenceException,
+    JavascriptException, WebDriverException)
+from selenium.webdriver.chrome.remote_connection import ChromeRemoteConnection
 from selenium.webdriver.common.by import By
+from selenium.webdriver.remote.command import Command
+from selenium.webdriver.remote.webdriver import WebDriver as RemoteWebDriver
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 
 
-from ambiguity.utils import Timeout
+from ambiguity import conditions
+from ambiguity import tracing
+from ambiguity.downloads import Download, DownloadWatcher
+from ambiguity.fetch import SessionFetcher
+from ambiguity.replay import Recorder, Recording, ReplayServer
+from ambiguity.utils import Deadline, wait_until
+
+LOG = logging.getLogger(__name__)
+
+# Collects the text and attributes of every element matching a selector in
+# a single round trip. Attributes prefer DOM properties like WebElement does
+EXTRACT_JS = """
+var nodes = document.querySelectorAll(arguments[0]);
+var attrs = arguments[1];
+var out = [];
+for (var i = 0; i < nodes.length; i++) {
+    var item = {text: (nodes[i].innerText || "").trim()};
+    if (arguments[2]) {
+        item.element = nodes[i];
+    }
+    for (var j = 0; j < attrs.length; j++) {
+        var value = nodes[i][attrs[j]];
+        if (value === undefined || value === null ||
+                typeof value === "object" || typeof value === "function") {
+            value = nodes[i].getAttribute(attrs[j]);
+        }
+        item[attrs[j]] = value;
+    }
+    out.push(item);
+}
+return out;
+"""
+
+# Profile contents that are either large and disposable or that would make a
+# copied profile refuse to start because the original is still locked
+PROFILE_COPY_IGNORE = shutil.ignore_patterns(
+    "Singleton*", "Cache", "Code Cache", "GPUCache", "*.lock")
+
+
+def copy_profile(src, dest):
+    """Copy a chrome profile so another browser can run with it"""
+    shutil.copytree(str(src), str(dest), ignore=PROFILE_COPY_IGNORE)
 
 
 class SimpleChromeDriver(webdriver.Chrome):
-    """A Chrome webdriver with a simpler API and additional methods"""
+    """A Chrome webdriver with a simpler API and additional methods. Given a
+    daemon socket, it borrows a warm browser from a running BrowserDaemon
+    instead of starting one when possible, and hands it back marked
+    unhealthy if the session ended in an error. Counts the WebDriver
+    commands it sends, each one a round trip to the browser. Sessions can
+    be recorded and later replayed offline, see record and replay"""
+
+    # Seconds allowed for each kind of wait, sites can override them
+    DEFAULT_TIMEOUTS = {
+        "element": 10,
+        "page": 30,
+        "login": 30,
+        "download": 30,
+        # How long a page that prints itself gets to open its preview
+        "print_preview": 2,
+    }
+    POLL_INTERVAL = 0.05
 
     # pylint: disable=super-init-not-called
-    def __init__(self, download_dir, profile_dir):
+    def __init__(self, download_dir, profile_dir, daemon_socket=None,
+                 headless=False):
+        self.daemon_socket = daemon_socket
+        self.daemon = None
+        self.attach_session_id = None
         self.download_dir = download_dir
         self.profile_dir = profile_dir
         self.chrome_options = webdriver.ChromeOptions()
@@ -29,26 +97,132 @@ class SimpleChromeDriver(webdriver.Chrome):
         self.chrome_options.add_experimental_option("prefs", prefs)
         self.chrome_options.add_argument(
             "user-data-dir=" + str(profile_dir.absolute()))
+        self.headless = headless
+        if headless:
+            self.chrome_options.add_argument("--headless")
+            self.chrome_options.add_argument("--window-size=1280,1024")
         self.active = False
+        # Whether the borrowed browser is fit for the daemon's next client
+        self.healthy = True
+        self.commands = 0
+        self.recorder = None
+        self.replay_server = None
+        self.downloads = None
+        self.timeouts = dict(self.DEFAULT_TIMEOUTS)
 
     def start(self):
         """Start the webdriver. Useful for deferring this past construction"""
         if not self.active:
-            super().__init__(chrome_options=self.chrome_options)
-            self.active = True
+            with tracing.span("browser_start"):
+                # Daemon browsers don't keep the log a recording needs
+                if (self.daemon_socket is not None and
+                        self.recorder is None and self.attach()):
+                    return
+                self.downloads = DownloadWatcher(self.download_dir)
+                capabilities = None
+                if self.recorder is not None:
+                    capabilities = {
+                        "goog:loggingPrefs": {"performance": "ALL"}}
+                super().__init__(chrome_options=self.chrome_options,
+                                 desired_capabilities=capabilities)
+                self.active = True
+                if self.headless:
+                    # Headless Chrome ignores the download directory pref
+                    self.execute_cdp_cmd("Page.setDownloadBehavior", {
+                        "behavior": "allow",
+                        "downloadPath": str(self.download_dir.absolute()),
+                    })
+
+    def attach(self):
+        """Borrow a started browser from the daemon, return whether one was
+        available"""
+        from ambiguity.daemon import DaemonClient
+        client = DaemonClient(self.daemon_socket)
+        try:
+            reply = client.acquire()
+        except OSError:
+            return False
+        if "error" in reply:
+            LOG.info("Not using the browser daemon: %s", reply["error"])
+            return False
+        LOG.info("Attached to a browser from the daemon")
+        self.daemon = client
+        self.attach_session_id = reply["session_id"]
+        self.download_dir = Path(reply["download_dir"])
+        self.downloads = DownloadWatcher(self.download_dir)
+        RemoteWebDriver.__init__(
+            self, command_executor=ChromeRemoteConnection(reply["executor"]),
+            desired_capabilities=self.chrome_options.to_capabilities())
+        self.active = True
+        return True
+
+    def start_session(self, capabilities, browser_profile=None):
+        """Start a new browser session, or adopt the daemon's one"""
+        if self.attach_session_id is None:
+            super().start_session(capabilities, browser_profile)
+            return
+        self.session_id = self.attach_session_id
+        self.capabilities = capabilities
+        self.w3c = True
+
+    def execute(self, driver_command, params=None):
+        """Send a command to the browser, counting the round trip. While
+        recording, the responses it caused are recorded right away"""
+        self.commands += 1
+        result = super().execute(driver_command, params)
+        if (self.recorder is not None and
+                driver_command not in (Command.NEW_SESSION, Command.QUIT)):
+            self.recorder.collect()
+        return result
+
+    def record(self, path):
+        """Record the pages, downloads and fetches of this session, with
+        their timing, into a Recording directory. Call before start"""
+        self.recorder = Recorder(self, Recording(path))
+
+    def replay(self, path, realtime=False):
+        """Browse a Recording served from a local server instead of the real
+        sites. With realtime, responses take as long as they did when
+        recorded, otherwise they're as fast as possible"""
+        self.replay_server = ReplayServer(Recording(path), realtime)
+        self.replay_server.start()
 
     def quit(self):
-        """Quit the webdriver."""
+        """Quit the webdriver, or hand it back if borrowed from the daemon"""
         if self.active:
-            super().quit()
+            if self.daemon is not None:
+                try:
+                    self.daemon.release(self.session_id, self.healthy)
+                except OSError:
+                    LOG.warning("Could not hand the browser back to daemon")
+                self.daemon = None
+                self.attach_session_id = None
+                self.healthy = True
+            else:
+                if self.recorder is not None:
+                    self.recorder.stop()
+                super().quit()
+            self.downloads.close()
             self.active = False
+        if self.replay_server is not None:
+            self.replay_server.stop()
+            self.replay_server = None
 
     def __enter__(self):
         return self
 
-    def __exit__(self, *args):
+    def __exit__(self, exc_type, *args):
+        if exc_type is not None:
+            self.healthy = False
         self.quit()
 
+    def get(self, url):
+        """Load a web page in the current browser session"""
+        if self.replay_server is not None:
+            url = self.replay_server.rebase(url)
+        with tracing.span("get", url=url):
+            super().get(url)
+
     def find(self, selector, idx=0):
         """Find the element at position idx that matches the CSS selector"""
         return self.find_all(selector)[idx]
@@ -57,6 +231,13 @@ class SimpleChromeDriver(webdriver.Chrome):
         """Return a list of all elements matching the CSS selector"""
         return self.find_elements_by_css_selector(selector)
 
+    def extract(self, selector, attrs=(), elements=False):
+        """Return a dict for every element matching the CSS selector with its
+        "text", the given attributes and, if asked, the "element" itself,
+        all fetched in one round trip"""
+        return self.execute_script(
+            EXTRACT_JS, selector, list(attrs), elements)
+
     def fill_field(self, selector, value):
         """Type the value into the element matching the CSS selector"""
         field = self.find(selector)
@@ -64,11 +245,23 @@ class SimpleChromeDriver(webdriver.Chrome):
         field.send_keys(value)
 
     def fill_field_slow(self, selector, value):
+        """Type the value into a field whose scripts can't keep up with fast
+        typing. Types it all at once if the field takes it, otherwise one
+        character at a time, waiting for the field to take each one"""
         field = self.find(selector)
         field.clear()
+        field.send_keys(value)
+        try:
+            self.wait_for(conditions.field_value(field, value), seconds=0.5)
+            return
+        except TimeoutError:
+            field.clear()
         for c in value:
+            before = field.get_attribute("value")
             field.send_keys(c)
-            sleep(0.02)
+            self.wait_for(conditions.Condition(
+                "field took {!r}".format(c),
+                lambda _: field.get_attribute("value") != before))
 
     def expand_shadow_element(self, element):
         shadow_root = self.execute_script(
@@ -84,10 +277,40 @@ class SimpleChromeDriver(webdriver.Chrome):
         except StaleElementReferenceException:
             return True
 
+    def use_timeouts(self, timeouts):
+        """Apply a site's timeout profile over the default timeouts"""
+        self.timeouts = dict(self.DEFAULT_TIMEOUTS, **timeouts)
+
+    def wait_for(self, condition, kind="element", seconds=None,
+                 replaces=None):
+        """Wait for a condition from ambiguity.conditions and return its
+        result. The timeout comes from the timeout profile for the kind of
+        wait unless given. Pass the fixed delay a wait stands in for as
+        replaces to log how the two compare"""
+        if seconds is None:
+            seconds = self.timeouts[kind]
+
+        def check():
+            """Check the condition, treating vanished elements as unmet"""
+            try:
+                return condition(self)
+            except (NoSuchElementException, StaleElementReferenceException):
+                return False
+        with tracing.span("wait", condition=condition):
+            with Deadline(seconds, "timed out waiting for {}".format(
+                    condition)) as dl:
+                result = dl.wait_until(check, self.POLL_INTERVAL)
+        if replaces is not None:
+            LOG.debug("Waited %.2fs for %s instead of sleeping %.2fs",
+                      dl.elapsed, condition, replaces)
+        return result
+
     def wait_on_ec(self, ec):
         """Wait for a given expected condition and return the element"""
-        wait = WebDriverWait(self, 10)
-        return wait.until(ec)
+        wait = WebDriverWait(self, self.timeouts["element"],
+                             poll_frequency=self.POLL_INTERVAL)
+        with tracing.span("wait", condition=type(ec).__name__):
+            return wait.until(ec)
 
     def wait_till_clickable(self, selector):
         """Wait till the 1st element matching the CSS selector is clickable"""
@@ -122,29 +345,94 @@ class SimpleChromeDriver(webdriver.Chrome):
         for path in self.download_dir.glob(dl_glob):
             path.unlink()
 
-    def wait_for_download(self, dl_glob):
-        """Wait for a download matching the given glob, return its Path"""
-        with Timeout(error_message="error downloading file " + dl_glob):
-            while not list(self.download_dir.glob(dl_glob)):
-                sleep(0.1)
-            return list(self.download_dir.glob(dl_glob))[0]
-
+    def expect_download(self, dl_glob):
+        """Return a handle for the next new download matching the given glob.
+        Call this before triggering the download"""
+        return self.downloads.expect(dl_glob)
+
+    def wait_for_download(self, download, seconds=None):
+        """Wait for a download handle to be completely written, return its
+        Path. A glob matches any finished download, old or new"""
+        if not isinstance(download, Download):
+            download = Download(download)
+        if seconds is None:
+            seconds = self.timeouts["download"]
+        with tracing.span("wait_for_download", pattern=download.pattern):
+            path = self.downloads.wait(
+                download, seconds,
+                error_message="error downloading file " + download.pattern)
+        if self.recorder is not None:
+            self.recorder.add_download(download)
+        return path
+
+    def fetcher(self, workers=4):
+        """Return a SessionFetcher logged in with this browser's cookies for
+        the current site, for GET downloads that don't need the browser"""
+        fetcher = SessionFetcher.from_driver(self, workers)
+        if self.recorder is not None:
+            fetcher.on_fetch = self.recorder.add_fetch
+        if self.replay_server is not None:
+            fetcher.rebase = self.replay_server.rebase
+        return fetcher
+
+    @tracing.traced("print_to_pdf")
     def print_to_pdf(self, fname, preview_exists=False):
-        """Print the current window to a pdf file"""
+        """Print the current window to a pdf file. Renders the whole page in
+        one DevTools call, falling back to the print preview if unsupported.
+        If the page opens a print preview itself, it gets closed first, but
+        is only waited for as long as the print_preview timeout"""
+        # Headless browsers never show a print preview
+        if preview_exists and not self.headless:
+            original_window_handle = self.current_window_handle
+            try:
+                wait_until(self.switch_to_print_preview,
+                           self.timeouts["print_preview"],
+                           "no print preview opened", interval=0.25)
+                self.close_print_preview()
+            except TimeoutError:
+                LOG.debug("Page did not open a print preview")
+            self.switch_to.window(original_window_handle)
+        try:
+            self.render_pdf(fname)
+        except WebDriverException:
+            LOG.info("DevTools printing unsupported, using print preview")
+            self.print_to_pdf_preview(fname)
+
+    def render_pdf(self, fname):
+        """Render the current window to a pdf file with DevTools"""
+        result = self.execute_cdp_cmd("Page.printToPDF", {
+            "printBackground": True,
+            "preferCSSPageSize": True,
+        })
+        fname.parent.mkdir(parents=True, exist_ok=True)
+        fname.write_bytes(base64.b64decode(result["data"]))
+
+    def switch_to_print_preview(self):
+        """Switch to the print preview window, return whether successful"""
+        for handle in self.window_handles[::-1]:
+            self.switch_to.window(handle)
+            try:
+                if (self.find("print-preview-app") is not None):
+                    return True
+            except IndexError:
+                continue
+        return False
+
+    def close_print_preview(self):
+        """Cancel the print preview dialog in the current window"""
+        self.execute_script(
+            "return "
+            "document.querySelector('print-preview-app').shadowRoot."
+            "querySelector('print-preview-sidebar').shadowRoot."
+            "querySelector('print-preview-button-strip').shadowRoot."
+            "querySelector('cr-button.cancel-button')").click()
+
+    def print_to_pdf_preview(self, fname, preview_exists=False):
+        """Print the current window to a pdf file through the print preview,
+        downloading it page by page"""
         original_window_handle = self.current_window_handle
         self.clear_download_glob("print*.pdf")
 
-        def switch_to_print_preview():
-            """Switch to the print preview window, return whether successful"""
-            for handle in self.window_handles[::-1]:
-                self.switch_to.window(handle)
-                try:
-                    if (self.find("print-preview-app") is not None):
-                        return True
-                except IndexError:
-                    continue
-            return False
-
         def extract_pdf_id():
             # Pull the pdf url from the print preview dialog
             try:
@@ -164,13 +452,9 @@ class SimpleChromeDriver(webdriver.Chrome):
         if not preview_exists:
             self.execute_script("setTimeout(window.print, 0);")
 
-        with Timeout(seconds=1000000000, error_message="could not find an open print preview"):
-            while switch_to_print_preview() is False:
-                sleep(0.25)
-            pdf_id = extract_pdf_id()
-            while pdf_id is None:
-                pdf_id = extract_pdf_id()
-                sleep(0.25)
+        with Deadline(60, "could not find an open print preview") as deadline:
+            deadline.wait_until(self.switch_to_print_preview, 0.25)
+            pdf_id = deadline.wait_until(extract_pdf_id, 0.25)
 
         # Keep downloading pages until they're empty
         pdf_pages = []
@@ -187,6 +471,7 @@ class SimpleChromeDriver(webdriver.Chrome):
                 break
 
         # Merge them together
+        from PyPDF2 import PdfFileMerger
         merger = PdfFileMerger(strict=False)
         for page in pdf_pages:
             merger.append(page.open("rb"))
@@ -198,21 +483,18 @@ class SimpleChromeDriver(webdriver.Chrome):
                 merger.write(fout)
 
         # Close dialog and return to original screen
-        # import pdb; pdb.set_trace()
-        self.execute_script(
-            "return "
-            "document.querySelector('print-preview-app').shadowRoot."
-            "querySelector('print-preview-sidebar').shadowRoot."
-            "querySelector('print-preview-button-strip').shadowRoot."
-            "querySelector('cr-button.cancel-button')").click()
-        # self.wait_till_clickable("button.cancel").click()
+        self.close_print_preview()
         self.switch_to.window(original_window_handle)
 
-    def reset(self):
-        """Clear all windows and cookies, leaving a new tab window"""
+    def close_other_windows(self):
+        """Close all windows but the first one and switch to it"""
         while len(self.window_handles) > 1:
             self.switch_to.window(self.window_handles[-1])
             self.close()
         self.switch_to.window(self.window_handles[0])
+
+    def reset(self):
+        """Clear all windows and cookies, leaving a new tab window"""
+        self.close_other_windows()
         self.get("chrome://newtab")
         self.delete_all_cookies()
@@ -0,0 +1,346 @@
+"""Scheduling pulls as retryable tasks, paced and limited per institution"""
+from collections import namedtuple, OrderedDict
+import itertools
+import logging
+import random
+import time
+
+from ambiguity.library_index import FilingError
+
+LOG = logging.getLogger(__name__)
+
+# One statement to pull
+PullTask = namedtuple("PullTask", ["name", "sd", "fmt"])
+
+# Statements of accounts sharing a login to pull in one session, as
+# {account name: {StatementDate: formats}}, and how many times before
+PullJob = namedtuple("PullJob", ["id", "session_key", "statements", "retry"])
+
+# What pulling an account in a PullJob did: the statements it left unfiled
+# and the error it stopped at, if any, and whether trying again may help
+Attempt = namedtuple("Attempt", ["name", "remaining", "error", "transient"])
+
+# Limits on pulling from one institution:
+#   sessions: logged in sessions at once, across workers
+#   interval: seconds between the starts of two sessions
+#   retries:  times a statement is tried again after a transient error
+#   backoff:  seconds before the first retry, doubling for each one after
+#   failures: failed sessions in a row that open its circuit breaker
+#   cooldown: seconds an open breaker holds the institution's jobs back for
+Limits = namedtuple("Limits", ["sessions", "interval", "retries", "backoff",
+                               "failures", "cooldown"])
+
+DEFAULT_LIMITS = Limits(sessions=2, interval=5.0, retries=2, backoff=10.0,
+                        failures=3, cooldown=600.0)
+
+# Final states of a task. Retried tasks were pulled after failing before
+TASK_STATES = ("pulled", "retried", "skipped", "failed")
+
+# The final state of a PullTask, the sessions it was tried in and the last
+# error it met
+TaskState = namedtuple("TaskState", ["state", "attempts", "error"])
+
+
+def statement_tasks(name, statements):
+    """Generate the PullTasks of an account's {StatementDate: formats}"""
+    for sd, fmts in statements.items():
+        for fmt in sorted(fmts):
+            yield PullTask(name, sd, fmt)
+
+
+def is_transient(ex):
+    """Return whether a pull that raised ex may succeed if tried again:
+    timeouts, elements gone stale or not there yet, browser and network
+    errors, and downloads that turned out not to be statements"""
+    from selenium.common.exceptions import WebDriverException
+    return isinstance(ex, (TimeoutError, IndexError, OSError, FilingError,
+                           WebDriverException))
+
+
+def limits_from_settings(settings):
+    """Return {institution: Limits} from the pull_limits section of the
+    settings, the "default" entry applying to institutions not listed"""
+    section = dict(getattr(settings, "pull_limits", None) or dict())
+    default = DEFAULT_LIMITS._replace(**section.pop("default", None) or {})
+    limits = OrderedDict([(None, default)])
+    for institution, overrides in section.items():
+        limits[institution] = default._replace(**overrides or {})
+    return limits
+
+
+class CircuitBreaker(object):
+    """Stops sessions at an institution that is clearly down. Opens after
+    a number of failed sessions in a row, skipping the institution until
+    the cooldown has passed, then lets sessions through again, opening at
+    the first failure until one succeeds"""
+
+    def __init__(self, failures, cooldown):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.failed = 0
+        self.opened_at = None
+
+    def allow(self, now):
+        """Return whether a session may start"""
+        return now >= self.allowed_from()
+
+    def allowed_from(self):
+        """Return the clock from which sessions may start"""
+        if self.opened_at is None:
+            return float("-inf")
+        return self.opened_at + self.cooldown
+
+    def success(self):
+        """Record a session that went through"""
+        self.failed = 0
+        self.opened_at = None
+
+    def failure(self, now):
+        """Record a failed session, returning whether it opened the
+        breaker"""
+        self.failed += 1
+        was_open = self.opened_at is not None
+        if was_open or self.failed >= self.failures:
+            self.opened_at = now
+            return not was_open
+        return False
+
+
+class PullReport(object):
+    """The TaskState of every statement a pull set out to pull"""
+
+    def __init__(self):
+        self.tasks = OrderedDict()  # PullTask: TaskState
+
+    def set(self, task, state, attempts, error=None):
+        """Record the final state of a PullTask"""
+        self.tasks[task] = TaskState(state, attempts, error)
+
+    def by_state(self, state):
+        """Return the PullTasks that ended in a state, with their
+        TaskStates"""
+        return [(task, task_state) for task, task_state in self.tasks.items()
+                if task_state.state == state]
+
+    def counts(self, name):
+        """Return {state: tasks} of an account"""
+        counts = dict.fromkeys(TASK_STATES, 0)
+        for task, task_state in self.tasks.items():
+            if task.name == name:
+                counts[task_state.state] += 1
+        return counts
+
+    def lines(self):
+        """Return the report as lines of text, the retried, skipped and
+        failed statements listed apart"""
+        pulled = len(self.by_state("pulled")) + len(self.by_state("retried"))
+        lines = ["Pulled {} of {} statements".format(pulled, len(self.tasks))]
+        headings = {
+            "retried": "Pulled after retrying",
+            "skipped": "Skipped, institution down",
+            "failed": "Failed"}
+        for state in ("retried", "skipped", "failed"):
+            tasks = self.by_state(state)
+            if not tasks:
+                continue
+            lines.append("{} ({}):".format(headings[state], len(tasks)))
+            for task, task_state in tasks:
+                line = "  {} {} {}, {} attempts".format(
+                    task.name, task.sd, task.fmt, task_state.attempts)
+                if task_state.error:
+                    line += ", " + task_state.error
+                lines.append(line)
+        return lines
+
+
+class PullScheduler(object):
+    """Runs the statements of a PullPlan as PullJobs, one per login, on an
+    executor with a number of slots, like browsers. Each statement is a
+    PullTask: those left unfiled by a transient error are retried in a
+    later job, after an exponential backoff with jitter. Per institution,
+    jobs are kept to a number of concurrent sessions and spaced out in
+    time, and a CircuitBreaker holds the institution's jobs back for a
+    cooldown once it is clearly down. They are skipped if nothing else is
+    left to run by then. Waiting jobs don't hold up other institutions"""
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, plan, limits=None, clock=time.monotonic,
+                 sleep=time.sleep, rng=None):
+        self.limits = limits or {None: DEFAULT_LIMITS}
+        self.clock = clock
+        self.sleep = sleep
+        self.rng = rng or random.Random()
+        self.ids = itertools.count()
+        self.report = PullReport()
+        self.attempts = dict()  # PullTask: sessions tried in
+        self.errors = dict()  # PullTask: last error
+        self.breakers = dict()  # institution: CircuitBreaker
+        self.running = dict()  # institution: sessions running
+        self.next_start = dict()  # institution: clock of the next start
+        self.waiting = []  # [(clock ready, PullJob)]
+        for session_key, accounts in plan.groups.items():
+            statements = OrderedDict(
+                (planned.name, plan.statements(planned.name))
+                for planned in accounts)
+            self.waiting.append((self.clock(), PullJob(
+                next(self.ids), session_key, statements, 0)))
+
+    def institution_limits(self, institution):
+        """Return the Limits of an institution"""
+        return self.limits.get(institution, self.limits[None])
+
+    def breaker(self, institution):
+        """Return the CircuitBreaker of an institution"""
+        if institution not in self.breakers:
+            limits = self.institution_limits(institution)
+            self.breakers[institution] = CircuitBreaker(
+                limits.failures, limits.cooldown)
+        return self.breakers[institution]
+
+    @staticmethod
+    def tasks(job):
+        """Generate the PullTasks of a PullJob"""
+        for name, statements in job.statements.items():
+            yield from statement_tasks(name, statements)
+
+    def backoff(self, institution, retry):
+        """Return the seconds to wait before a retry: half of the backoff
+        doubled for each retry before, the other half random"""
+        delay = self.institution_limits(institution).backoff * 2 ** (
+            retry - 1)
+        return delay / 2 + self.rng.uniform(0, delay / 2)
+
+    def _skip(self, job):
+        """Give up on a PullJob whose institution's breaker is open"""
+        LOG.warning("%s is down, skipping %s", job.session_key[0],
+                    ", ".join(job.statements))
+        for task in self.tasks(job):
+            self.report.set(task, "skipped", self.attempts.get(task, 0),
+                            self.errors.get(task))
+
+    def ready(self, now):
+        """Take the first PullJob that can start now off the waiting list,
+        or return None. Jobs of institutions whose breaker is open wait
+        for its cooldown"""
+        idx = 0
+        while idx < len(self.waiting):
+            ready_at, job = self.waiting[idx]
+            institution = job.session_key[0]
+            limits = self.institution_limits(institution)
+            if (ready_at <= now and
+                    self.breaker(institution).allow(now) and
+                    self.running.get(institution, 0) < limits.sessions and
+                    self.next_start.get(institution, now) <= now):
+                del self.waiting[idx]
+                self.running[institution] = self.running.get(
+                    institution, 0) + 1
+                self.next_start[institution] = now + limits.interval
+                return job
+            idx += 1
+        return None
+
+    def wake_at(self, now):
+        """Return the clock at which the next waiting PullJob could start,
+        were a slot free, or None if every waiting job is held by its
+        institution's sessions, which only a job finishing frees"""
+        starts = [
+            max(ready_at, self.next_start.get(job.session_key[0], now),
+                self.breaker(job.session_key[0]).allowed_from())
+            for ready_at, job in self.waiting
+            if self.running.get(job.session_key[0], 0) <
+            self.institution_limits(job.session_key[0]).sessions]
+        return min(starts) if starts else None
+
+    def finish(self, job, attempts):
+        """Record the Attempts of a PullJob, scheduling the retry of its
+        statements left unfiled by transient errors"""
+        now = self.clock()
+        institution = job.session_key[0]
+        self.running[institution] -= 1
+        limits = self.institution_limits(institution)
+        retry = OrderedDict()
+        failed = False
+        for attempt in attempts:
+            failed = failed or attempt.error is not None
+            remaining = {PullTask(attempt.name, sd, fmt)
+                         for sd, fmts in attempt.remaining.items()
+                         for fmt in fmts}
+            for task in statement_tasks(attempt.name,
+                                        job.statements[attempt.name]):
+                self.attempts[task] = self.attempts.get(task, 0) + 1
+                if attempt.error is not None:
+                    self.errors[task] = attempt.error
+                if task not in remaining:
+                    self.report.set(task, "retried" if job.retry else
+                                    "pulled", self.attempts[task])
+                elif attempt.transient and job.retry < limits.retries:
+                    retry.setdefault(task.name, OrderedDict()).setdefault(
+                        task.sd, set()).add(task.fmt)
+                else:
+                    # Not offered by the site, or not worth trying again
+                    self.report.set(task, "failed", self.attempts[task],
+                                    self.errors.get(task))
+        if failed:
+            if self.breaker(institution).failure(now):
+                LOG.warning("%s failed %d sessions in a row, skipping it for "
+                            "%d seconds", institution, limits.failures,
+                            limits.cooldown)
+        else:
+            self.breaker(institution).success()
+        if retry:
+            delay = self.backoff(institution, job.retry + 1)
+            LOG.info("Retrying %s in %.0f seconds", ", ".join(retry), delay)
+            self.waiting.append((now + delay, PullJob(
+                next(self.ids), job.session_key, retry, job.retry + 1)))
+            self.waiting.sort(key=lambda item: (item[0], item[1].id))
+
+    def abandon(self, job, error, running=True):
+        """Record a PullJob lost along with its executor, or left waiting
+        when it went, as failed"""
+        if running:
+            self.running[job.session_key[0]] -= 1
+        for task in self.tasks(job):
+            self.report.set(task, "failed", self.attempts.get(task, 0) + 1,
+                            error)
+
+    def run(self, executor, slots=1):
+        """Run every PullJob on an executor with slots, returning the
+        PullReport. The executor has submit(job), and finished(timeout)
+        returning the (job id, Attempts) of the jobs done since, or None if
+        it can't run jobs anymore"""
+        running = dict()  # PullJob id: PullJob
+        while self.waiting or running:
+            now = self.clock()
+            while len(running) < slots:
+                job = self.ready(now)
+                if job is None:
+                    break
+                running[job.id] = job
+                executor.submit(job)
+            if running:
+                # Block on the jobs running until another one could start
+                timeout = 1.0
+                wake = self.wake_at(now) if len(running) < slots else None
+                if wake is not None:
+                    timeout = min(timeout, max(0, wake - now))
+                done = executor.finished(timeout)
+                if done is None:
+                    for job in running.values():
+                        self.abandon(job, "worker exited before finishing")
+                    for _ready_at, job in self.waiting:
+                        self.abandon(job, "worker exited before finishing",
+                                     running=False)
+                    self.waiting = []
+                    break
+                for job_id, attempts in done:
+                    self.finish(running.pop(job_id), attempts)
+            elif all(not self.breaker(job.session_key[0]).allow(now)
+                     for _ready_at, job in self.waiting):
+                # Only institutions that are down are left, skip them
+                for _ready_at, job in self.waiting:
+                    self._skip(job)
+                self.waiting = []
+            else:
+                wake = self.wake_at(now)
+                self.sleep(1.0 if wake is None else max(0, wake - now))
+        return self.report
@@ -0,0 +1,146 @@
+"""A local stand-in web server for exercising scrapers and fetchers offline"""
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import threading
+import time
+from urllib.parse import parse_qsl, urlsplit
+
+LOG = logging.getLogger(__name__)
+
+LOGIN_PAGE = b"<html><body><form id='login'></form></body></html>"
+
+StandinRequest = namedtuple(
+    "StandinRequest",
+    ["method", "path", "query", "cookies", "form", "headers"])
+
+
+class QuietHTTPServer(ThreadingHTTPServer):
+    """Threaded HTTP server that logs dropped connections instead of
+    printing tracebacks, since clients keep connections alive on shutdown"""
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        LOG.debug("Error serving %s", client_address, exc_info=True)
+
+
+class StandinServer(object):
+    """Serves canned responses on localhost from a background thread.
+    Routes map a path, with or without its query string, either to a
+    (content type, body) pair or to a callable taking a StandinRequest and
+    returning (status, headers, body). When a session cookie is given,
+    requests without it get a login page like a bank whose session expired"""
+
+    def __init__(self, routes=None, cookie=None, latency=0):
+        self.routes = dict(routes or {})
+        self.cookie = cookie
+        self.latency = latency
+        self.requests = []
+        self.lock = threading.Lock()
+        self.httpd = QuietHTTPServer(("127.0.0.1", 0), self._handler())
+        self.thread = None
+
+    @property
+    def port(self):
+        """The port the server is listening on"""
+        return self.httpd.server_address[1]
+
+    def url(self, path="/"):
+        """Return the full URL of a path on the server"""
+        return "http://127.0.0.1:{}{}".format(self.port, path)
+
+    def route(self, path, body, content_type="application/octet-stream"):
+        """Serve body at path. A callable body handles requests itself"""
+        if callable(body):
+            self.routes[path] = body
+            return
+        if isinstance(body, str):
+            body = body.encode()
+        self.routes[path] = (content_type, body)
+
+    def respond(self, request):
+        """Return the (status, headers, body) for a request"""
+        with self.lock:
+            self.requests.append(request.path)
+        if self.latency:
+            time.sleep(self.latency)
+        cookies = ["{}={}".format(*item) for item in request.cookies.items()]
+        if self.cookie is not None and self.cookie not in cookies:
+            return 200, {"Content-Type": "text/html"}, LOGIN_PAGE
+        route = self.routes.get(request.path)
+        if route is None:
+            route = self.routes.get(urlsplit(request.path).path)
+        if route is None:
+            return 404, {"Content-Type": "text/plain"}, b"not found"
+        if callable(route):
+            return route(request)
+        content_type, body = route
+        return 200, {"Content-Type": content_type}, body
+
+    def _handler(self):
+        """Return a request handler class bound to this server"""
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """Serves requests from the routes of the server"""
+            protocol_version = "HTTP/1.1"
+
+            def parse(self, method):
+                """Return the StandinRequest being handled"""
+                cookies = dict()
+                for pair in self.headers.get("Cookie", "").split(";"):
+                    if "=" in pair:
+                        name, value = pair.strip().split("=", 1)
+                        cookies[name] = value
+                length = int(self.headers.get("Content-Length", 0))
+                form = dict(parse_qsl(self.rfile.read(length).decode()))
+                query = dict(parse_qsl(urlsplit(self.path).query))
+                return StandinRequest(method, self.path, query, cookies, form,
+                                      dict(self.headers))
+
+            def answer(self, method):
+                """Send the response to a request"""
+                status, headers, body = server.respond(self.parse(method))
+                if isinstance(body, str):
+                    body = body.encode()
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                """Answer a GET request"""
+                self.answer("GET")
+
+            def do_POST(self):  # pylint: disable=invalid-name
+                """Answer a POST request"""
+                self.answer("POST")
+
+            def log_message(self, fmt, *args):  # pylint: disable=arguments-differ
+                LOG.debug(fmt, *args)
+
+        return Handler
+
+    def start(self):
+        """Start serving in a background thread"""
+        if self.thread is None:
+            self.thread = threading.Thread(
+                target=self.httpd.serve_forever, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        """Stop serving and release the port"""
+        if self.thread is not None:
+            self.httpd.shutdown()
+            self.thread.join()
+            self.thread = None
+        self.httpd.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
@@ -0,0 +1,544 @@
+"""Local stand-ins of the bank websites the scrapers pull from. Each serves
+the pages, frames and exports its scrapers walk through, for a run of
+monthly statements, at the same paths as the real site"""
+import datetime
+import random
+import re
+import uuid
+
+from ambiguity.standin import StandinServer
+from ambiguity.statement_date import StatementDate
+
+# Scheme and host of the site URLs in an Account class
+SITE_RE = re.compile(r"^https?://[^/]+")
+
+PAYEES = ["GROCERY OUTLET", "CITY TRANSIT", "CORNER CAFE", "HARDWARE STORE",
+          "BOOKSHOP", "PHARMACY", "GAS STATION", "POWER COMPANY",
+          "RESTAURANT", "ONLINE MARKETPLACE"]
+
+CONTENT_TYPES = {
+    "csv": "text/csv",
+    "xlsx": "application/vnd.ms-excel",
+    "qfx": "application/x-ofx",
+    "ofx": "application/x-ofx",
+    "qif": "application/qif",
+    "txt": "text/plain",
+    "pdf": "application/pdf",
+}
+
+PAGE = """<!DOCTYPE html>
+<html><head><title>{title}</title>
+<script>
+function show(id) {{ document.getElementById(id).style.display = "block"; }}
+function hide(id) {{ document.getElementById(id).style.display = "none"; }}
+</script></head>
+<body>{body}</body></html>"""
+
+
+def render_pdf(lines):
+    """Return the bytes of a one page PDF showing lines of ASCII text"""
+    def escape(line):
+        """Escape a line for a PDF string literal"""
+        return re.sub(r"([\\()])", r"\\\1", line)
+    text = "BT /F1 10 Tf 12 TL 50 750 Td {} ET".format(
+        " ".join("({}) '".format(escape(line)) for line in lines))
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+        "/Contents 4 0 R /Resources << /Font << /F1 5 0 R >> >> >>",
+        "<< /Length {} >>\nstream\n{}\nendstream".format(len(text), text),
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    out = "%PDF-1.4\n"
+    offsets = []
+    for num, obj in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += "{} 0 obj\n{}\nendobj\n".format(num, obj)
+    xref = len(out)
+    out += "xref\n0 {}\n0000000000 65535 f \n".format(len(objects) + 1)
+    out += "".join("{:010d} 00000 n \n".format(offset) for offset in offsets)
+    out += "trailer\n<< /Size {} /Root 1 0 R >>\nstartxref\n{}\n%%EOF\n".format(
+        len(objects) + 1, xref)
+    return out.encode("latin-1")
+
+
+class StandinBank(object):
+    """Base class for a stand-in bank website. It serves the months most
+    recent monthly statements closing on STATEMENT_DAY, with rows
+    transactions each, listing page_size statements per page where the
+    site paginates. Every response is delayed by latency seconds"""
+
+    STATEMENT_DAY = 20
+    # Constructor arguments of the Account classes this site stands in for
+    ACCOUNT_PARAMS = dict()
+
+    def __init__(self, months=12, page_size=10, rows=30, latency=0):
+        self.server = StandinServer(latency=latency)
+        self.page_size = page_size
+        self.rows = rows
+        today = StatementDate.from_datetime(datetime.date.today())
+        # Newest first, the way statement lists show them
+        self.statements = [StatementDate.from_ym(ym) for ym in
+                           range(today.ym - 1, today.ym - 1 - months, -1)]
+        self.sessions = dict()
+        self.add_routes()
+
+    def add_routes(self):
+        """Register the pages of the site on the server"""
+        raise NotImplementedError
+
+    def localize(self, acct_cls):
+        """Return a subclass of an Account class whose site URLs point to
+        this stand-in instead of the real site"""
+        def local(value):
+            """Rebase a URL, or the URLs in a dict, onto the server"""
+            if isinstance(value, dict):
+                return {k: local(v) for k, v in value.items()}
+            if isinstance(value, str) and SITE_RE.match(value):
+                return SITE_RE.sub(self.server.url(""), value)
+            return value
+        overrides = {name: local(getattr(acct_cls, name))
+                     for name in dir(acct_cls)
+                     if name.isupper() and name.endswith(("URL", "URLS"))}
+        return type(acct_cls.__name__, (acct_cls,), overrides)
+
+    def statement_date(self, sd):
+        """Return the closing datetime of a statement"""
+        return sd.to_datetime(self.STATEMENT_DAY)
+
+    def transactions(self, sd):
+        """Return the (datetime, payee, amount) transactions of a statement,
+        the same ones every time"""
+        rng = random.Random(sd.ym)
+        end = self.statement_date(sd)
+        start = (end.replace(day=1) - datetime.timedelta(days=1)).replace(
+            day=self.STATEMENT_DAY + 1)
+        days = (end - start).days
+        txns = [(start + datetime.timedelta(days=rng.randrange(days + 1)),
+                 rng.choice(PAYEES), round(-rng.uniform(1, 200), 2))
+                for _ in range(self.rows)]
+        return sorted(txns)
+
+    def export(self, sd, fmt):
+        """Return the contents of a statement in a format. Spreadsheets are
+        served as tab separated text"""
+        txns = self.transactions(sd)
+        if fmt == "csv":
+            lines = ["Date,Description,Amount"] + [
+                "{:%m/%d/%Y},{},{:.2f}".format(*txn) for txn in txns]
+        elif fmt in ("xlsx", "txt"):
+            lines = ["Date\tDescription\tAmount"] + [
+                "{:%m/%d/%Y}\t{}\t{:.2f}".format(*txn) for txn in txns]
+        elif fmt == "qif":
+            lines = ["!Type:Bank"]
+            for date, payee, amount in txns:
+                lines += ["D{:%m/%d/%Y}".format(date),
+                          "T{:.2f}".format(amount), "P" + payee, "^"]
+        elif fmt in ("qfx", "ofx"):
+            lines = ["OFXHEADER:100", "DATA:OFXSGML", "VERSION:102", "",
+                     "<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS><BANKTRANLIST>"]
+            for num, (date, payee, amount) in enumerate(txns):
+                lines += ["<STMTTRN><TRNTYPE>DEBIT",
+                          "<DTPOSTED>{:%Y%m%d}".format(date),
+                          "<TRNAMT>{:.2f}".format(amount),
+                          "<FITID>{}{:04d}".format(sd.ym, num),
+                          "<NAME>" + payee, "</STMTTRN>"]
+            lines.append("</BANKTRANLIST></STMTRS></STMTTRNRS>"
+                         "</BANKMSGSRSV1></OFX>")
+        elif fmt == "pdf":
+            return render_pdf(["Statement closing {:%m/%d/%Y}".format(
+                self.statement_date(sd))] + [
+                    "{:%m/%d/%Y}  {:<20} {:>10.2f}".format(*txn)
+                    for txn in txns])
+        else:
+            raise ValueError("No {} exports".format(fmt))
+        return ("\r\n".join(lines) + "\r\n").encode()
+
+    def statement(self, ym):
+        """Return the served StatementDate with the given ym, or None"""
+        try:
+            sd = StatementDate.from_ym(int(ym))
+        except (TypeError, ValueError):
+            return None
+        return sd if sd in self.statements else None
+
+    def session(self, request):
+        """Return the state of the request's logged in session, or None"""
+        return self.sessions.get(request.cookies.get("session"))
+
+    def sign_in(self, request, location):
+        """Start a session and redirect to the post-login page"""
+        token = uuid.uuid4().hex
+        self.sessions[token] = dict(user=request.form)
+        return 303, {"Location": location,
+                     "Set-Cookie": "session={}; Path=/".format(token)}, b""
+
+    def sign_out(self, request):
+        """End the request's session"""
+        self.sessions.pop(request.cookies.get("session"), None)
+        return self.html("Signed out", "<p>You have signed out.</p>")
+
+    @staticmethod
+    def html(title, body):
+        """Return a web page response"""
+        return 200, {"Content-Type": "text/html"}, PAGE.format(
+            title=title, body=body)
+
+    def page(self, request, title, body):
+        """Return a web page response, or send signed out users home"""
+        if self.session(request) is None:
+            return 303, {"Location": "/"}, b""
+        return self.html(title, body)
+
+    def attachment(self, request, sd, fmt):
+        """Return a statement as a file download response"""
+        if self.session(request) is None:
+            return self.html("Session expired", "<p>Please sign in.</p>")
+        if sd is None:
+            return 404, {"Content-Type": "text/plain"}, b"no such statement"
+        return 200, {
+            "Content-Type": CONTENT_TYPES[fmt],
+            "Content-Disposition": "attachment; filename={}.{}".format(
+                sd, fmt),
+        }, self.export(sd, fmt)
+
+    def start(self):
+        """Start serving the site"""
+        self.server.start()
+
+    def stop(self):
+        """Stop serving the site"""
+        self.server.stop()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+class MITFCUSite(StandinBank):
+    """Online banking, e-statement viewer and mycardinfo card site of MITFCU,
+    for the MITFCU and MITFCUVisa scrapers"""
+
+    LAST_FOUR = "4321"
+    ACCOUNT_PARAMS = {
+        "MITFCU": {"subaccount": "0001", "description": "CHECKING"},
+        "MITFCUVisa": {"last_four_digits": LAST_FOUR},
+    }
+
+    def add_routes(self):
+        route = self.server.route
+        route("/", lambda request: self.html(
+            "MITFCU", '<iframe title="Online Banking Login" src="/login">'
+            '</iframe>'))
+        route("/login", lambda request: self.html(
+            "Login", '<form method="post" action="/signin" target="_top">'
+            '<input id="userid" name="userid">'
+            '<input id="password" name="password" type="password">'
+            '<button type="submit">Log In</button></form>'))
+        route("/signin", lambda request: self.sign_in(request, "/dashboard"))
+        route("/dashboard", self.dashboard)
+        route("/tob/live/usp-core/app/logout", self.sign_out)
+        route("/estatements", lambda request: self.page(
+            request, "e-Statements",
+            '<iframe name="content" src="/estatements/content"></iframe>'))
+        route("/estatements/content", lambda request: self.page(
+            request, "e-Statements",
+            '<b><a href="/cowww/viewer" target="_blank">View statements</a>'
+            '</b>'))
+        route("/cowww/viewer", lambda request: self.page(
+            request, "Statement viewer",
+            '<iframe name="build" src="/cowww/build"></iframe>'
+            '<iframe name="hitlist" src="/cowww/hitlist"></iframe>'))
+        route("/cowww/build", self.build_frame)
+        route("/cowww/hitlist", lambda request: self.page(
+            request, "Hit list", self.hits(0)))
+        route("/cowww/hits", lambda request: self.page(
+            request, "Hit list", self.hits(int(request.query["page"]))))
+        route("/cowww/DocumentServer/XmlStatementDownload",
+              lambda request: self.attachment(
+                  request, self.statement(
+                      int(request.query["DocumentID"]) - 1000000), "csv"))
+        route("/cowww/DocumentServer/ViewDoc", self.view_doc)
+        route("/mycardinfo", lambda request: self.page(
+            request, "mycardinfo", '<div id="user-summary">Visa ending {}'
+            '</div>'.format(self.LAST_FOUR)))
+        route("/estatementenroll.aspx", self.estatements)
+        route("/estatement.pdf", lambda request: self.attachment(
+            request, self.statement(request.query.get("id")), "pdf"))
+        route("/AccountTransactions.aspx", self.account_transactions)
+        route("/select", self.select_period)
+        route("/downloadtransactions.ashx", self.download_transactions)
+
+    def dashboard(self, request):
+        """Accounts page with the e-statements menu and card links"""
+        return self.page(request, "Accounts", """
+            <a href="#" aria-label="Additional Services"
+               onclick="show('services'); return false;">More</a>
+            <div id="services" style="display: none">
+              <a href="#" aria-label="e-Statements" onclick="
+                  window.open('/estatements');
+                  alert('You are leaving online banking');
+                  return false;">e-Statements</a>
+            </div>
+            <a href="/mycardinfo" target="_blank"
+               title="XXXXXXXXXXXX{0} *{0}">Visa *{0}</a>
+            """.format(self.LAST_FOUR))
+
+    def build_frame(self, request):
+        """Hidden viewer frame that pages the hit list in place"""
+        return self.page(request, "Build", """<script>
+            var hitPage = 0;
+            function UIMovePage(list, forward) {
+                hitPage += forward ? 1 : -1;
+                var xhr = new XMLHttpRequest();
+                xhr.open("GET", "/cowww/hits?page=" + hitPage, false);
+                xhr.send();
+                var doc = new DOMParser().parseFromString(
+                    xhr.responseText, "text/html");
+                parent.hitlist.document.body.innerHTML = doc.body.innerHTML;
+            }
+            </script>""")
+
+    def hits(self, page):
+        """Hit list table of one page of statements. Pages past the end
+        repeat the last one"""
+        pages = max(1, -(-len(self.statements) // self.page_size))
+        page = min(max(page, 0), pages - 1)
+        rows = "".join(
+            '<tr class="normal"><td><a href="javascript:view({})">'
+            '{:%m/%d/%Y}</a></td></tr>'.format(
+                1000000 + sd.ym, self.statement_date(sd))
+            for sd in self.statements[page * self.page_size:
+                                      (page + 1) * self.page_size])
+        return ("<table><tr><td><table><tr><td><table>{}</table></td></tr>"
+                "</table></td></tr></table>".format(rows))
+
+    def view_doc(self, request):
+        """Printable statement page"""
+        sd = self.statement(int(request.query["DocumentID"]) - 1000000)
+        if sd is None:
+            return 404, {"Content-Type": "text/plain"}, b"no such statement"
+        rows = "".join(
+            "<tr><td>{:%m/%d/%Y}</td><td>{}</td><td>{:.2f}</td></tr>".format(
+                *txn) for txn in self.transactions(sd))
+        return self.page(request, "Statement", "<h1>Statement {}</h1>"
+                         "<table>{}</table>".format(sd, rows))
+
+    def estatements(self, request):
+        """Card e-statement list, each link downloading a PDF"""
+        links = "".join(
+            '<tr><td><a href="javascript:dl({})">{:%m/%d/%Y}</a></td></tr>'
+            .format(sd.ym, self.statement_date(sd))
+            for sd in self.statements)
+        return self.page(request, "e-Statements", """
+            <script>
+            function dl(id) {{ location.href = "/estatement.pdf?id=" + id; }}
+            </script>
+            <table class="estatements-list">{}</table>""".format(links))
+
+    def account_transactions(self, request):
+        """Card activity page with a statement period picker"""
+        choices = []
+        for num, sd in enumerate(self.statements):
+            end = self.statement_date(sd)
+            start = (end.replace(day=1) - datetime.timedelta(days=1)).replace(
+                day=self.STATEMENT_DAY + 1)
+            choices.append(
+                '<li class="{}"><a href="javascript:pick({})">'
+                '{:%b %d, %Y} - {:%b %d, %Y}</a></li>'.format(
+                    "previous-statements" if num else
+                    "most-recent-statements", sd.ym, start, end))
+        return self.page(request, "Transactions", """
+            <script>
+            function pick(ym) {{
+                show("overlay");
+                var xhr = new XMLHttpRequest();
+                xhr.open("POST", "/select?period=" + ym);
+                xhr.onload = function() {{ hide("overlay"); }};
+                xhr.send();
+            }}
+            function togglePicker() {{
+                var picker = document.getElementById("picker");
+                if (picker.style.display === "none") {{
+                    show("picker");
+                }} else {{
+                    hide("picker");
+                }}
+            }}
+            </script>
+            <a id="selected-date" href="#"
+               onclick="togglePicker(); return false;">Current activity</a>
+            <ul id="picker" style="display: none">{}</ul>
+            <div id="transactions-container">
+              <div id="overlay" class="animated-overlay"
+                   style="display: none">Loading</div>
+            </div>""".format("".join(choices)))
+
+    def select_period(self, request):
+        """Remember the picked statement period in the session"""
+        session = self.session(request)
+        if session is None:
+            return 403, {"Content-Type": "text/plain"}, b"signed out"
+        session["period"] = self.statement(request.query.get("period"))
+        return 200, {"Content-Type": "text/plain"}, b"ok"
+
+    def download_transactions(self, request):
+        """Export of the selected statement period"""
+        session = self.session(request) or dict()
+        fmt = {"excel": "xlsx"}.get(request.query.get("m"),
+                                    request.query.get("m"))
+        return self.attachment(request, session.get("period"), fmt)
+
+
+class BoASite(StandinBank):
+    """Bank of America sign in, accounts overview and account activity with
+    its transaction download modal"""
+
+    LAST_FOUR = "0701"
+    ACCOUNT_PARAMS = {
+        "BoA": {"last_four_digits": LAST_FOUR},
+    }
+    FORMATS = {"csv": "CSV", "qfx": "QFX", "qif": "QIF4", "txt": "TXT"}
+
+    def add_routes(self):
+        route = self.server.route
+        route("/", lambda request: self.html("Bank of America", """
+            <form method="post" action="/signin">
+              <input name="onlineId1">
+              <input name="passcode1" type="password">
+              <button id="signIn" type="submit">Sign In</button>
+            </form>"""))
+        route("/signin", lambda request: self.sign_in(request, "/accounts"))
+        route("/accounts", lambda request: self.page(
+            request, "Accounts",
+            '<span class="AccountName"><a href="/activity?acct=0042">'
+            'Savings - 0042</a></span>'
+            '<span class="AccountName"><a href="/activity?acct={0}">'
+            'Checking - {0}</a></span>'.format(self.LAST_FOUR)))
+        route("/activity", self.activity)
+        route("/export", lambda request: self.attachment(
+            request, self.statement(request.query.get("period")),
+            request.query.get("fmt")))
+        route("/myaccounts/signoff/signoff-default.go", self.sign_out)
+
+    def activity(self, request):
+        """Account activity page with the download modal"""
+        periods = ["<option value=''>Current transactions</option>"]
+        for num, sd in enumerate(self.statements):
+            end = self.statement_date(sd)
+            # The newest statement is labelled without "Period ending"
+            label = ("{:%B %d, %Y}" if num == 0 else
+                     "Period ending {:%m/%d/%Y}").format(end)
+            periods.append("<option value='{}'>{}</option>".format(
+                sd.ym, label))
+        formats = "".join(
+            "<option name='download_file_in_this_format_{}' value='{}'>{}"
+            "</option>".format(name, fmt, name)
+            for fmt, name in self.FORMATS.items())
+        return self.page(request, "Activity", """
+            <script>
+            function download() {{
+                location.href = "/export?acct={}&period=" +
+                    document.getElementById("select_txnperiod").value +
+                    "&fmt=" + document.getElementById("select_format").value;
+            }}
+            </script>
+            <a name="download_transactions_top" href="#"
+               onclick="show('modal'); return false;">Download</a>
+            <div id="modal" style="display: none">
+              <select id="select_txnperiod">{}</select>
+              <select id="select_format">{}</select>
+              <a class="submit-download" href="#"
+                 onclick="download(); return false;">Download</a>
+            </div>""".format(request.query.get("acct"), "".join(periods),
+                             formats))
+
+
+class USBankSite(StandinBank):
+    """U.S. Bank sign in and credit card page with its transaction download
+    panel and statement list"""
+
+    LAST_FOUR = "9876"
+    ACCOUNT_PARAMS = {
+        "USBankVisa": {"last_four_digits": LAST_FOUR},
+    }
+    FORMATS = [("", "Select a format"), ("csv", "Comma Separated (CSV)"),
+               ("qfx", "Quicken (QFX)"), ("qif", "Quicken (QIF)")]
+
+    def add_routes(self):
+        route = self.server.route
+        route("/", lambda request: self.html("U.S. Bank", """
+            <form method="post" action="/signin">
+              <input id="aw-personal-id" name="user">
+              <input id="aw-password" name="password" type="password">
+              <button id="aw-log-in" type="submit">Log In</button>
+            </form>"""))
+        route("/signin", lambda request: self.sign_in(request, "/card"))
+        route("/card", self.card)
+        route("/export", self.export_range)
+        route("/statement.pdf", lambda request: self.attachment(
+            request, self.statement(request.query.get("period")), "pdf"))
+        route("/Auth/LogoutConfirmation", self.sign_out)
+
+    def card(self, request):
+        """Credit card page with the download panel and statement list"""
+        formats = "".join(
+            '<li><a href="#" onclick="pickFormat(\'{}\', this); '
+            'return false;">{}</a></li>'.format(fmt, label)
+            for fmt, label in self.FORMATS)
+        statements = "".join(
+            '<li><a href="/statement.pdf?period={}">{:%B %d, %Y}</a></li>'
+            .format(sd.ym, self.statement_date(sd))
+            for sd in self.statements)
+        return self.page(request, "Credit Card", """
+            <script>
+            var format = "";
+            function pickFormat(fmt, item) {{
+                format = fmt;
+                document.getElementById("ddlFormatType-button").innerText =
+                    item.innerText;
+                hide("ddlFormatType-menu");
+            }}
+            function downloadTransactions() {{
+                location.href = "/export?fmt=" + format + "&from=" +
+                    encodeURIComponent(
+                        document.getElementById("FromDateInput").value) +
+                    "&to=" + encodeURIComponent(
+                        document.getElementById("ToDateInput").value);
+            }}
+            </script>
+            <div id="DownloadTransactionsLink">
+              <a href="#" onclick="show('panel'); return false;">
+                Download transactions</a></div>
+            <div id="myaccount_BCCreditCardViewOnlineStatements">
+              <a href="#" onclick="show('DocumentList'); return false;">
+                View statements</a></div>
+            <div id="panel" style="display: none">
+              <input id="FromDateInput"><input id="ToDateInput">
+              <a id="ddlFormatType-button" href="#"
+                 onclick="show('ddlFormatType-menu'); return false;">
+                Select a format</a>
+              <ul id="ddlFormatType-menu" style="display: none">{}</ul>
+              <a id="DTLLink" href="#"
+                 onclick="downloadTransactions(); return false;">Download</a>
+              <a id="lnkLASCancel" href="#"
+                 onclick="hide('panel'); return false;">Cancel</a>
+            </div>
+            <div id="DocumentList" style="display: none">
+              <ul><li><a href="#">Statement help</a></li>{}</ul>
+            </div>""".format(formats, statements))
+
+    def export_range(self, request):
+        """Export of the statement closing at the end of a date range"""
+        try:
+            end = datetime.datetime.strptime(request.query.get("to", ""),
+                                             "%m/%d/%Y")
+        except ValueError:
+            return 400, {"Content-Type": "text/plain"}, b"bad date range"
+        sd = StatementDate.from_datetime(end)
+        return self.attachment(request, sd if sd in self.statements else None,
+                               request.query.get("fmt"))
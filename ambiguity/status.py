@@ -0,0 +1,43 @@
+"""Summaries of the library's coverage, from the library indexes alone"""
+from collections import namedtuple
+
+from ambiguity.planner import iter_bits
+from ambiguity.statement_date import StatementDate
+
+AccountStatus = namedtuple(
+    "AccountStatus", ["name", "acct_type", "active", "statements", "latest",
+                      "missing", "oldest_missing", "formats"])
+
+
+def account_status(acct, today=None):
+    """Return the AccountStatus of an account: how many statements it has
+    filed and the latest, and how many are missing in any format, the
+    oldest of them and the formats missing"""
+    missing = acct.missing_masks(today)
+    months = 0
+    for mask in missing.values():
+        months |= mask
+    oldest = next(iter_bits(months), None)
+    filed = [sd for sd, fmts in acct.library.items() if fmts]
+    return AccountStatus(
+        acct.name, type(acct).__name__, acct.active, len(filed),
+        max(filed) if filed else None, bin(months).count("1"),
+        StatementDate.from_ym(oldest) if oldest is not None else None,
+        sorted(missing))
+
+
+def format_status(statuses):
+    """Return AccountStatuses as a table, one line per account"""
+    rows = [("ACCOUNT", "TYPE", "FILED", "LATEST", "MISSING", "SINCE",
+             "FORMATS")]
+    for status in statuses:
+        rows.append((
+            status.name, status.acct_type, str(status.statements),
+            repr(status.latest) if status.latest else "-",
+            str(status.missing) if status.active else "inactive",
+            repr(status.oldest_missing) if status.oldest_missing else "-",
+            ",".join(status.formats) or "-"))
+    widths = [max(len(row[col]) for row in rows)
+              for col in range(len(rows[0]))]
+    return "\n".join("  ".join(cell.ljust(width) for cell, width in zip(
+        row, widths)).rstrip() for row in rows)
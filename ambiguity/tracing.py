@@ -0,0 +1,132 @@
+"""Timed, nested spans of a pull exported in the Chrome trace format"""
+from collections import defaultdict
+import contextlib
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+
+# Arguments of the innermost open span, inherited by the spans inside it
+_CONTEXT = contextvars.ContextVar("trace_context", default=None)
+
+_TRACER = None
+
+
+class Tracer(object):
+    """Collects complete ("X") and instant ("i") trace events that can be
+    opened in chrome://tracing or Perfetto. Every span also records its self
+    time, the part of its duration not spent in nested spans"""
+
+    def __init__(self):
+        self.events = []
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, name, **args):
+        """Record the time spent inside the block as a span. Arguments such
+        as account, statement date and format carry over to nested spans"""
+        parent = _CONTEXT.get()
+        ctx = {"args": dict(parent["args"] if parent else {}, **args),
+               "child_us": 0}
+        token = _CONTEXT.set(ctx)
+        ts = time.time() * 1e6
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            dur = (time.perf_counter() - start) * 1e6
+            _CONTEXT.reset(token)
+            if parent is not None:
+                parent["child_us"] += dur
+            event_args = {k: str(v) for k, v in ctx["args"].items()}
+            event_args["self_us"] = round(dur - ctx["child_us"])
+            self._add({"name": name, "ph": "X", "ts": ts, "dur": dur,
+                       "args": event_args})
+
+    def instant(self, name, **args):
+        """Record a point in time, like a statement being filed"""
+        parent = _CONTEXT.get()
+        merged = dict(parent["args"] if parent else {}, **args)
+        self._add({"name": name, "ph": "i", "s": "t",
+                   "ts": time.time() * 1e6,
+                   "args": {k: str(v) for k, v in merged.items()}})
+
+    def _add(self, event):
+        """Stamp an event with its process and thread and keep it"""
+        event.update(cat="ambiguity", pid=os.getpid(),
+                     tid=threading.get_ident())
+        with self.lock:
+            self.events.append(event)
+
+    def write(self, path):
+        """Write the events as a Chrome trace JSON file"""
+        path.write_text(json.dumps({"traceEvents": self.events}))
+
+    def breakdown(self):
+        """Return a plain-text table of the self time of each kind of span,
+        per account"""
+        totals = defaultdict(lambda: defaultdict(lambda: [0.0, 0]))
+        for event in self.events:
+            if event["ph"] != "X":
+                continue
+            account = event["args"].get("account", "(all accounts)")
+            total = totals[account][event["name"]]
+            total[0] += event["args"]["self_us"] / 1e6
+            total[1] += 1
+        lines = []
+        for account in sorted(totals):
+            spans = totals[account]
+            lines.append("{}: {:.2f}s".format(
+                account, sum(secs for secs, _ in spans.values())))
+            for name, (secs, count) in sorted(
+                    spans.items(), key=lambda item: -item[1][0]):
+                lines.append("    {:<20} {:>9.2f}s  x{}".format(
+                    name, secs, count))
+        return "\n".join(lines)
+
+
+def enable():
+    """Start recording spans with a fresh tracer and return it"""
+    global _TRACER  # pylint: disable=global-statement
+    _TRACER = Tracer()
+    return _TRACER
+
+
+def disable():
+    """Stop recording spans, returning the tracer that was recording"""
+    global _TRACER  # pylint: disable=global-statement
+    tracer, _TRACER = _TRACER, None
+    return tracer
+
+
+def tracer():
+    """Return the recording tracer, or None if tracing is off"""
+    return _TRACER
+
+
+def span(name, **args):
+    """Context manager recording a span if tracing is on"""
+    if _TRACER is None:
+        return contextlib.nullcontext()
+    return _TRACER.span(name, **args)
+
+
+def instant(name, **args):
+    """Record an instant event if tracing is on"""
+    if _TRACER is not None:
+        _TRACER.instant(name, **args)
+
+
+def traced(name):
+    """Decorator recording each call of the function as a span"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _TRACER is None:
+                return func(*args, **kwargs)
+            with _TRACER.span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -1,25 +1,79 @@
 """Some miscellaneous utilities"""
-import signal
+import contextvars
+import logging
+import time
 
+LOG = logging.getLogger(__name__)
 
-class Timeout:  # pylint: disable=too-few-public-methods
-    """Context manager to raise a TimeoutError exception if it isn't exited
-    after some amount of time"""
+_CURRENT_DEADLINE = contextvars.ContextVar("deadline", default=None)
+
+
+class Deadline:
+    """Context manager bounding how long the waits inside it may take.
+    Works in any thread or asyncio task, takes fractional seconds and nests,
+    an inner deadline never outliving the one around it. Waits call check(),
+    sleep() or wait_until() to get a TimeoutError once it has passed"""
 
     def __init__(self, seconds=10, error_message='Timeout'):
         self.seconds = seconds
         self.error_message = error_message
-
-    def handle_timeout(self, *_args):
-        """Callback when the time has elapsed"""
-        raise TimeoutError(self.error_message)
+        self.limit = self
+        self.started = None
+        self.expires = None
+        self.elapsed = None
+        self._token = None
 
     def __enter__(self):
-        signal.signal(signal.SIGALRM, self.handle_timeout)
-        signal.alarm(self.seconds)
+        self.started = time.monotonic()
+        self.expires = self.started + self.seconds
+        parent = _CURRENT_DEADLINE.get()
+        if parent is not None and parent.expires < self.expires:
+            self.limit = parent.limit
+            self.expires = parent.expires
+        self._token = _CURRENT_DEADLINE.set(self)
+        return self
 
     def __exit__(self, *_args):
-        signal.alarm(0)
+        _CURRENT_DEADLINE.reset(self._token)
+        self.elapsed = time.monotonic() - self.started
+        LOG.debug("Waited %.3fs of %.3fs: %s", self.elapsed, self.seconds,
+                  self.error_message)
+
+    @property
+    def remaining(self):
+        """Seconds left before the deadline passes"""
+        return max(0.0, self.expires - time.monotonic())
+
+    def check(self):
+        """Raise a TimeoutError if the deadline has passed"""
+        if time.monotonic() >= self.expires:
+            raise TimeoutError(self.limit.error_message)
+
+    def sleep(self, seconds):
+        """Sleep, but no later than the deadline"""
+        self.check()
+        time.sleep(min(seconds, self.remaining))
+
+    async def async_sleep(self, seconds):
+        """Sleep in an asyncio task, but no later than the deadline"""
+        import asyncio
+        self.check()
+        await asyncio.sleep(min(seconds, self.remaining))
+
+    def wait_until(self, predicate, interval=0.1):
+        """Poll predicate until it returns something truthy and return it"""
+        result = predicate()
+        while not result:
+            self.sleep(interval)
+            result = predicate()
+        return result
+
+
+def wait_until(predicate, seconds=10, error_message='Timeout', interval=0.1):
+    """Poll predicate until it returns something truthy and return it, or
+    raise a TimeoutError after some amount of time"""
+    with Deadline(seconds, error_message) as deadline:
+        return deadline.wait_until(predicate, interval)
 
 
 class Namespace:  # pylint: disable=too-few-public-methods
@@ -16,23 +16,29 @@ setup(
         "Development Status :: 2 - Pre-Alpha",
         "Natural Language :: English",
         "License :: OSI Approved :: MIT License",
-        "Programming Language :: Python :: 3 :: Only"
-        "Programming Language :: Python :: 3.5",
-        "Programming Language :: Python :: 3.6",
+        "Programming Language :: Python :: 3 :: Only",
+        "Programming Language :: Python :: 3.8",
         "Topic :: Office/Business :: Financial :: Accounting",
     ],
     keywords="personal finance accounting",
+    python_requires=">=3.8",
     packages=find_packages(exclude=['contrib', 'docs', 'tests*']),
     install_requires=[
         "pykeepass",
         "selenium==4.0.0a3",
         "pypdf2===1.26.0",
         "PyYAML==3.12",
+        "urllib3",
     ],
     entry_points={
         "console_scripts": [
             "ambi-pull=ambiguity.command_line:pull",
-            "ambi-scd=ambiguity.command_line:open_scd"
+            "ambi-scd=ambiguity.command_line:open_scd",
+            "ambi-daemon=ambiguity.command_line:browser_daemon",
+            "ambi-bench=ambiguity.command_line:bench",
+            "ambi-export=ambiguity.command_line:export",
+            "ambi-query=ambiguity.command_line:query",
+            "ambi-status=ambiguity.command_line:status"
         ],
     }
 )
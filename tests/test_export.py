@@ -0,0 +1,66 @@
+"""Tests of exporting the library to beancount"""
+import datetime
+from pathlib import Path
+import tempfile
+import unittest
+
+from ambiguity.account.mitfcu import MITFCU
+from ambiguity.export import BeancountExporter
+
+
+class BeancountExporterTest(unittest.TestCase):
+    """Overlapping statements export each transaction once"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name)
+        self.lib_dir = self.dir / "library" / "checking"
+        self.write(1, ["01/02/2020,-3.50,COFFEE", "01/20/2020,-40.00,GROCER"])
+        self.write(2, ["01/20/2020,-40.00,GROCER", "02/03/2020,-3.50,COFFEE"])
+        self.exporter = BeancountExporter(self.dir / "beancount")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, month, rows):
+        """File a csv statement of a month, replacing any before"""
+        path = self.lib_dir / "csv" / "checking_2020_0{}.csv".format(month)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.dir / "statement.csv"
+        tmp_path.write_text("Date,Amount,Description\n" + "\n".join(rows) +
+                            "\n")
+        tmp_path.replace(path)
+
+    def export(self):
+        """Export the library, returning the counts and ledger files"""
+        acct = MITFCU("0001", "Checking", name="checking",
+                      open_date=datetime.date(2019, 12, 1),
+                      lib_dir=self.lib_dir)
+        counts = self.exporter.export([acct])
+        return counts, {
+            path.name: path.read_text()
+            for path in (self.dir / "beancount" / "checking").iterdir()}
+
+    def test_overlap_written_once(self):
+        counts, ledger = self.export()
+        self.assertEqual(counts, (2, 0, 0))
+        self.assertEqual(ledger["2020-01.beancount"].count("GROCER"), 1)
+        self.assertNotIn("GROCER", ledger["2020-02.beancount"])
+        self.assertIn("COFFEE", ledger["2020-02.beancount"])
+
+    def test_changed_statement_rewrites_later_ones(self):
+        self.export()
+        self.assertEqual(self.export()[0], (0, 2, 0))
+        self.write(1, ["01/02/2020,-3.50,COFFEE"])
+        counts, ledger = self.export()
+        self.assertEqual(counts, (2, 0, 0))
+        self.assertIn("GROCER", ledger["2020-02.beancount"])
+
+    def test_no_accounts(self):
+        self.assertEqual(self.exporter.export([]), (0, 0, 0))
+        self.assertTrue((self.dir / "beancount" /
+                         BeancountExporter.MAIN_FILE).exists())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+"""Tests of fetching exports over the browser's session, against the
+stand-in server"""
+from pathlib import Path
+import tempfile
+import unittest
+from unittest import mock
+
+from ambiguity.standin import StandinServer
+
+try:
+    import urllib3
+except ImportError:  # The fetcher's only dependency outside the stdlib
+    urllib3 = None
+
+
+@unittest.skipIf(urllib3 is None, "urllib3 is not installed")
+class SessionFetcherTest(unittest.TestCase):
+    """SessionFetcher downloads what a logged in browser would"""
+
+    def setUp(self):
+        from ambiguity.fetch import SessionFetcher
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name)
+        self.server = StandinServer(cookie="sid=s3cret")
+        self.server.route("/statement.csv", "Date,Amount\n", "text/csv")
+        self.server.start()
+        self.fetcher = SessionFetcher([
+            {"name": "sid", "value": "s3cret", "domain": "127.0.0.1"}])
+
+    def tearDown(self):
+        self.fetcher.pool.clear()
+        self.server.stop()
+        self.tmp.cleanup()
+
+    def redirect(self, path, location):
+        """Redirect requests for path to location"""
+        self.server.route(path, lambda request: (
+            302, {"Location": location}, b""))
+
+    def test_cookies_follow_redirects_on_the_same_host(self):
+        self.redirect("/export", "/statement.csv")
+        dest = self.fetcher.fetch(self.server.url("/export"),
+                                  self.dir / "a.csv")
+        self.assertEqual(dest.read_text(), "Date,Amount\n")
+
+    def test_cookies_stay_behind_on_another_host(self):
+        cookies = []
+        with StandinServer() as other:
+            other.route("/file.csv", lambda request: cookies.append(
+                request.cookies) or (200, {"Content-Type": "text/csv"}, b"x"))
+            # The cookie is host-only for 127.0.0.1
+            self.redirect("/export", "http://localhost:{}/file.csv".format(
+                other.port))
+            self.fetcher.fetch(self.server.url("/export"), self.dir / "a.csv")
+        self.assertEqual(cookies, [{}])
+
+    def test_login_page_is_rejected(self):
+        self.fetcher.cookies = []
+        dest = self.dir / "a.csv"
+        with self.assertRaises(IOError):
+            self.fetcher.fetch(self.server.url("/statement.csv"), dest)
+        self.assertEqual(list(self.dir.iterdir()), [])
+
+    def test_fetch_all_reports_each_job(self):
+        self.fetcher.cookies = []
+        results = self.fetcher.fetch_all([
+            (self.server.url("/statement.csv"), self.dir / "a.csv")])
+        self.assertIsInstance(results[0], IOError)
+
+    def test_download_renamed_once_complete(self):
+        dest = self.dir / "a.csv"
+        self.fetcher.fetch(self.server.url("/statement.csv"), dest)
+        self.assertEqual(sorted(path.name for path in self.dir.iterdir()),
+                         ["a.csv"])
+
+    def test_interrupted_download_leaves_no_statement(self):
+        def stream(_response, _amount):
+            yield b"Date,"
+            raise urllib3.exceptions.ProtocolError("connection lost")
+        dest = self.dir / "a.csv"
+        with mock.patch.object(urllib3.response.HTTPResponse, "stream",
+                               stream):
+            with self.assertRaises(urllib3.exceptions.ProtocolError):
+                self.fetcher.fetch(self.server.url("/statement.csv"), dest)
+        self.assertFalse(dest.exists())
+        self.assertEqual((self.dir / "a.csv.part").read_bytes(), b"Date,")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,157 @@
+"""Tests of filing statements into the library and resuming pulls"""
+import argparse
+import datetime
+from pathlib import Path
+import tempfile
+import unittest
+
+from ambiguity.account_manager import AccountManager
+from ambiguity.journal import PullJournal
+from ambiguity.library_index import FilingError, LibraryIndex
+from ambiguity.planner import PlannedAccount, PullPlan, format_masks
+from ambiguity.statement_date import StatementDate
+
+CSV = b"Date,Amount,Description\n01/02/2020,-3.50,COFFEE\n"
+
+
+class LibraryTestCase(unittest.TestCase):
+    """Runs each test in a library of its own"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name)
+        self.lib_dir = self.dir / "library" / "acct"
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def download(self, data=CSV, name="download.csv"):
+        """Write a downloaded file, return its path"""
+        path = self.dir / name
+        path.write_bytes(data)
+        return path
+
+    def dest(self, sd, fmt="csv"):
+        """Return the library path of a statement, its folder created"""
+        path = self.lib_dir / fmt / "acct_{}_{:02}.{}".format(
+            sd.year, sd.month, fmt)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return path
+
+
+class LibraryIndexTest(LibraryTestCase):
+    """Statements are staged, then committed into the index atomically"""
+
+    def index(self):
+        """Return a freshly loaded LibraryIndex of the account"""
+        index = LibraryIndex(self.lib_dir, "acct")
+        index.load()
+        return index
+
+    def test_stage_then_commit(self):
+        index = self.index()
+        dest = self.dest(StatementDate(2020, 1))
+        staged = index.stage(self.download(), dest)
+        self.assertEqual(staged.path.parent, self.lib_dir)
+        self.assertFalse(dest.exists())
+        index.commit(staged, dest, verify=True)
+        self.assertEqual(dest.read_bytes(), CSV)
+        self.assertFalse(staged.path.exists())
+        self.assertEqual(dict(self.index().library),
+                         {StatementDate(2020, 1): {"csv"}})
+
+    def test_changed_staged_file_is_refused(self):
+        index = self.index()
+        dest = self.dest(StatementDate(2020, 1))
+        staged = index.stage(self.download(), dest)
+        staged.path.write_bytes(CSV.replace(b"3.50", b"9.99"))
+        with self.assertRaises(FilingError):
+            index.commit(staged, dest, verify=True)
+        self.assertFalse(dest.exists())
+
+    def test_web_page_is_refused(self):
+        with self.assertRaises(FilingError):
+            self.index().stage(self.download(b"<!DOCTYPE html><html>"),
+                               self.dest(StatementDate(2020, 1)))
+
+    def test_stale_index_rescans_changed_folders(self):
+        self.index().file(self.download(), self.dest(StatementDate(2020, 1)))
+        # Filed by hand, behind the index's back
+        self.dest(StatementDate(2020, 2)).write_bytes(CSV)
+        self.assertEqual(set(self.index().library),
+                         {StatementDate(2020, 1), StatementDate(2020, 2)})
+
+    def test_broken_index_is_rebuilt(self):
+        self.index().file(self.download(), self.dest(StatementDate(2020, 1)))
+        (self.lib_dir / LibraryIndex.FILE_NAME).write_text('{"version": 1, ')
+        self.assertEqual(set(self.index().library), {StatementDate(2020, 1)})
+
+    def test_rewrite_leaves_no_temporary_files(self):
+        index = self.index()
+        index.file(self.download(), self.dest(StatementDate(2020, 1)))
+        self.assertEqual(sorted(path.name for path in self.lib_dir.iterdir()
+                                if path.is_file()), [LibraryIndex.FILE_NAME])
+
+
+class PullJournalTest(LibraryTestCase):
+    """A pull cut short is resumed from its journal"""
+
+    def setUp(self):
+        super().setUp()
+        self.manager = AccountManager(argparse.Namespace(
+            credential_provider={"provider_type": "stdin"},
+            library_dir=str(self.dir / "library"),
+            chrome_download_dir=str(self.dir / "downloads"),
+            chrome_profile_dir=str(self.dir / "profile"),
+            accounts=[{"acct_type": "MITFCU", "name": "acct",
+                       "subaccount": "0001", "description": "Checking",
+                       "open_date": datetime.date(2019, 12, 15)}]))
+        [self.acct] = self.manager.accounts
+        self.journal = self.manager.journal
+        self.statements = {StatementDate(2020, 1): {"csv"},
+                           StatementDate(2020, 2): {"csv"}}
+        plan = PullPlan()
+        plan.add(self.acct.session_key, PlannedAccount(
+            "acct", "MITFCU", format_masks(self.statements)))
+        self.journal.start(plan)
+
+    def stage(self, sd):
+        """Stage a download of a statement and journal it, the way a pull
+        interrupted before filing it leaves it"""
+        staged = self.acct.index.stage(self.download(), self.dest(sd))
+        self.journal.record("acct", sd, "csv", "downloaded", staged)
+        return staged
+
+    def test_states_skip_a_torn_line(self):
+        sd = StatementDate(2020, 1)
+        self.journal.record("acct", sd, "csv", "filed")
+        with self.journal.path.open("a") as fout:
+            fout.write('{"acct": "acct", "sd": "2020-02", "fm')
+        self.assertEqual(
+            [(key, record["state"])
+             for key, record in self.journal.pending().items()],
+            [(("acct", StatementDate(2020, 2), "csv"), "planned")])
+
+    def test_resume_files_what_was_downloaded(self):
+        self.stage(StatementDate(2020, 1))
+        plan = self.manager.resume_plan(self.journal)
+        self.assertIn(StatementDate(2020, 1), self.acct.library)
+        self.assertEqual(plan.statements("acct"),
+                         {StatementDate(2020, 2): {"csv"}})
+        self.assertEqual(list(self.journal.pending()),
+                         [("acct", StatementDate(2020, 2), "csv")])
+
+    def test_starting_over_files_or_discards_staged(self):
+        self.stage(StatementDate(2020, 1))
+        changed = self.stage(StatementDate(2020, 2))
+        changed.path.write_bytes(CSV + b"01/03/2020,-1.00,TEA\n")
+        remaining = self.manager.file_downloaded(self.journal, discard=True)
+        self.assertIn(StatementDate(2020, 1), self.acct.library)
+        self.assertEqual(remaining,
+                         {"acct": {StatementDate(2020, 2): {"csv"}}})
+        self.assertFalse(changed.path.exists())
+        self.assertEqual(list(self.lib_dir.glob(".*.staged")), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
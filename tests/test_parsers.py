@@ -0,0 +1,202 @@
+"""Tests of the statement parsers"""
+import datetime
+from pathlib import Path
+import tempfile
+import unittest
+import zipfile
+
+from ambiguity.parsers.dedup import DedupTable
+from ambiguity.parsers.engine import StatementFile, parse_files
+from ambiguity.parsers.formats import ParseError, Parser, XLSXParser
+from ambiguity.parsers.query import TransactionIndex
+from ambiguity.parsers.store import TransactionStore
+from ambiguity.parsers.table import TransactionTable
+from ambiguity.statement_date import StatementDate
+
+
+class XLSXParserTest(unittest.TestCase):
+    """Broken spreadsheets raise ParseError instead of escaping parsing"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def spreadsheet(self, sheet):
+        """Write a spreadsheet archive with a first sheet, return its path"""
+        path = self.dir / "acct_2020_01.xlsx"
+        with zipfile.ZipFile(str(path), "w") as archive:
+            archive.writestr("xl/worksheets/sheet1.xml", sheet)
+        return path
+
+    def test_broken_sheet_xml(self):
+        path = self.spreadsheet("<worksheet><sheetData><row>")
+        with self.assertRaises(ParseError):
+            list(XLSXParser().parse(path))
+
+    def test_missing_sheet(self):
+        path = self.dir / "acct_2020_01.xlsx"
+        with zipfile.ZipFile(str(path), "w") as archive:
+            archive.writestr("xl/workbook.xml", "<workbook/>")
+        with self.assertRaises(ParseError):
+            list(XLSXParser().parse(path))
+
+    def test_truncated_archive(self):
+        path = self.spreadsheet("<worksheet/>")
+        path.write_bytes(path.read_bytes()[:20])
+        with self.assertRaises(ParseError):
+            list(XLSXParser().parse(path))
+
+    def test_parse_files_reports_broken_sheet(self):
+        path = self.spreadsheet("<worksheet><sheetData><row>")
+        statement = StatementFile("MITFCUVisa", "acct", StatementDate(2020, 1),
+                                  path, "0" * 64)
+        [result] = parse_files([statement])
+        self.assertIsInstance(result, ParseError)
+
+    def test_delimited_text_under_spreadsheet_name(self):
+        path = self.dir / "acct_2020_01.xlsx"
+        path.write_text("Date,Amount,Description\n01/02/2020,-3.50,COFFEE\n")
+        [(date, cents, payee, _memo)] = list(XLSXParser().parse(path))
+        self.assertEqual((date.day, cents, payee), (2, -350, "COFFEE"))
+
+
+class EmptyStatementTest(unittest.TestCase):
+    """Empty files filed for statements without transactions parse empty"""
+
+    def test_empty_statement(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "acct_2020_01.csv"
+            path.write_bytes(b"")
+            statement = StatementFile("BoA", "acct", StatementDate(2020, 1),
+                                      path, "0" * 64)
+            [rows] = parse_files([statement])
+        self.assertEqual((len(rows.date), rows.strings), (0, []))
+
+
+class StoreIndexTest(unittest.TestCase):
+    """The store's saved index answers like one over a DedupTable"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name)
+        self.store = TransactionStore(self.dir / "store")
+        self.add(1, ["01/02/2020,-3.50,COFFEE", "01/02/2020,-3.50,COFFEE",
+                     "01/20/2020,-40.00,GROCER"])
+        self.add(2, ["01/20/2020,-40.00,GROCER", "02/03/2020,-3.50,COFFEE",
+                     "02/10/2020,1000.00,PAYROLL"])
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def add(self, month, rows):
+        """Store a statement of a month with csv rows"""
+        path = self.dir / "acct_2020_0{}.csv".format(month)
+        path.write_text("Date,Amount,Description\n" + "\n".join(rows) + "\n")
+        self.store.add(StatementFile("BoA", "acct", StatementDate(2020, month),
+                                     path, str(month) * 64))
+
+    def test_matches_dedup_table(self):
+        index = TransactionIndex(self.store.table(["acct"], dedup=True))
+        saved = self.store.index(["acct"])
+        self.assertEqual(len(saved), 5)
+        for conditions in [dict(), dict(payee="coffee"), dict(high=-10),
+                           dict(accounts=["acct"],
+                                start=datetime.date(2020, 1, 15),
+                                end=datetime.date(2020, 2, 5)),
+                           dict(start=datetime.date(2020, 1, 15),
+                                end=datetime.date(2020, 2, 5))]:
+            self.assertEqual(saved.transactions(**conditions),
+                             index.transactions(**conditions))
+
+    def test_loads_until_partitions_change(self):
+        self.store.index(["acct"])
+        [path] = (self.dir / "store" / TransactionStore.INDEX_DIR).iterdir()
+        saved = path.stat().st_ino
+        self.assertEqual(len(self.store.index(["acct"])), 5)
+        self.assertEqual(path.stat().st_ino, saved)
+        self.add(3, ["03/01/2020,-7.00,COFFEE"])
+        self.assertEqual(len(self.store.index(["acct"])), 6)
+        self.assertNotEqual(path.stat().st_ino, saved)
+
+
+class FITIDTest(unittest.TestCase):
+    """OFX transactions keep their FITID, which dedup goes by"""
+
+    TRANSACTION = ("<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20200120<TRNAMT>-40.00"
+                   "<FITID>{}<NAME>{}</STMTTRN>")
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def statement(self, month, fmt, text):
+        """Write and parse a statement file, return its StatementRows"""
+        path = self.dir / "acct_2020_0{}.{}".format(month, fmt)
+        path.write_text(text)
+        [rows] = parse_files([StatementFile(
+            "BoA", "acct", StatementDate(2020, month), path, "0" * 64)])
+        return rows
+
+    def ofx(self, month, *transactions):
+        """Parse an OFX statement of (fitid, payee) transactions"""
+        return self.statement(month, "qfx", "".join(
+            self.TRANSACTION.format(*txn) for txn in transactions))
+
+    def test_fitid_and_unescaped_payee(self):
+        rows = self.ofx(1, ("T1", "AT&amp;T"))
+        self.assertEqual(rows.strings[rows.fitid[0]], "T1")
+        self.assertEqual(rows.strings[rows.payee[0]], "AT&T")
+
+    def test_same_fitid_merges_reworded_payees(self):
+        table = DedupTable()
+        table.extend_statement(self.ofx(1, ("T1", "GROCER #12")), "acct", "a")
+        table.extend_statement(self.ofx(2, ("T1", "THE GROCER")), "acct", "b")
+        self.assertEqual((len(table), table.duplicates), (1, 1))
+
+    def test_other_fitid_stays_apart(self):
+        table = DedupTable()
+        table.extend_statement(self.ofx(1, ("T1", "GROCER")), "acct", "a")
+        table.extend_statement(self.ofx(2, ("T2", "GROCER")), "acct", "b")
+        self.assertEqual(len(table), 2)
+
+    def test_merges_with_formats_without_ids(self):
+        table = DedupTable()
+        csv = self.statement(
+            1, "csv", "Date,Amount,Description\n01/20/2020,-40.00,GROCER\n")
+        table.extend_statement(csv, "acct", "a")
+        table.extend_statement(self.ofx(2, ("T1", "GROCER")), "acct", "b")
+        table.extend_statement(self.ofx(3, ("T1", "THE GROCER")), "acct",
+                               "c")
+        self.assertEqual(len(table), 1)
+        self.assertEqual(table.provenance(0), ["a", "b", "c"])
+
+    def test_extend_merges_tables(self):
+        first, second = TransactionTable(), TransactionTable()
+        first.extend_statement(self.ofx(1, ("T1", "GROCER #12")), "acct",
+                               "a")
+        second.extend_statement(self.ofx(2, ("T1", "THE GROCER"),
+                                         ("T2", "GROCER")), "acct", "b")
+        second.extend_statement(self.ofx(2, ("T3", "GROCER")), "other", "c")
+        table = DedupTable()
+        table.extend(first)
+        table.extend(second)
+        self.assertEqual([txn.source for txn in table], ["a", "b", "c"])
+        self.assertEqual(table.provenance(0), ["a", "b"])
+
+
+class ParserTest(unittest.TestCase):
+    """Parser is abstract"""
+
+    def test_parse_is_abstract(self):
+        with self.assertRaises(TypeError):
+            Parser()  # pylint: disable=abstract-class-instantiated
+
+
+if __name__ == "__main__":
+    unittest.main()
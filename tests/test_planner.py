@@ -0,0 +1,70 @@
+"""Tests of planning pulls with month bitmasks"""
+import datetime
+import itertools
+from pathlib import Path
+import tempfile
+import unittest
+
+from ambiguity.account.mitfcu import MITFCU
+from ambiguity.planner import expected_mask, iter_bits, missing_statements
+from ambiguity.statement_date import StatementDate
+
+OPEN_DATES = [datetime.date(2019, 1, 1), datetime.date(2019, 1, 14),
+              datetime.date(2019, 1, 15), datetime.date(2019, 1, 31),
+              datetime.date(2019, 12, 20)]
+TODAYS = [datetime.date(2019, 12, 31), datetime.date(2020, 1, 14),
+          datetime.date(2020, 1, 15), datetime.date(2020, 1, 16),
+          datetime.date(2021, 6, 1)]
+STATEMENT_DAYS = [1, 15, 28]
+
+
+def statement_dates(open_date, statement_day, today):
+    """Generate the expected StatementDates the way the planner did before
+    bitmasks, see Account.gen_statement_dates"""
+    start_sd = StatementDate.from_datetime(open_date)
+    end_sd = StatementDate.from_datetime(today)
+    extra_start_month = open_date.day < statement_day
+    extra_end_month = today.day > statement_day
+    for ym in range(start_sd.ym + 1 - int(extra_start_month),
+                    end_sd.ym + int(extra_end_month)):
+        yield StatementDate.from_ym(ym)
+
+
+class PlannerTest(unittest.TestCase):
+    """The bitmask planner plans what the date generator did"""
+
+    def test_expected_mask(self):
+        for open_date, statement_day, today in itertools.product(
+                OPEN_DATES, STATEMENT_DAYS, TODAYS):
+            self.assertEqual(
+                [StatementDate.from_ym(ym) for ym in iter_bits(
+                    expected_mask(open_date, statement_day, today))],
+                list(statement_dates(open_date, statement_day, today)),
+                (open_date, statement_day, today))
+
+    def test_missing_statements(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            lib_dir = Path(tmp) / "acct"
+            for ym, fmt in [("2019_03", "csv"), ("2019_04", "csv"),
+                            ("2019_04", "pdf"), ("2020_01", "pdf")]:
+                path = lib_dir / fmt / "acct_{}.{}".format(ym, fmt)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                path.write_bytes(b"%PDF-1.4" if fmt == "pdf" else b"Date\n")
+            for open_date, statement_day, today in itertools.product(
+                    OPEN_DATES[:2], STATEMENT_DAYS, TODAYS):
+                acct = MITFCU("0001", "Checking", name="acct",
+                              open_date=open_date, lib_dir=lib_dir,
+                              statement_day=statement_day,
+                              ignore={"2019-06": None, "2019-07": ["pdf"]})
+                expected = dict()
+                for sd in statement_dates(open_date, statement_day, today):
+                    fmts = acct.PULL_FMTS - acct.library[sd] - acct.ignore[sd]
+                    if fmts:
+                        expected[sd] = fmts
+                self.assertEqual(
+                    dict(missing_statements(acct.missing_masks(today))),
+                    expected, (open_date, statement_day, today))
+
+
+if __name__ == "__main__":
+    unittest.main()
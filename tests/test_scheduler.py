@@ -0,0 +1,114 @@
+"""Tests of the pull scheduler"""
+from collections import OrderedDict
+import unittest
+
+from ambiguity.planner import PlannedAccount, PullPlan, bit
+from ambiguity.scheduler import DEFAULT_LIMITS, Attempt, PullScheduler
+from ambiguity.statement_date import StatementDate
+
+
+class FakeClock(object):
+    """A clock that only moves when told to"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        """Move the clock on"""
+        self.now += seconds
+
+
+class FakeExecutor(object):
+    """Finishes each job a number of seconds of the FakeClock after it was
+    submitted, counting the calls to finished. Jobs that failing(job)
+    says so of when submitted fail"""
+
+    def __init__(self, clock, seconds, failing=lambda job: False):
+        self.clock = clock
+        self.seconds = seconds
+        self.failing = failing
+        self.running = dict()  # PullJob id: (clock done, PullJob, error)
+        self.calls = 0
+
+    def submit(self, job):
+        seconds = self.seconds
+        if callable(seconds):
+            seconds = seconds(job)
+        self.running[job.id] = (self.clock() + seconds, job,
+                                "down" if self.failing(job) else None)
+
+    def finished(self, timeout):
+        self.calls += 1
+        if self.calls > 1000:
+            raise AssertionError("finished() called in a busy loop")
+        done_at = min(done_at for done_at, _job, _error
+                      in self.running.values())
+        self.clock.sleep(min(timeout, max(0, done_at - self.clock())))
+        done = [(job_id, [Attempt(name, job.statements[name] if error else
+                                  OrderedDict(), error, False)
+                          for name in job.statements])
+                for job_id, (done_at, job, error) in self.running.items()
+                if done_at <= self.clock()]
+        for job_id, _attempts in done:
+            del self.running[job_id]
+        return done
+
+
+class PullSchedulerTest(unittest.TestCase):
+    """Jobs waiting on an institution's sessions don't spin the loop"""
+
+    def plan(self, jobs, institution="Bank", plan=None):
+        """Return a PullPlan of jobs at an institution, added to plan"""
+        plan = plan or PullPlan()
+        for idx in range(jobs):
+            name = "{}{}".format(institution.lower(), idx)
+            plan.add((institution, name), PlannedAccount(
+                name, institution, {"csv": bit(StatementDate(2020, 1))}))
+        return plan
+
+    def run_down(self, plan):
+        """Run a plan where Down fails before the clock reaches 20 and Slow
+        jobs take 100 seconds, returning the PullReport and the clock"""
+        clock = FakeClock()
+        limits = {None: DEFAULT_LIMITS._replace(interval=0.0),
+                  "Down": DEFAULT_LIMITS._replace(
+                      sessions=1, interval=0.0, failures=1, cooldown=30.0)}
+        scheduler = PullScheduler(plan, limits, clock=clock,
+                                  sleep=clock.sleep)
+        executor = FakeExecutor(
+            clock, lambda job: 100.0 if job.session_key[0] == "Slow" else 10.0,
+            lambda job: job.session_key[0] == "Down" and clock() < 20)
+        return scheduler.run(executor, slots=2), clock()
+
+    def test_sessions_cap_blocks(self):
+        clock = FakeClock()
+        limits = {None: DEFAULT_LIMITS._replace(sessions=1, interval=0.0)}
+        scheduler = PullScheduler(self.plan(3), limits, clock=clock,
+                                  sleep=clock.sleep)
+        executor = FakeExecutor(clock, 10.0)
+        report = scheduler.run(executor, slots=3)
+        self.assertEqual(len(report.by_state("pulled")), 3)
+        # One blocking call per second of the three jobs run one by one
+        self.assertLessEqual(executor.calls, 33)
+        self.assertEqual(clock(), 30.0)
+
+    def test_open_breaker_waits_for_cooldown(self):
+        report, _now = self.run_down(self.plan(
+            2, "Down", self.plan(1, "Slow")))
+        states = {task.name: state.state
+                  for task, state in report.tasks.items()}
+        self.assertEqual(states, {"slow0": "pulled", "down0": "failed",
+                                  "down1": "pulled"})
+
+    def test_open_breaker_skipped_when_nothing_is_left(self):
+        report, now = self.run_down(self.plan(2, "Down"))
+        self.assertEqual([task.name for task, _ in report.by_state("skipped")],
+                         ["down1"])
+        self.assertEqual(now, 10.0)
+
+
+if __name__ == "__main__":
+    unittest.main()